@@ -0,0 +1,56 @@
+"""
+Benchmarks for sftraintimes. Each module is runnable from the repository root, for example:
+
+    python -m benchmarks.bench_registry
+"""
+import time
+
+
+def measure(func, iterations):
+    """
+    Calls func repeatedly and records the wall-clock duration of each call.
+    :param func: A no-argument callable to time.
+    :param iterations: The number of calls to make.
+    :return: A list of durations in milliseconds.
+    """
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return samples
+
+
+def percentile(samples, fraction):
+    """
+    Gets a percentile from a list of samples using the nearest-rank method.
+    :param samples: A non-empty list of numbers.
+    :param fraction: The percentile as a fraction between 0 and 1 (ex: 0.99 for p99).
+    :return: The sample at the requested percentile.
+    """
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """
+    Summarizes a list of latency samples.
+    :param samples: A non-empty list of durations in milliseconds.
+    :return: A dict containing the sample count, mean, p50, p95 and p99.
+    """
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 0.50),
+        'p95': percentile(samples, 0.95),
+        'p99': percentile(samples, 0.99)
+    }
+
+
+def print_summary(name, samples):
+    """Prints a one-line latency summary for the given samples."""
+    summary = summarize(samples)
+    print('{:<40} n={count:<6} mean={mean:9.3f}ms p50={p50:9.3f}ms p95={p95:9.3f}ms p99={p99:9.3f}ms'.format(
+        name, **summary))
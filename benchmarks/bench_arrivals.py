@@ -0,0 +1,76 @@
+"""
+Compares holding upcoming arrivals as raw MonitoredStopVisit dicts against holding them as model.Arrival records: the
+memory each cached stop takes, and the time to get the next wait time from a cached stop.
+
+    python -m benchmarks.bench_arrivals --stops 3500
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from benchmarks import measure, print_summary
+from sftraintimes.feed import VISITS_KEY, iter_json_array, to_arrival
+from sftraintimes.tst.fakes import build_stop_monitoring_feed
+from sftraintimes.util import parse_datetime
+
+
+def _group_visits(body):
+    stops = {}
+    for visit in iter_json_array([body], VISITS_KEY):
+        stops.setdefault(visit['MonitoringRef'], []).append(visit)
+    return stops
+
+
+def _group_arrivals(body):
+    stops = {}
+    for visit in iter_json_array([body], VISITS_KEY):
+        stops.setdefault(visit['MonitoringRef'], []).append(to_arrival(visit))
+    for arrivals in stops.values():
+        arrivals.sort(key=lambda arrival: arrival.arrival_time)
+    return stops
+
+
+def _retained_memory_mb(build):
+    tracemalloc.start()
+    result = build()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained / 1024 / 1024
+
+
+def _wait_from_visits(visits, now):
+    arrival = parse_datetime(visits[0]['MonitoredVehicleJourney']['MonitoredCall']['AimedArrivalTime'])
+    return int((arrival.timestamp() - now) // 60)
+
+
+def _wait_from_arrivals(arrivals, now):
+    return int((arrivals[0].arrival_time - now) // 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=3500)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    body = build_stop_monitoring_feed(args.stops)
+    visits, visits_mb = _retained_memory_mb(lambda: _group_visits(body))
+    arrivals, arrivals_mb = _retained_memory_mb(lambda: _group_arrivals(body))
+    print('raw visit dicts: {:8.1f} KB per stop'.format(visits_mb * 1024 / len(visits)))
+    print('Arrival records: {:8.1f} KB per stop'.format(arrivals_mb * 1024 / len(arrivals)))
+    print('serialized for the shared cache tier: {} vs {} bytes per stop'.format(
+        len(json.dumps(next(iter(visits.values())))), len(json.dumps(next(iter(arrivals.values()))))))
+
+    stop_ids = list(visits)
+    now = time.time()
+    visit_iterator = iter(stop_ids * (args.iterations // len(stop_ids) + 1))
+    arrival_iterator = iter(stop_ids * (args.iterations // len(stop_ids) + 1))
+    print_summary('wait time from raw visits', measure(lambda: _wait_from_visits(visits[next(visit_iterator)], now),
+                                                       args.iterations))
+    print_summary('wait time from Arrivals', measure(
+        lambda: _wait_from_arrivals(arrivals[next(arrival_iterator)], now), args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Measures answering the static intents through the intent router with precomputed responses, against the previous
+if/elif dispatch that rebuilt each response with ResponseBuilder.
+
+    python -m benchmarks.bench_dispatch --iterations 100000
+"""
+import argparse
+
+from benchmarks import measure, print_summary
+from sftraintimes import handler
+from sftraintimes.util import ResponseBuilder
+
+
+def _on_intent_previous(request, session):
+    intent_name = request['intent']['name']
+    if intent_name in ('SetHomeStopByIdIntent', 'SetHomeStopIntent', 'GetNextTrainIntent'):
+        raise ValueError('Only the static intents are measured.')
+    elif intent_name == 'AMAZON.HelpIntent':
+        return ResponseBuilder(output_speech_text=handler.HELP_INTENT_MESSAGE,
+                               session_attributes=dict(session.get('attributes') or {})).build()
+    return ResponseBuilder(output_speech_text=handler.FALLBACK_INTENT_MESSAGE,
+                           session_attributes=dict(session.get('attributes') or {})).build()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    session = {'user': {'userId': 'userId'}, 'attributes': {'user': {'id': 'userId', 'homeStopId': '13996'}}}
+    for intent_name in ['AMAZON.HelpIntent', 'AMAZON.FallbackIntent']:
+        request = {'type': 'IntentRequest', 'intent': {'name': intent_name}}
+        print_summary('{} if/elif'.format(intent_name), measure(lambda: _on_intent_previous(request, session),
+                                                                 args.iterations))
+        print_summary('{} router'.format(intent_name), measure(lambda: handler.on_intent(request, session),
+                                                                args.iterations))
+
+    print_summary('LaunchRequest ResponseBuilder', measure(lambda: ResponseBuilder(
+        output_speech_text=handler.LAUNCH_INTENT_MESSAGE + handler.HELP_INTENT_MESSAGE).build(), args.iterations))
+    print_summary('LaunchRequest precomputed', measure(handler.handle_launch_request, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
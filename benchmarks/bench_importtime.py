@@ -0,0 +1,80 @@
+"""
+Measures what importing the Lambda entry point costs on a cold start, per module, using python -X importtime in a fresh
+interpreter for each run. Reports the cumulative import time of each sftraintimes module and of the third-party
+packages pulled in with it, and can save the numbers as a baseline and compare later runs against it.
+
+    python -m benchmarks.bench_importtime
+    python -m benchmarks.bench_importtime --save importtime.json
+    python -m benchmarks.bench_importtime --compare importtime.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks import percentile
+
+PROJECT_PACKAGE = 'sftraintimes'
+THIRD_PARTY_PACKAGES = ('boto3', 'botocore', 'urllib3', 'orjson')
+
+
+def _import_times(module):
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                               stderr=subprocess.PIPE, check=True)
+    times = {}
+    for line in completed.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def _is_tracked(name):
+    return name.split('.')[0] == PROJECT_PACKAGE or name in THIRD_PARTY_PACKAGES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='sftraintimes.handler', help='The module to import.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--save', help='A file to save the median import time of each module to.')
+    parser.add_argument('--compare', help='A file saved with --save to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='The fraction a module may be slower than its baseline before it is reported.')
+    args = parser.parse_args()
+
+    samples = {}
+    for _ in range(args.runs):
+        for name, milliseconds in _import_times(args.module).items():
+            if _is_tracked(name):
+                samples.setdefault(name, []).append(milliseconds)
+    medians = {name: percentile(times, 0.5) for name, times in samples.items()}
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    regressions = []
+    for name in sorted(medians, key=medians.get, reverse=True):
+        line = '{:<40} p50={:8.1f}ms'.format(name, medians[name])
+        if name in baseline:
+            change = medians[name] / baseline[name] - 1 if baseline[name] else 0
+            line += ' baseline={:8.1f}ms ({:+.0%})'.format(baseline[name], change)
+            if change > args.tolerance:
+                regressions.append(name)
+        print(line)
+    for name in sorted(set(baseline) - set(medians)):
+        print('{:<40} no longer imported (baseline={:.1f}ms)'.format(name, baseline[name]))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(medians, baseline_file, indent=2, sort_keys=True)
+    if regressions:
+        print('slower than baseline: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
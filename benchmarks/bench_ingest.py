@@ -0,0 +1,78 @@
+"""
+Measures the agency-wide StopMonitoring ingest: streaming the feed from a local 511 stand-in, building the per-stop
+snapshot, and looking a stop up in it, against the old approach of loading the whole document with json.loads.
+
+    python -m benchmarks.bench_ingest --stops 3500
+    python -m benchmarks.bench_ingest --fixture recorded_stop_monitoring.json
+"""
+import argparse
+import json
+import tracemalloc
+
+from benchmarks import measure, print_summary
+from sftraintimes.client import FiveElevenClient, HttpTransport
+from sftraintimes.feed import VISITS_KEY, StopSnapshot, iter_json_array
+from sftraintimes.tst.fakes import FakeFiveElevenServer, build_stop_monitoring_feed
+
+CHUNK_SIZE = 65536
+
+
+def _chunks(body):
+    return (body[index:index + CHUNK_SIZE] for index in range(0, len(body), CHUNK_SIZE))
+
+
+def _load_whole(body):
+    return json.loads(body.decode('utf-8-sig'))['ServiceDelivery']['StopMonitoringDelivery'][VISITS_KEY]
+
+
+def _peak_memory_mb(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=3500, help='The number of stops in the generated feed.')
+    parser.add_argument('--fixture', help='A recorded StopMonitoring response to use instead of a generated one.')
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.fixture:
+        with open(args.fixture, 'rb') as fixture_file:
+            body = fixture_file.read()
+    else:
+        body = build_stop_monitoring_feed(args.stops)
+    print('feed size: {:.1f} MB'.format(len(body) / 1024 / 1024))
+
+    print_summary('json.loads whole feed', measure(lambda: _load_whole(body), args.iterations))
+    print_summary('stream-parse feed', measure(lambda: list(iter_json_array(_chunks(body), VISITS_KEY)),
+                                               args.iterations))
+    print_summary('stream-parse and build snapshot', measure(
+        lambda: StopSnapshot.build(iter_json_array(_chunks(body), VISITS_KEY), 0), args.iterations))
+
+    print('peak memory, json.loads then build: {:.1f} MB'.format(
+        _peak_memory_mb(lambda: StopSnapshot.build(_load_whole(body), 0))))
+    print('peak memory, streamed build:        {:.1f} MB'.format(
+        _peak_memory_mb(lambda: StopSnapshot.build(iter_json_array(_chunks(body), VISITS_KEY), 0))))
+
+    with FakeFiveElevenServer(routes={'/transit/StopMonitoring': body}) as server:
+        transport = HttpTransport(read_timeout=30)
+        client = FiveElevenClient('key', transport=transport, base_url=server.base_url)
+        print_summary('ingest over HTTP', measure(lambda: StopSnapshot.build(client.iter_agency_stop_visits('SF'), 0),
+                                                  args.iterations))
+        transport.close()
+
+    snapshot = StopSnapshot.build(iter_json_array(_chunks(body), VISITS_KEY), 0)
+    serialized = snapshot.to_bytes()
+    stop_ids = list(snapshot.stops)
+    stop_iterator = iter(stop_ids * 1000)
+    print('snapshot size: {:.1f} MB for {} stops'.format(len(serialized) / 1024 / 1024, len(stop_ids)))
+    print_summary('load snapshot', measure(lambda: StopSnapshot.from_bytes(serialized), args.iterations))
+    print_summary('snapshot stop lookup', measure(lambda: snapshot.get_arrivals(next(stop_iterator)), 10000))
+
+
+if __name__ == '__main__':
+    main()
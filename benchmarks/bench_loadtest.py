@@ -0,0 +1,278 @@
+"""
+Replays recorded Alexa events against handler.handle_request at a configurable concurrency, and reports the latency
+percentiles of each intent with the calls it made to 511, DynamoDB and S3. 511 is a local FakeFiveElevenServer with
+injectable latency, slow responses and errors, and DynamoDB and S3 are in-memory stand-ins registered with
+config.REGISTRY.override. Results can be saved as a baseline, and later runs compared against it.
+
+Each worker is a separate process standing in for one warm Lambda container. Lambda runs one invocation per container
+at a time, and the handler keeps per-invocation state, such as the metrics invocation and the deadline, in module
+globals. Calls to each dependency are counted from the spans every invocation records.
+
+    python -m benchmarks.bench_loadtest --requests 2000 --concurrency 8
+    python -m benchmarks.bench_loadtest --latency 0.05 --slow-rate 0.05 --slow-latency 2 --error-rate 0.02
+    python -m benchmarks.bench_loadtest --save loadtest.json
+    python -m benchmarks.bench_loadtest --compare loadtest.json
+"""
+import argparse
+import glob
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from benchmarks import print_summary, summarize
+from sftraintimes import config, handler
+from sftraintimes.cache import DynamoDBCache, TieredCache
+from sftraintimes.client import FiveElevenClient
+from sftraintimes.feed import S3SnapshotStore
+from sftraintimes.metrics import MetricsRecorder
+from sftraintimes.patterns import S3PatternStore
+from sftraintimes.tst.fakes import FakeDynamoDBTable, FakeFiveElevenServer, FakeS3Client
+
+EVENTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'events')
+# GetNextTrainIntent is most of the skill's traffic; every other recorded event is replayed once per round.
+DEFAULT_WEIGHTS = {'get_next_train_intent': 4}
+BUCKET = 'sftraintimes-loadtest'
+HOME_STOP = {'homeStopId': '13996', 'homeStopLine': 'KJ', 'homeStopDirection': 'IB'}
+LINE_STOPS = {
+    'IB': [('13895', 'Church St & 18th St'), ('13996', 'Church St & 24th St'), ('14006', 'Church St & 30th St')],
+    'OB': [('14006', 'Church St & 30th St'), ('13997', 'Church St & 24th St'), ('13896', 'Church St & 18th St')]
+}
+UPSTREAM_SPAN_PREFIXES = ('HttpTransport.', 'UserDAO.', 'DynamoDBCache.', 'S3')
+ERROR_MESSAGE = 'Sorry, something went wrong.'
+OUTCOMES = ('ok', 'degraded', 'error')
+# Percentiles of sub-millisecond requests such as LaunchRequest move by more than any tolerance from run to run.
+MIN_REGRESSION_MS = 1.0
+
+
+class _Context:
+    """Stands in for the Lambda context object."""
+    def __init__(self, timeout_ms):
+        self._expires_at = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int(max(0.0, self._expires_at - time.monotonic()) * 1000)
+
+
+def _format_epoch(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+def _stop_monitoring(params):
+    now = int(time.time())
+    visits = [{
+        'MonitoringRef': params.get('stopCode'),
+        'MonitoredVehicleJourney': {
+            'LineRef': 'KJ',
+            'DirectionRef': 'IB',
+            'DestinationName': 'Embarcadero Station',
+            'VehicleRef': str(1500 + index),
+            'MonitoredCall': {'AimedArrivalTime': _format_epoch(now + minutes * 60),
+                              'ExpectedArrivalTime': _format_epoch(now + minutes * 60 + 30)}
+        }
+    } for index, minutes in enumerate((3, 12, 21))]
+    return json.dumps({'ServiceDelivery': {'StopMonitoringDelivery': {'MonitoredStopVisit': visits}}}).encode('utf-8')
+
+
+def _patterns(params):
+    patterns = [{
+        'DirectionRef': direction,
+        'PointsInSequence': {'StopPointInJourneyPattern': [
+            {'Order': str(order), 'Name': name, 'ScheduledStopPointRef': stop_id}
+            for order, (stop_id, name) in enumerate(stops, 1)
+        ]}
+    } for direction, stops in LINE_STOPS.items()]
+    return json.dumps({'journeyPatterns': patterns}).encode('utf-8')
+
+
+def _get_label(event):
+    request = event['request']
+    intent = request.get('intent')
+    if intent is None:
+        return request['type']
+    if request.get('dialogState'):
+        return '{}:{}'.format(intent['name'], request['dialogState'])
+    return intent['name']
+
+
+def _load_events(directory, weights):
+    events = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        with open(path) as event_file:
+            event = json.load(event_file)
+        name = os.path.splitext(os.path.basename(path))[0]
+        events.extend([(_get_label(event), event)] * weights.get(name, 1))
+    if not events:
+        raise ValueError('No recorded events found in {}.'.format(directory))
+    return events
+
+
+def _get_outcome(response):
+    text = response.get('response', {}).get('outputSpeech', {}).get('text', '')
+    if text == ERROR_MESSAGE:
+        return 'error'
+    if text.endswith(handler.STALE_ARRIVALS_CAVEAT) or text.endswith(handler.SCHEDULED_ARRIVALS_CAVEAT):
+        return 'degraded'
+    return 'ok'
+
+
+def _install_stand_ins(base_url, events, options, stream):
+    os.environ[config.API_KEY_VARIABLE] = 'loadtest'
+    s3_client = FakeS3Client(options['aws_latency'])
+    user_table = FakeDynamoDBTable(latency=options['aws_latency'])
+    for _, event in events:
+        user_id = event['session']['user']['userId']
+        user_table.items[user_id] = dict(HOME_STOP, id=user_id)
+    cache_table = FakeDynamoDBTable('StopCache-loadtest', latency=options['aws_latency'], hash_key='key')
+
+    config.reset()
+    config.REGISTRY.override('user_table', user_table)
+    config.REGISTRY.override('s3_client', s3_client)
+    config.REGISTRY.override('visit_cache', TieredCache(ttl=options['visit_cache_ttl'],
+                                                        shared=DynamoDBCache(cache_table)))
+    config.REGISTRY.override('snapshot_store', S3SnapshotStore(s3_client, BUCKET, config.SNAPSHOT_KEY))
+    config.REGISTRY.override('pattern_store', S3PatternStore(s3_client, BUCKET))
+    config.REGISTRY.override('five_eleven_client', FiveElevenClient(key_provider=config.get_api_key_provider(),
+                                                                    base_url=base_url))
+    config.REGISTRY.override('metrics_recorder', MetricsRecorder(stream=stream))
+
+
+def _replay(task):
+    """Replays a worker's share of the events in this process, after one warm-up pass that is not recorded."""
+    stream = io.StringIO()
+    _install_stand_ins(task['base_url'], task['warmup'] + task['events'], task['options'], stream)
+    logging.getLogger('log').setLevel(logging.DEBUG if task['options']['verbose'] else logging.CRITICAL)
+
+    results = []
+    started = None
+    for index, (label, event) in enumerate(task['warmup'] + task['events']):
+        if index == len(task['warmup']):
+            started = time.perf_counter()
+        request_started = time.perf_counter()
+        response = handler.handle_request(event, _Context(task['options']['timeout_ms']))
+        milliseconds = (time.perf_counter() - request_started) * 1000
+
+        document = json.loads(stream.getvalue().splitlines()[-1])
+        stream.seek(0)
+        stream.truncate()
+        if index < len(task['warmup']):
+            continue
+        spans = {name: len(values) for name, values in document.items()
+                 if isinstance(values, list) and name.startswith(UPSTREAM_SPAN_PREFIXES)}
+        results.append((label, milliseconds, _get_outcome(response), spans))
+
+    return {'results': results, 'elapsed': time.perf_counter() - started if started is not None else 0.0}
+
+
+def _summarize_label(results):
+    summary = summarize([milliseconds for _, milliseconds, _, _ in results])
+    summary['outcomes'] = {outcome: sum(1 for _, _, result, _ in results if result == outcome) for outcome in OUTCOMES}
+    upstream = {}
+    for _, _, _, spans in results:
+        for name, count in spans.items():
+            upstream[name] = upstream.get(name, 0) + count
+    summary['upstream'] = {name: count / len(results) for name, count in sorted(upstream.items())}
+    return summary
+
+
+def _compare(label, summary, baseline, tolerance):
+    regressions = []
+    for metric in ('p95', 'p99'):
+        change = summary[metric] - baseline[metric]
+        if change >= MIN_REGRESSION_MS and change > baseline[metric] * tolerance:
+            regressions.append('{} {} {:.1f}ms -> {:.1f}ms'.format(label, metric, baseline[metric], summary[metric]))
+    error_rate = summary['outcomes']['error'] / summary['count']
+    baseline_error_rate = baseline['outcomes']['error'] / baseline['count']
+    if error_rate > baseline_error_rate + 0.01:
+        regressions.append('{} errors {:.1%} -> {:.1%}'.format(label, baseline_error_rate, error_rate))
+    for name, calls in summary['upstream'].items():
+        baseline_calls = baseline['upstream'].get(name, 0)
+        if calls > baseline_calls * (1 + tolerance) and calls - baseline_calls >= 0.05:
+            regressions.append('{} {} {:.2f} -> {:.2f} per request'.format(label, name, baseline_calls, calls))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', default=EVENTS_DIRECTORY, help='A directory of recorded Alexa events (*.json).')
+    parser.add_argument('--weight', action='append', default=[], metavar='NAME=N',
+                        help='Replays the event file NAME.json N times per round (default: get_next_train_intent=4).')
+    parser.add_argument('--requests', type=int, default=1000, help='The number of events to replay.')
+    parser.add_argument('--concurrency', type=int, default=4, help='The number of containers replaying at once.')
+    parser.add_argument('--latency', type=float, default=0.03, help='Seconds each 511 call takes.')
+    parser.add_argument('--slow-rate', type=float, default=0, help='The fraction of 511 calls that are slow.')
+    parser.add_argument('--slow-latency', type=float, default=1.0, help='Seconds a slow 511 call takes.')
+    parser.add_argument('--error-rate', type=float, default=0, help='The fraction of 511 calls that answer 503.')
+    parser.add_argument('--aws-latency', type=float, default=0.005, help='Seconds each DynamoDB and S3 call takes.')
+    parser.add_argument('--visit-cache-ttl', type=float, default=TieredCache.DEFAULT_TTL)
+    parser.add_argument('--timeout-ms', type=int, default=6000, help='The Lambda timeout each request starts with.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='A file to save the results to as a baseline.')
+    parser.add_argument('--compare', help='A file saved with --save to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='The fraction p95, p99 or upstream calls may exceed the baseline before it is reported.')
+    parser.add_argument('--verbose', action='store_true', help='Shows the skill\'s own log output.')
+    args = parser.parse_args()
+
+    weights = dict(DEFAULT_WEIGHTS)
+    weights.update((name, int(count)) for name, count in (weight.split('=') for weight in args.weight))
+    events = _load_events(args.events, weights)
+    rng = random.Random(args.seed)
+    replayed = [events[index % len(events)] for index in range(args.requests)]
+    rng.shuffle(replayed)
+    warmup = list({label: (label, event) for label, event in events}.values())
+    options = {'aws_latency': args.aws_latency, 'visit_cache_ttl': args.visit_cache_ttl,
+               'timeout_ms': args.timeout_ms, 'verbose': args.verbose}
+
+    def latency():
+        return args.slow_latency if rng.random() < args.slow_rate else args.latency
+
+    routes = {'/transit/StopMonitoring': _stop_monitoring, '/transit/patterns': _patterns}
+    with FakeFiveElevenServer(routes=routes, latency=latency, error_rate=args.error_rate, seed=args.seed) as server:
+        tasks = [{'base_url': server.base_url, 'warmup': warmup, 'events': replayed[worker::args.concurrency],
+                  'options': options} for worker in range(args.concurrency)]
+        with multiprocessing.get_context('spawn').Pool(args.concurrency) as pool:
+            workers = pool.map(_replay, tasks)
+        request_count = server.request_count
+
+    by_label = {}
+    for worker in workers:
+        for result in worker['results']:
+            by_label.setdefault(result[0], []).append(result)
+    summaries = {label: _summarize_label(results) for label, results in sorted(by_label.items())}
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    regressions = []
+    for label, summary in summaries.items():
+        print_summary(label, [milliseconds for _, milliseconds, _, _ in by_label[label]])
+        print('    {}'.format(' '.join('{}={}'.format(outcome, summary['outcomes'][outcome]) for outcome in OUTCOMES)))
+        print('    calls per request: {}'.format(
+            ', '.join('{}={:.2f}'.format(name, calls) for name, calls in summary['upstream'].items()) or 'none'))
+        if label in baseline:
+            baseline_summary = baseline[label]
+            print('    baseline p50={p50:.3f}ms p95={p95:.3f}ms p99={p99:.3f}ms'.format(**baseline_summary))
+            regressions.extend(_compare(label, summary, baseline_summary, args.tolerance))
+
+    elapsed = max(worker['elapsed'] for worker in workers)
+    print('{} requests over {} containers in {:.1f}s ({:.0f} requests/s); 511 received {} requests including '
+          'warm-up'.format(args.requests, args.concurrency, elapsed, args.requests / elapsed if elapsed else 0,
+                           request_count))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(summaries, baseline_file, indent=2, sort_keys=True)
+    if regressions:
+        print('regressed from baseline:\n    ' + '\n    '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures StopMatcher lookup latency over a synthetic index roughly the size of every Muni stop.
+
+    python -m benchmarks.bench_matching --stops 3500
+"""
+import argparse
+import random
+
+from benchmarks import measure, print_summary
+from sftraintimes.matching import StopMatcher
+
+STREETS = ['church', 'market', 'mission', 'geary', 'valencia', 'ocean', 'taraval', 'judah', 'irving', 'noriega',
+           'duboce', 'castro', 'fillmore', 'divisadero', 'van ness', 'polk', 'larkin', 'hyde', 'jones', 'taylor',
+           'mason', 'powell', 'stockton', 'kearny', 'montgomery', 'sansome', 'battery', 'folsom', 'harrison',
+           'bryant', 'brannan', 'townsend', 'king', 'berry', 'carl', 'cole', 'west portal', 'san jose', 'sloat'] + \
+          ['{}th'.format(number) for number in range(4, 49)]
+SUFFIXES = ['st', 'ave', 'blvd', 'dr']
+
+
+def _build_stops(count, rng):
+    stops = {}
+    while len(stops) < count:
+        name = '{} {} & {} {}'.format(rng.choice(STREETS), rng.choice(SUFFIXES), rng.choice(STREETS),
+                                      rng.choice(SUFFIXES))
+        stops[name] = str(len(stops))
+    return stops
+
+
+def _mishear(name, rng):
+    position = rng.randrange(len(name))
+    return name[:position] + rng.choice('aeiou') + name[position + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=3500)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(511)
+    stops = _build_stops(args.stops, rng)
+    matcher = StopMatcher(stops)
+    queries = [_mishear(name, rng) for name in rng.sample(list(stops), min(200, len(stops)))]
+    query_iterator = iter(queries * (args.iterations // len(queries) + 1))
+
+    print_summary('exact name', measure(lambda: matcher.match(queries[0]), args.iterations))
+    print_summary('misheard name', measure(lambda: matcher.match(next(query_iterator)), args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Measures the overhead the tracing layer adds to a request: a timed call outside of a sampled invocation, a timed call
+inside one, and recording and writing a whole invocation with the spans a GetNextTrainIntent produces.
+
+    python -m benchmarks.bench_metrics --iterations 100000
+"""
+import argparse
+import io
+
+from benchmarks import measure, print_summary
+from sftraintimes.metrics import MetricsRecorder, span, timed
+
+SPAN_NAMES = ['S3KeySource.load', 'UserDAO.get_user', 'DynamoDBCache.get', 'HttpTransport.get',
+              'FiveElevenClient.parse_json', 'FiveElevenClient.get_real_time_stop_monitoring']
+
+
+def _call():
+    return None
+
+
+_timed_call = timed('UserDAO.get_user')(_call)
+
+
+def _record_invocation(recorder):
+    with recorder.invocation('GetNextTrainIntent'):
+        for name in SPAN_NAMES:
+            with span(name):
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    recorder = MetricsRecorder(stream=io.StringIO())
+    print_summary('plain call', measure(_call, args.iterations))
+    print_summary('timed call, not sampled', measure(_timed_call, args.iterations))
+    with recorder.invocation('GetNextTrainIntent'):
+        print_summary('timed call, sampled', measure(_timed_call, args.iterations))
+
+    recorder.stream = io.StringIO()
+    print_summary('invocation with {} spans'.format(len(SPAN_NAMES)),
+                  measure(lambda: _record_invocation(recorder), args.iterations // 10))
+
+
+if __name__ == '__main__':
+    main()
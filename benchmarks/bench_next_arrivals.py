@@ -0,0 +1,60 @@
+"""
+Measures StopService.get_next_arrivals for a user with several saved stops, against a local 511 stand-in with injected
+latency: stops loaded one after another, loaded concurrently, and served from the visit cache.
+
+    python -m benchmarks.bench_next_arrivals --stops 10 --latency 0.05
+"""
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import measure, print_summary
+from sftraintimes.cache import TieredCache
+from sftraintimes.client import FiveElevenClient, HttpTransport
+from sftraintimes.feed import VISITS_KEY, iter_json_array
+from sftraintimes.service import StopService
+from sftraintimes.tst.fakes import FakeFiveElevenServer, build_stop_monitoring_feed
+
+
+def _build_routes(stop_count):
+    visits_by_stop = {}
+    for visit in iter_json_array([build_stop_monitoring_feed(stop_count)], VISITS_KEY):
+        visits_by_stop.setdefault(visit['MonitoringRef'], []).append(visit)
+
+    def stop_monitoring(params):
+        visits = visits_by_stop.get(params.get('stopCode'), [])
+        return json.dumps({'ServiceDelivery': {'StopMonitoringDelivery': {VISITS_KEY: visits}}}).encode('utf-8')
+
+    return {'/transit/StopMonitoring': stop_monitoring}, list(visits_by_stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each 511 call takes.')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    routes, stop_ids = _build_routes(args.stops)
+    with FakeFiveElevenServer(routes=routes, latency=args.latency) as server, \
+            ThreadPoolExecutor(max_workers=args.stops) as executor:
+        transport = HttpTransport(pool_size=args.stops)
+        client = FiveElevenClient('key', transport=transport, base_url=server.base_url)
+        stop_service = StopService(client)
+
+        print_summary('{} stops, sequential'.format(args.stops),
+                      measure(lambda: stop_service.get_next_arrivals(stop_ids, limit=3), args.iterations))
+        print_summary('{} stops, concurrent'.format(args.stops),
+                      measure(lambda: stop_service.get_next_arrivals(stop_ids, limit=3, executor=executor),
+                              args.iterations))
+
+        stop_service.visit_cache = TieredCache(ttl=3600)
+        stop_service.get_next_arrivals(stop_ids, executor=executor)
+        print_summary('{} stops, cached'.format(args.stops),
+                      measure(lambda: stop_service.get_next_arrivals(stop_ids, limit=3, executor=executor),
+                              args.iterations * 50))
+        transport.close()
+
+
+if __name__ == '__main__':
+    main()
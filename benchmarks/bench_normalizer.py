@@ -0,0 +1,43 @@
+"""
+Compares util.normalize_street_name against the chain of substring checks it replaced.
+
+    python -m benchmarks.bench_normalizer
+"""
+import argparse
+
+from benchmarks import measure, print_summary
+from sftraintimes.util import _normalize_street_name, normalize_street_name
+
+STREET_NAMES = ['church street', 'twenty fourth street', 'ocean avenue', 'sunset boulevard', 'san jose drive',
+                'west portal avenue', 'duboce avenue', 'market street', 'sixteenth street', 'carl street']
+
+
+def _previous_parse_street(literal_street):
+    if 'street' in literal_street:
+        return literal_street.replace('street', 'st')
+    if 'avenue' in literal_street:
+        return literal_street.replace('avenue', 'ave')
+    if 'boulevard' in literal_street:
+        return literal_street.replace('boulevard', 'blvd')
+    if 'drive' in literal_street:
+        return literal_street.replace('drive', 'dr')
+
+
+def _run(func):
+    return lambda: [func(name) for name in STREET_NAMES]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    print('Each sample normalizes {} street names.'.format(len(STREET_NAMES)))
+    print_summary('previous parse_street', measure(_run(_previous_parse_street), args.iterations))
+    print_summary('normalize_street_name (uncached)', measure(_run(_normalize_street_name.__wrapped__),
+                                                              args.iterations))
+    print_summary('normalize_street_name (memoized)', measure(_run(normalize_street_name), args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Measures parse time and peak memory of FiveElevenClient._parse_json on a large journey patterns payload, against the
+previous decode-then-slice-then-json.loads approach.
+
+    python -m benchmarks.bench_parse_json --patterns 400
+"""
+import argparse
+import json
+import random
+import tracemalloc
+from unittest.mock import patch
+
+from benchmarks import measure, print_summary
+from sftraintimes import client
+from sftraintimes.client import JOURNEY_PATTERNS_PATH, FiveElevenClient
+
+
+def _build_patterns_payload(pattern_count, rng):
+    patterns = []
+    for pattern_index in range(pattern_count):
+        points = [{
+            'Order': str(order),
+            'ScheduledStopPointRef': str(rng.randrange(10000, 20000)),
+            'Name': 'Street {} & Avenue {}'.format(rng.randrange(100), rng.randrange(100))
+        } for order in range(60)]
+        patterns.append({
+            'serviceJourneyPatternRef': str(pattern_index),
+            'LineRef': 'N',
+            'Name': 'Pattern {}'.format(pattern_index),
+            'DirectionRef': rng.choice(['IB', 'OB']),
+            'DestinationDisplayView': {'FontText': 'Ocean Beach'},
+            'LinkSequenceProjection': {'Type': 'LineString', 'Coordinates': [
+                [-122.4 - rng.random() / 10, 37.7 + rng.random() / 10] for _ in range(400)]},
+            'PointsInSequence': {
+                'StopPointInJourneyPattern': points[:50],
+                'TimingPointInJourneyPattern': points[50:]
+            }
+        })
+
+    document = {'Line': {'Id': 'N', 'Name': 'JUDAH'}, 'journeyPatterns': patterns}
+    return b'\xef\xbb\xbf' + json.dumps(document).encode('utf-8')
+
+
+def _parse_previous(data):
+    serialized_json = data.decode('utf-8')
+    if serialized_json[0] == '\ufeff':
+        return json.loads(serialized_json[1:])
+    return json.loads(serialized_json)
+
+
+def _peak_memory_mb(func):
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patterns', type=int, default=400)
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    data = _build_patterns_payload(args.patterns, random.Random(511))
+    print('payload size: {:.1f} MB'.format(len(data) / 1024 / 1024))
+
+    candidates = [('previous', None, _parse_previous)]
+    candidates.append(('subtree, standard library', None,
+                       lambda body: FiveElevenClient._parse_json(body, JOURNEY_PATTERNS_PATH)))
+    if client.import_orjson() is not None:
+        candidates.append(('subtree, orjson', client.import_orjson(),
+                           lambda body: FiveElevenClient._parse_json(body, JOURNEY_PATTERNS_PATH)))
+
+    for name, backend, parse in candidates:
+        with patch('sftraintimes.client.orjson', backend):
+            print_summary(name, measure(lambda: parse(data), args.iterations))
+            print('{:<40} peak={:.1f}MB'.format('', _peak_memory_mb(lambda: parse(data))))
+
+
+if __name__ == '__main__':
+    main()
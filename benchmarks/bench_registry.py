@@ -0,0 +1,68 @@
+"""
+Compares the cost of resolving the stop and user services on a cold container against a warm one.
+
+AWS calls are replaced by stand-ins that sleep for a configurable latency, so the numbers show how much per-invocation
+time the registry removes rather than real AWS timings.
+
+    python -m benchmarks.bench_registry --s3-latency-ms 40 --boto3-latency-ms 60
+"""
+import argparse
+import time
+from io import BytesIO
+from unittest.mock import patch
+
+from benchmarks import measure, print_summary
+from sftraintimes import config
+
+
+class _SlowS3Client:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_object(self, **kwargs):
+        time.sleep(self.latency)
+        return {'Body': BytesIO(b'{"api_key": "benchmark"}')}
+
+
+class _SlowBoto3:
+    def __init__(self, s3_latency, construction_latency):
+        self.s3_latency = s3_latency
+        self.construction_latency = construction_latency
+
+    def client(self, name):
+        time.sleep(self.construction_latency)
+        return _SlowS3Client(self.s3_latency)
+
+    def resource(self, name):
+        time.sleep(self.construction_latency)
+        return type('DynamoDB', (), {'Table': lambda self, table_name: object()})()
+
+
+def _invoke():
+    config.get_stop_service()
+    config.get_user_service()
+
+
+def _cold_invoke():
+    config.reset()
+    _invoke()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--s3-latency-ms', type=float, default=40)
+    parser.add_argument('--boto3-latency-ms', type=float, default=60)
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    fake_boto3 = _SlowBoto3(args.s3_latency_ms / 1000, args.boto3_latency_ms / 1000)
+    with patch('sftraintimes.config.boto3', fake_boto3):
+        print_summary('cold container (registry reset)', measure(_cold_invoke, args.iterations))
+        config.reset()
+        _invoke()
+        print_summary('warm container (registry hit)', measure(_invoke, args.iterations))
+    config.reset()
+
+
+if __name__ == '__main__':
+    main()
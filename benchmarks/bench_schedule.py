@@ -0,0 +1,84 @@
+"""
+Measures the offline GTFS schedule on a generated feed about the size of SFMTA's: compiling it, loading the compiled
+file, and answering "next departures at a stop" queries.
+
+    python -m benchmarks.bench_schedule --stops 3500 --trips 20000
+    python -m benchmarks.bench_schedule --gtfs path/to/gtfs
+"""
+import argparse
+import calendar
+import csv
+import os
+import random
+import tempfile
+
+from benchmarks import measure, print_summary
+from sftraintimes.schedule import Schedule, compile_gtfs
+
+STOPS_PER_TRIP = 30
+# Monday, November 5 2018 at 8 AM PST.
+QUERY_TIME = calendar.timegm((2018, 11, 5, 16, 0, 0))
+
+
+def _write_csv(directory, file_name, header, rows):
+    with open(os.path.join(directory, file_name), 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _build_gtfs(directory, stop_count, trip_count):
+    generator = random.Random(0)
+    _write_csv(directory, 'stops.txt', ['stop_id', 'stop_code', 'stop_name'],
+               [(stop, 10000 + stop, 'Stop {}'.format(stop)) for stop in range(stop_count)])
+    _write_csv(directory, 'routes.txt', ['route_id', 'route_short_name'],
+               [(route, 'R{}'.format(route)) for route in range(100)])
+    _write_csv(directory, 'calendar.txt',
+               ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
+                'start_date', 'end_date'],
+               [(1, 1, 1, 1, 1, 1, 0, 0, 20180101, 20191231), (2, 0, 0, 0, 0, 0, 1, 1, 20180101, 20191231)])
+    _write_csv(directory, 'trips.txt', ['route_id', 'service_id', 'trip_id', 'trip_headsign', 'direction_id'],
+               [(trip % 100, 1 + trip % 2, trip, 'Headsign {}'.format(trip % 100), trip % 2)
+                for trip in range(trip_count)])
+
+    stop_times = []
+    for trip in range(trip_count):
+        seconds = generator.randrange(5 * 3600, 25 * 3600)
+        for sequence, stop in enumerate(generator.sample(range(stop_count), STOPS_PER_TRIP)):
+            time = '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+            stop_times.append((trip, time, time, stop, sequence))
+            seconds += 90
+    _write_csv(directory, 'stop_times.txt', ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'],
+               stop_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=3500, help='The number of stops in the generated feed.')
+    parser.add_argument('--trips', type=int, default=20000, help='The number of trips in the generated feed.')
+    parser.add_argument('--gtfs', help='An unzipped GTFS feed to use instead of a generated one.')
+    parser.add_argument('--iterations', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        gtfs_directory = args.gtfs
+        if gtfs_directory is None:
+            gtfs_directory = os.path.join(directory, 'gtfs')
+            os.mkdir(gtfs_directory)
+            _build_gtfs(gtfs_directory, args.stops, args.trips)
+        path = os.path.join(directory, 'schedule.bin')
+
+        print_summary('compile', measure(lambda: compile_gtfs(gtfs_directory, path), 1))
+        print('schedule size: {:.1f} MB'.format(os.path.getsize(path) / 1024 / 1024))
+        print_summary('load', measure(lambda: Schedule.load(path).close(), 20))
+
+        schedule = Schedule.load(path)
+        stop_ids = list(schedule.stops)
+        generator = random.Random(1)
+        print_summary('get_departures', measure(
+            lambda: schedule.get_departures(generator.choice(stop_ids), QUERY_TIME), args.iterations))
+        schedule.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares ways of turning 511's ISO 8601 arrival times into epoch seconds: the original slice-and-int parser followed by
+calendar.timegm, datetime.strptime, util.parse_epoch, and util.parse_epochs over a whole feed's column.
+
+    python -m benchmarks.bench_timestamps --stops 3500
+"""
+import argparse
+import calendar
+from datetime import datetime
+
+from benchmarks import measure, print_summary
+from sftraintimes.feed import VISITS_KEY, iter_json_array
+from sftraintimes.tst.fakes import build_stop_monitoring_feed
+from sftraintimes.util import _parse_epoch, parse_epoch, parse_epochs
+
+
+def _parse_previous(iso_date):
+    parsed = datetime(int(iso_date[:4]), int(iso_date[5:7]), int(iso_date[8:10]), int(iso_date[11:13]),
+                      int(iso_date[14:16]), int(iso_date[17:19]))
+    return calendar.timegm(parsed.timetuple())
+
+
+def _parse_strptime(iso_date):
+    return int(datetime.strptime(iso_date, '%Y-%m-%dT%H:%M:%S%z').timestamp())
+
+
+def _uncached(iso_date):
+    _parse_epoch.cache_clear()
+    return parse_epoch(iso_date)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=3500)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    column = [visit['MonitoredVehicleJourney']['MonitoredCall']['AimedArrivalTime']
+              for visit in iter_json_array([build_stop_monitoring_feed(args.stops)], VISITS_KEY)]
+    print('column: {} timestamps, {} distinct'.format(len(column), len(set(column))))
+
+    for name, parse in [('previous parser', _parse_previous), ('datetime.strptime', _parse_strptime),
+                        ('parse_epoch, cold cache', _uncached)]:
+        print_summary(name + ' (per value)', measure(lambda: parse(column[0]), 10000))
+
+    print_summary('parse_epoch, warm cache (per value)', measure(lambda: parse_epoch(column[0]), 10000))
+    print_summary('previous parser (column)', measure(lambda: [_parse_previous(value) for value in column],
+                                                      args.iterations))
+    print_summary('parse_epoch (column)', measure(lambda: [parse_epoch(value) for value in column], args.iterations))
+    print_summary('parse_epochs (column)', measure(lambda: parse_epochs(column), args.iterations))
+    print_summary('parse_epochs, cold cache (column)',
+                  measure(lambda: _parse_epoch.cache_clear() or parse_epochs(column), args.iterations))
+
+
+if __name__ == '__main__':
+    main()
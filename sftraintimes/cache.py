@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+
+from sftraintimes.metrics import timed
+
+
+LOG = logging.getLogger('log')
+
+CacheEntry = namedtuple('CacheEntry', ['value', 'stored_at'])
+
+
+class LRUCache:
+    """An in-process cache tier that evicts the least recently used entry once it holds max_size entries."""
+    DEFAULT_MAX_SIZE = 512
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        """
+        Constructs a new LRUCache instance.
+        :param max_size: The maximum number of entries to hold.
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Gets an entry from the cache.
+        :param key: The key of the entry.
+        :return: The CacheEntry stored for the key, or None if there is none.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        """
+        Stores an entry in the cache.
+        :param key: The key of the entry.
+        :param entry: The CacheEntry to store.
+        """
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache:
+    """A cache tier that stores each entry as a JSON file, shared by every process that can see the directory."""
+    def __init__(self, directory):
+        """
+        Constructs a new FileCache instance.
+        :param directory: The directory to store entries in. It is created if it does not exist.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """
+        Gets an entry from the cache.
+        :param key: The key of the entry.
+        :return: The CacheEntry stored for the key, or None if there is none.
+        """
+        try:
+            with open(self._path(key), encoding='utf-8') as entry_file:
+                document = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        return CacheEntry(document['value'], document['storedAt'])
+
+    def put(self, key, entry):
+        """
+        Stores an entry in the cache. The file is written under a temporary name and renamed so readers never see a
+        partially written entry.
+        :param key: The key of the entry.
+        :param entry: The CacheEntry to store.
+        """
+        path = self._path(key)
+        temporary_path = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+        with open(temporary_path, 'w', encoding='utf-8') as entry_file:
+            json.dump({'value': entry.value, 'storedAt': entry.stored_at}, entry_file, separators=(',', ':'))
+        os.replace(temporary_path, path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, _serialize_key(key) + '.json')
+
+
+class DynamoDBCache:
+    """
+    A cache tier backed by a DynamoDB table with a string hash key named 'key'. Items carry an 'expiresAt' epoch so
+    DynamoDB's TTL feature can delete them once they are no longer useful.
+    """
+    def __init__(self, table, retention=3600):
+        """
+        Constructs a new DynamoDBCache instance.
+        :param table: A boto3.resources.factory.dynamodb.Table instance representing the cache table.
+        :param retention: Seconds after which DynamoDB may delete an item.
+        """
+        self.table = table
+        self.retention = retention
+
+    @timed('DynamoDBCache.get')
+    def get(self, key):
+        """
+        Gets an entry from the cache.
+        :param key: The key of the entry.
+        :return: The CacheEntry stored for the key, or None if there is none.
+        """
+        item = self.table.get_item(Key={'key': _serialize_key(key)}).get('Item')
+        if item is None:
+            return None
+
+        return CacheEntry(json.loads(item['value']), float(item['storedAt']))
+
+    @timed('DynamoDBCache.put')
+    def put(self, key, entry):
+        """
+        Stores an entry in the cache.
+        :param key: The key of the entry.
+        :param entry: The CacheEntry to store.
+        """
+        self.table.put_item(Item={
+            'key': _serialize_key(key),
+            'value': json.dumps(entry.value, separators=(',', ':')),
+            'storedAt': Decimal(str(entry.stored_at)),
+            'expiresAt': int(entry.stored_at + self.retention)
+        })
+
+
+class TieredCache:
+    """
+    A read-through cache with an in-process tier and an optional shared tier. Entries older than ttl seconds are
+    reloaded, and concurrent lookups of the same missing key are coalesced so only one of them calls the loader.
+    """
+    DEFAULT_TTL = 20
+
+    def __init__(self, ttl=DEFAULT_TTL, local=None, shared=None, clock=time.time):
+        """
+        Constructs a new TieredCache instance.
+        :param ttl: Seconds an entry is served before it is reloaded.
+        :param local: The in-process tier. A new LRUCache is used if not provided.
+        :param shared: An optional tier shared between containers, such as a FileCache or DynamoDBCache.
+        :param clock: A callable returning the current epoch time in seconds, used for testing.
+        """
+        self.ttl = ttl
+        self.local = local if local is not None else LRUCache()
+        self.shared = shared
+        self._clock = clock
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Gets a value from the cache, loading it if no tier holds a fresh entry.
+        :param key: A hashable key for the value (ex: ('SF', '12345')).
+        :param loader: A no-argument callable producing the value on a miss.
+        :return: The cached or freshly loaded value.
+        """
+        entry = self.local.get(key)
+        if self._is_fresh(entry):
+            return entry.value
+
+        return self._load_once(key, loader)
+
+    def peek(self, key):
+        """
+        Gets the entry the in-process tier holds for a key, however old it is, without loading it.
+        :param key: A hashable key for the value.
+        :return: The CacheEntry held for the key, or None if there is none.
+        """
+        return self.local.get(key)
+
+    def put(self, key, value):
+        """
+        Stores a value in every tier.
+        :param key: A hashable key for the value.
+        :param value: The JSON-serializable value to store.
+        """
+        entry = CacheEntry(value, self._clock())
+        self.local.put(key, entry)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, entry)
+            except Exception:
+                LOG.warning('Failed to write {} to the shared cache tier.'.format(key), exc_info=True)
+
+    def _load_once(self, key, loader):
+        with self._lock:
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._in_flight[key] = _Call()
+
+        if not is_leader:
+            return call.wait()
+
+        try:
+            call.value = self._load(key, loader)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+        return call.value
+
+    def _load(self, key, loader):
+        if self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception:
+                LOG.warning('Failed to read {} from the shared cache tier.'.format(key), exc_info=True)
+                entry = None
+            if self._is_fresh(entry):
+                self.local.put(key, entry)
+                return entry.value
+
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def _is_fresh(self, entry):
+        return entry is not None and self._clock() - entry.stored_at < self.ttl
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _serialize_key(key):
+    if isinstance(key, tuple):
+        return '-'.join(str(part) for part in key)
+    return str(key)
@@ -1,18 +1,153 @@
+import codecs
 import json
+import random
+import threading
+import time
+from collections import deque
 
-from botocore.vendored import requests
+from sftraintimes.feed import VISITS_KEY, iter_json_array
+from sftraintimes.metrics import timed
+from sftraintimes.util import LazyModule
 
+urllib3 = LazyModule('urllib3')
+# orjson is optional and only imported on the first response parsed. Until then this holds _NOT_IMPORTED, and after
+# that the module, or None if it is not installed.
+_NOT_IMPORTED = object()
+orjson = _NOT_IMPORTED
 
-REAL_TIME_STOP_MONITORING_URL = 'http://api.511.org/transit/StopMonitoring'
-LINE_PATTERN_URL = 'http://api.511.org/transit/patterns'
+
+BASE_URL = 'http://api.511.org/transit'
+REAL_TIME_STOP_MONITORING_PATH = '/StopMonitoring'
+LINE_PATTERN_PATH = '/patterns'
+REAL_TIME_STOP_MONITORING_URL = BASE_URL + REAL_TIME_STOP_MONITORING_PATH
+LINE_PATTERN_URL = BASE_URL + LINE_PATTERN_PATH
+STOP_VISITS_PATH = ('ServiceDelivery', 'StopMonitoringDelivery', VISITS_KEY)
+JOURNEY_PATTERNS_PATH = ('journeyPatterns',)
+_WHITESPACE = b' \t\r\n'
+_DECODER = json.JSONDecoder()
+
+
+class RequestMetrics:
+    """Keeps latency samples for the most recent requests made through an HttpTransport."""
+    def __init__(self, max_samples=1000):
+        """
+        Constructs a new RequestMetrics instance.
+        :param max_samples: The number of recent samples to keep.
+        """
+        self.samples = deque(maxlen=max_samples)
+        self.request_count = 0
+        self.retry_count = 0
+        self.failure_count = 0
+        self._lock = threading.Lock()
+
+    def record(self, url, status, latency_ms, attempts):
+        """
+        Records a completed request.
+        :param url: The URL requested, without query parameters.
+        :param status: The final HTTP status code, or None if no response was received.
+        :param latency_ms: Total time spent on the request across all attempts, in milliseconds.
+        :param attempts: The number of attempts made.
+        """
+        with self._lock:
+            self.samples.append((url, status, latency_ms, attempts))
+            self.request_count += 1
+            self.retry_count += attempts - 1
+            if status is None:
+                self.failure_count += 1
+
+    @property
+    def last_latency_ms(self):
+        """The latency of the most recent request in milliseconds, or None if no request has been made."""
+        return self.samples[-1][2] if self.samples else None
+
+
+class HttpTransport:
+    """
+    Makes HTTP GET requests over a persistent pool of keep-alive connections, with connect and read timeouts and a
+    bounded number of retries using exponential backoff with full jitter.
+    """
+    DEFAULT_CONNECT_TIMEOUT = 1.0
+    DEFAULT_READ_TIMEOUT = 3.0
+    DEFAULT_MAX_RETRIES = 2
+    DEFAULT_BACKOFF = 0.1
+    DEFAULT_POOL_SIZE = 4
+    RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+        """
+        Constructs a new HttpTransport instance.
+        :param connect_timeout: Seconds to wait for a connection to be established.
+        :param read_timeout: Seconds to wait between bytes of the response.
+        :param max_retries: The number of times a failed request is retried.
+        :param backoff: The base backoff in seconds; attempt n sleeps a random time up to backoff * 2 ** n.
+        :param pool_size: The number of connections kept alive per host.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.metrics = RequestMetrics()
+        self._pool_manager = urllib3.PoolManager(
+            maxsize=pool_size,
+            block=False,
+            retries=False,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout)
+        )
+
+    @timed('HttpTransport.get')
+    def get(self, url, params=None, preload_content=True):
+        """
+        Makes a GET request, retrying connection errors, timeouts and retryable status codes.
+        :param url: The URL to request.
+        :param params: A dict of query parameters.
+        :param preload_content: If False, the body is left unread so it can be streamed with response.stream(). The
+                                caller must then call response.release_conn() when done with it.
+        :return: A urllib3 response whose body has been fully read into its data attribute, unless preload_content is
+                 False.
+        """
+        start = time.perf_counter()
+        status = None
+        attempt = 0
+
+        try:
+            while True:
+                try:
+                    response = self._pool_manager.request('GET', url, fields=params, preload_content=preload_content)
+                    status = response.status
+                    if status not in self.RETRYABLE_STATUSES or attempt >= self.max_retries:
+                        return response
+                    if not preload_content:
+                        response.drain_conn()
+                        response.release_conn()
+                except urllib3.exceptions.HTTPError as e:
+                    if attempt >= self.max_retries:
+                        raise RuntimeError('Request to {} failed after {} attempts.'.format(url, attempt + 1)) from e
+
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                attempt += 1
+        finally:
+            self.metrics.record(url, status, (time.perf_counter() - start) * 1000, attempt + 1)
+
+    def close(self):
+        """Closes every pooled connection."""
+        self._pool_manager.clear()
 
 
 class FiveElevenClient:
     """Client for making calls to 511.org APIs."""
-    def __init__(self, api_key):
-        """Constructs a new FiveElevenClient instance."""
+    def __init__(self, api_key=None, key_provider=None, transport=None, base_url=BASE_URL):
+        """
+        Constructs a new FiveElevenClient instance.
+        :param api_key: A fixed 511 API key.
+        :param key_provider: A keys.ApiKeyProvider consulted on every call instead of a fixed api_key.
+        :param transport: The HttpTransport used for requests. A new one is created if not provided.
+        :param base_url: The root URL of the 511 transit API.
+        """
         self.api_key = api_key
+        self.key_provider = key_provider
+        self.transport = transport if transport is not None else HttpTransport()
+        self.base_url = base_url
 
+    @timed('FiveElevenClient.get_real_time_stop_monitoring')
     def get_real_time_stop_monitoring(self, agency, stop_id):
         """
         Gets upcoming arrivals for the given stop ID.
@@ -21,18 +156,42 @@ class FiveElevenClient:
         :return: A dict representing the API response.
         """
         query_params = {
-            'api_key': self.api_key,
+            'api_key': self._get_api_key(),
             'agency': agency,
             'stopCode': stop_id
         }
-        response_object = requests.get(REAL_TIME_STOP_MONITORING_URL, params=query_params)
-        if response_object.status_code != 200:
+        response_object = self.transport.get(self.base_url + REAL_TIME_STOP_MONITORING_PATH, params=query_params)
+        if response_object.status != 200:
             raise RuntimeError('Response returned an unexpected status code. Response: {}'.format(response_object))
 
-        response = self._parse_json(response_object.text)
+        response = self._parse_json(response_object.data, STOP_VISITS_PATH)
 
         return response
 
+    def iter_agency_stop_visits(self, agency, chunk_size=65536):
+        """
+        Streams upcoming arrivals for every stop of an agency from a single StopMonitoring request. Visits are parsed
+        as their bytes arrive, so the multi-megabyte response is never held in memory as a whole.
+        :param agency: The agency to get arrivals for (ex: 'SF')
+        :param chunk_size: The number of bytes read from the connection at a time.
+        :return: A generator of MonitoredStopVisit dicts.
+        """
+        query_params = {
+            'api_key': self._get_api_key(),
+            'agency': agency
+        }
+        response_object = self.transport.get(self.base_url + REAL_TIME_STOP_MONITORING_PATH, params=query_params,
+                                             preload_content=False)
+        try:
+            if response_object.status != 200:
+                raise RuntimeError('Response returned an unexpected status code. Response: {}'.format(response_object))
+
+            for visit in iter_json_array(response_object.stream(chunk_size), VISITS_KEY):
+                yield visit
+        finally:
+            response_object.release_conn()
+
+    @timed('FiveElevenClient.get_patterns_for_line')
     def get_patterns_for_line(self, agency, line_id):
         """
         Gets patterns for the specified line. A pattern represents the route a train travels on the line.
@@ -41,20 +200,90 @@ class FiveElevenClient:
         :return: A list of patterns serviced by this line.
         """
         query_params = {
-            'api_key': self.api_key,
+            'api_key': self._get_api_key(),
             'operator_id': agency,
             'line_id': line_id
         }
-        response_object = requests.get(LINE_PATTERN_URL, params=query_params)
-        if response_object.status_code != 200:
+        response_object = self.transport.get(self.base_url + LINE_PATTERN_PATH, params=query_params)
+        if response_object.status != 200:
             raise RuntimeError('Response returned an unexpected status code. Response: {}'.format(response_object))
 
-        response = self._parse_json(response_object.text)
+        response = self._parse_json(response_object.data, JOURNEY_PATTERNS_PATH)
 
         return response
 
+    def _get_api_key(self):
+        if self.key_provider is not None:
+            return self.key_provider.get_key()
+        return self.api_key
+
     @staticmethod
-    def _parse_json(serialized_json):
-        if serialized_json[0] == '\ufeff':
-            return json.loads(serialized_json[1:])
-        return json.loads(serialized_json)
+    @timed('FiveElevenClient.parse_json')
+    def _parse_json(data, path=()):
+        """
+        Decodes a UTF-8 JSON response body, skipping a leading byte order mark by offset rather than by copying the
+        body. When a path of keys is given, only the value at the end of it is kept, wrapped in dicts so the result has
+        the same shape as the full document (ex: {'journeyPatterns': [...]}) and callers index into it as before.
+
+        With orjson installed, it decodes the document straight from the bytes. Otherwise the last key of the path is
+        found by searching the bytes and only the value after it is decoded, so nothing else in the document is ever
+        turned into Python objects. A full decode is used if the key cannot be found.
+        :param data: The response body as bytes.
+        :param path: The keys leading to the value callers use.
+        :return: The value at the end of the path wrapped in its keys, or the whole document if path is empty or the
+                 value is missing.
+        """
+        offset = len(codecs.BOM_UTF8) if data.startswith(codecs.BOM_UTF8) else 0
+        fast_json = import_orjson()
+        if fast_json is not None:
+            document = fast_json.loads(memoryview(data)[offset:])
+        else:
+            value_start = _find_value(data, path[-1], offset) if path else None
+            if value_start is not None:
+                value, _ = _DECODER.raw_decode(codecs.utf_8_decode(memoryview(data)[value_start:])[0])
+                return _wrap(path, value)
+            document = json.loads(codecs.utf_8_decode(memoryview(data)[offset:])[0])
+
+        value = document
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                return document
+            value = value[key]
+        return _wrap(path, value)
+
+
+def import_orjson():
+    """
+    Imports orjson the first time it is needed.
+    :return: The orjson module, or None if it is not installed.
+    """
+    global orjson
+    if orjson is _NOT_IMPORTED:
+        try:
+            import orjson as module
+        except ImportError:
+            module = None
+        orjson = module
+    return orjson
+
+
+def _find_value(data, key, start):
+    marker = json.dumps(key).encode('utf-8')
+    position = data.find(marker, start)
+    while position >= 0:
+        position += len(marker)
+        while position < len(data) and data[position] in _WHITESPACE:
+            position += 1
+        if position < len(data) and data[position] == ord(':'):
+            position += 1
+            while position < len(data) and data[position] in _WHITESPACE:
+                position += 1
+            return position
+        position = data.find(marker, position)
+    return None
+
+
+def _wrap(path, value):
+    for key in reversed(path):
+        value = {key: value}
+    return value
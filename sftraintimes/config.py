@@ -1,47 +1,217 @@
-import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import environ, path
 
-import boto3
-
+from sftraintimes.cache import DynamoDBCache, FileCache, TieredCache
 from sftraintimes.service import UserService, StopService, LineService
 from sftraintimes.dao import UserDAO
 from sftraintimes.client import FiveElevenClient
 from sftraintimes.controller import SetupController
+from sftraintimes.feed import FileSnapshotStore, S3SnapshotStore
+from sftraintimes.index import StopIndex
+from sftraintimes.keys import ApiKeyProvider, EnvironmentKeySource, FileKeySource, S3KeySource
+from sftraintimes.metrics import MetricsRecorder
+from sftraintimes.patterns import FilePatternStore, S3PatternStore
+from sftraintimes.schedule import DEFAULT_SCHEDULE_PATH, Schedule
+from sftraintimes.util import LazyModule
+
+boto3 = LazyModule('boto3')
 
 KEY_STORAGE_BUCKET = 'sftraintimes-api-key-storage'
 KEY_STORAGE_PATH = 'five_eleven_keys.json'
-
-
-user_service = None
-stop_service = None
-setup_controller = None
+API_KEY_VARIABLE = 'FIVE_ELEVEN_API_KEY'
+API_KEY_FILE_VARIABLE = 'FIVE_ELEVEN_API_KEY_FILE'
+API_KEY_TTL_VARIABLE = 'FIVE_ELEVEN_API_KEY_TTL'
+EXECUTOR_MAX_WORKERS = 8
+VISIT_CACHE_TTL_VARIABLE = 'VISIT_CACHE_TTL'
+VISIT_CACHE_DIRECTORY_VARIABLE = 'VISIT_CACHE_DIRECTORY'
+VISIT_CACHE_TABLE_VARIABLE = 'VISIT_CACHE_TABLE'
+SNAPSHOT_BUCKET_VARIABLE = 'STOP_SNAPSHOT_BUCKET'
+SNAPSHOT_FILE_VARIABLE = 'STOP_SNAPSHOT_FILE'
+SNAPSHOT_KEY = 'stop_snapshot.json'
+SCHEDULE_FILE_VARIABLE = 'GTFS_SCHEDULE_FILE'
+PATTERN_BUCKET_VARIABLE = 'PATTERN_BUCKET'
+PATTERN_DIRECTORY_VARIABLE = 'PATTERN_DIRECTORY'
+METRICS_SAMPLE_RATE_VARIABLE = 'METRICS_SAMPLE_RATE'
+LOG_LEVEL_VARIABLE = 'LOG_LEVEL'
+DEFAULT_LOG_LEVEL = 'WARNING'
+# Marks a dependency that has not been built, since None is a valid instance of an optional one.
+_MISSING = object()
+
+
+class Registry:
+    """
+    Holds dependencies that should be built at most once per warm Lambda container. Each dependency is created lazily
+    by its factory the first time it is requested and reused by every later invocation until reset() is called.
+    """
+    def __init__(self):
+        """Constructs a new, empty Registry instance."""
+        self._instances = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, factory):
+        """
+        Gets the dependency registered under the given name, building it if this container has not done so yet.
+        :param name: The name of the dependency.
+        :param factory: A no-argument callable that builds the dependency. A None result is kept like any other, so
+                        factories for optional dependencies run once.
+        :return: The shared dependency instance.
+        """
+        instance = self._instances.get(name, _MISSING)
+        if instance is not _MISSING:
+            return instance
+
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+
+        with lock:
+            instance = self._instances.get(name, _MISSING)
+            if instance is _MISSING:
+                instance = factory()
+                self._instances[name] = instance
+
+        return instance
+
+    def override(self, name, instance):
+        """
+        Registers a prebuilt dependency under the given name, replacing any existing instance.
+        :param name: The name of the dependency.
+        :param instance: The instance to hand out for that name.
+        """
+        with self._lock:
+            self._instances[name] = instance
+
+    def reset(self):
+        """Discards every dependency so the next request for each one builds it again, as on a cold start."""
+        with self._lock:
+            self._instances.clear()
+            self._locks.clear()
+
+
+REGISTRY = Registry()
 
 
 def get_user_service():
-    if not user_service:
-        return UserService(UserDAO(boto3.resource('dynamodb').Table(UserDAO.USER_TABLE_NAME)))
-    return user_service
+    return REGISTRY.get('user_service', lambda: UserService(UserDAO(get_user_table())))
 
 
 def get_stop_service():
-    if not stop_service:
-        return StopService(FiveElevenClient(_get_five_eleven_api_key()))
-    return stop_service
+    return REGISTRY.get('stop_service', lambda: StopService(get_five_eleven_client(), get_visit_cache(),
+                                                            get_snapshot_store(), schedule=get_schedule(),
+                                                            executor=get_executor()))
 
 
 def get_setup_controller():
-    if not setup_controller:
-        return SetupController(LineService(FiveElevenClient))
-    return setup_controller
+    return REGISTRY.get('setup_controller', lambda: SetupController(get_line_service(), get_stop_index()))
+
+
+def get_line_service():
+    return REGISTRY.get('line_service', lambda: LineService(get_five_eleven_client(), get_pattern_store()))
+
+
+def get_five_eleven_client():
+    return REGISTRY.get('five_eleven_client', lambda: FiveElevenClient(key_provider=get_api_key_provider()))
+
+
+def get_api_key_provider():
+    return REGISTRY.get('api_key_provider', _build_api_key_provider)
+
+
+def get_stop_index():
+    return REGISTRY.get('stop_index', StopIndex.load)
+
+
+def get_visit_cache():
+    return REGISTRY.get('visit_cache', _build_visit_cache)
+
+
+def get_snapshot_store():
+    return REGISTRY.get('snapshot_store', _build_snapshot_store)
+
+
+def get_pattern_store():
+    return REGISTRY.get('pattern_store', _build_pattern_store)
+
+
+def get_schedule():
+    return REGISTRY.get('schedule', _build_schedule)
+
+
+def get_metrics_recorder():
+    return REGISTRY.get('metrics_recorder', lambda: MetricsRecorder(
+        sample_rate=float(environ.get(METRICS_SAMPLE_RATE_VARIABLE, MetricsRecorder.DEFAULT_SAMPLE_RATE))))
+
+
+def get_executor():
+    return REGISTRY.get('executor', lambda: ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS))
+
+
+def get_user_table():
+    return REGISTRY.get('user_table', lambda: get_dynamodb_resource().Table(UserDAO.USER_TABLE_NAME))
+
+
+def get_dynamodb_resource():
+    return REGISTRY.get('dynamodb_resource', lambda: boto3.resource('dynamodb'))
+
+
+def get_s3_client():
+    return REGISTRY.get('s3_client', lambda: boto3.client('s3'))
+
+
+def reset():
+    """Clears every dependency held for this container. Intended for tests and benchmarks that simulate cold starts."""
+    REGISTRY.reset()
 
 
 def get_logger():
     logger = logging.getLogger('log')
-    logger.setLevel(logging.WARNING)
+    logger.setLevel(environ.get(LOG_LEVEL_VARIABLE, DEFAULT_LOG_LEVEL).upper())
 
     return logger
 
 
-def _get_five_eleven_api_key():
-    keys = boto3.client('s3').get_object(Bucket=KEY_STORAGE_BUCKET, Key=KEY_STORAGE_PATH)['Body'].read().decode('utf-8')
-    return json.loads(keys)['api_key']
+def _build_api_key_provider():
+    if environ.get(API_KEY_VARIABLE):
+        source = EnvironmentKeySource(API_KEY_VARIABLE)
+    elif environ.get(API_KEY_FILE_VARIABLE):
+        source = FileKeySource(environ[API_KEY_FILE_VARIABLE])
+    else:
+        source = S3KeySource(get_s3_client(), KEY_STORAGE_BUCKET, KEY_STORAGE_PATH)
+
+    return ApiKeyProvider(source, ttl=float(environ.get(API_KEY_TTL_VARIABLE, ApiKeyProvider.DEFAULT_TTL)))
+
+
+def _build_visit_cache():
+    if environ.get(VISIT_CACHE_DIRECTORY_VARIABLE):
+        shared = FileCache(environ[VISIT_CACHE_DIRECTORY_VARIABLE])
+    elif environ.get(VISIT_CACHE_TABLE_VARIABLE):
+        shared = DynamoDBCache(get_dynamodb_resource().Table(environ[VISIT_CACHE_TABLE_VARIABLE]))
+    else:
+        shared = None
+
+    return TieredCache(ttl=float(environ.get(VISIT_CACHE_TTL_VARIABLE, TieredCache.DEFAULT_TTL)), shared=shared)
+
+
+def _build_snapshot_store():
+    if environ.get(SNAPSHOT_FILE_VARIABLE):
+        return FileSnapshotStore(environ[SNAPSHOT_FILE_VARIABLE])
+    if environ.get(SNAPSHOT_BUCKET_VARIABLE):
+        return S3SnapshotStore(get_s3_client(), environ[SNAPSHOT_BUCKET_VARIABLE], SNAPSHOT_KEY)
+    return None
+
+
+def _build_pattern_store():
+    if environ.get(PATTERN_DIRECTORY_VARIABLE):
+        return FilePatternStore(environ[PATTERN_DIRECTORY_VARIABLE])
+    if environ.get(PATTERN_BUCKET_VARIABLE):
+        return S3PatternStore(get_s3_client(), environ[PATTERN_BUCKET_VARIABLE])
+    return None
+
+
+def _build_schedule():
+    schedule_path = environ.get(SCHEDULE_FILE_VARIABLE, DEFAULT_SCHEDULE_PATH)
+    if not path.exists(schedule_path):
+        return None
+    return Schedule.load(schedule_path)
@@ -1,12 +1,20 @@
+from sftraintimes.index import StopIndex
+from sftraintimes.metrics import timed
+
+
 class SetupController:
     """Controller class for setting user's home stop."""
-    def __init__(self, line_service):
+    def __init__(self, line_service, stop_index=None):
         """
         Constructs a new SetupController instance.
         :param line_service: A controller.LineController instance for getting line patterns.
+        :param stop_index: An index.StopIndex of known stops. Lines missing from it are fetched from line_service and
+                           added to it.
         """
         self.line_service = line_service
+        self.stop_index = stop_index if stop_index is not None else StopIndex()
 
+    @timed('SetupController.get_stop_id')
     def get_stop_id(self, line_id, stop_name, direction):
         """
         Gets a stop ID from a stop's human-readable name.
@@ -15,19 +23,19 @@ class SetupController:
         :param direction: The direction of the specific stop (IB or OB)
         :return: The ID of the stop, or None if it cannot be found.
         """
-        patterns = self.line_service.get_patterns_for_line(line_id)
-
-        for journey_pattern in patterns:
-            if journey_pattern['DirectionRef'] == direction.value:
+        match = self.find_stop(line_id, stop_name, direction)
+        return match.stop_id if match is not None else None
 
-                stop_points = journey_pattern['PointsInSequence']['StopPointInJourneyPattern']
-                for stop_point in stop_points:
-                    if stop_point['Name'].lower() == stop_name:
-                        return stop_point['ScheduledStopPointRef']
-
-                timing_points = journey_pattern['PointsInSequence']['TimingPointInJourneyPattern']
-                for timing_point in timing_points:
-                    if timing_point['Name'].lower() == stop_name:
-                        return timing_point['ScheduledStopPointRef']
+    def find_stop(self, line_id, stop_name, direction):
+        """
+        Finds the stop best matching a human-readable name, tolerating misheard or differently abbreviated names.
+        :param line_id: The line the stop lies on.
+        :param stop_name: The name of the stop (ex: 'church street and 16th street')
+        :param direction: The direction of the specific stop (IB or OB)
+        :return: A matching.StopMatch with the stop's ID, name and a confidence between 0 and 1, or None if no stop
+                 matches closely enough.
+        """
+        if not self.stop_index.has_line(line_id):
+            self.stop_index.add_line(line_id, self.line_service.get_patterns_for_line(line_id))
 
-        return None
+        return self.stop_index.find_stop(line_id, direction.value, stop_name)
@@ -1,10 +1,20 @@
-import boto3
+import random
+import time
 from os import environ
 
+from sftraintimes.metrics import timed
+from sftraintimes.util import LazyModule
+
+botocore_exceptions = LazyModule('botocore.exceptions')
+
 
 class UserDAO:
     """Contains methods for getting, adding, and updating users in the database."""
     USER_TABLE_NAME = 'User-' + environ.get('STAGE', 'dev')
+    BATCH_GET_LIMIT = 100
+    BATCH_WRITE_LIMIT = 25
+    MAX_BATCH_ATTEMPTS = 8
+    BATCH_BACKOFF = 0.05
 
     def __init__(self, table):
         """
@@ -13,6 +23,7 @@ class UserDAO:
         """
         self.table = table
 
+    @timed('UserDAO.get_user')
     def get_user(self, user_id):
         """
         Gets a user from the database.
@@ -23,6 +34,7 @@ class UserDAO:
 
         return response.get('Item')
 
+    @timed('UserDAO.add_user')
     def add_user(self, user):
         """
         Adds a user to the database.
@@ -30,6 +42,7 @@ class UserDAO:
         """
         self.table.put_item(Item=user)
 
+    @timed('UserDAO.update_user')
     def update_user(self, user_id, **kwargs):
         """
         Updates a user in the database, or adds the user if it does not exist.
@@ -40,22 +53,153 @@ class UserDAO:
         if not kwargs:
             return
 
-        update_expression = 'SET '
+        update_expression, expression_attribute_names, expression_attribute_values = self._build_update(kwargs)
+
+        self.table.update_item(
+            Key={'id': user_id},
+            UpdateExpression=update_expression,
+            ExpressionAttributeNames=expression_attribute_names,
+            ExpressionAttributeValues=expression_attribute_values
+        )
+
+    @timed('UserDAO.upsert_user')
+    def upsert_user(self, user_id, **kwargs):
+        """
+        Sets attributes on a user in a single conditional write, adding the user if it does not exist. The write is
+        skipped when every attribute already holds the requested value, and the user is then read back.
+        :param user_id: The ID for the user to update.
+        :param kwargs: Key-value pairs for each field to set in the database.
+        :return: A tuple of (old_user, new_user) dicts. old_user is None if the user did not exist.
+        """
+        if not kwargs:
+            raise ValueError('At least one attribute is required to upsert user {}.'.format(user_id))
+
+        update_expression, expression_attribute_names, expression_attribute_values = self._build_update(kwargs)
+        expression_attribute_names['#id'] = 'id'
+        condition_expression = 'attribute_not_exists(#id) OR ' + ' OR '.join(
+            '#{0} <> :{0}'.format(key) for key in kwargs)
+
+        try:
+            response = self.table.update_item(
+                Key={'id': user_id},
+                UpdateExpression=update_expression,
+                ConditionExpression=condition_expression,
+                ExpressionAttributeNames=expression_attribute_names,
+                ExpressionAttributeValues=expression_attribute_values,
+                ReturnValues='ALL_OLD'
+            )
+        except botocore_exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Nothing changed, so the stored user is both the old and the new value. It is read back rather than
+            # returned with the failed condition, which the boto3 in the Lambda runtime does not support.
+            user = self.get_user(user_id) or dict(kwargs, id=user_id)
+            return user, user
+
+        old_user = response.get('Attributes')
+        new_user = dict(old_user or {'id': user_id}, **kwargs)
+
+        return old_user, new_user
+
+    def scan_users(self, *attributes):
+        """
+        Reads every user in the database, one page at a time.
+        :param attributes: The names of the attributes to read. Every attribute is read if none are given.
+        :return: A generator of dicts representing the users. Users are yielded in no particular order.
+        """
+        kwargs = {}
+        if attributes:
+            kwargs['ProjectionExpression'] = ', '.join('#' + attribute for attribute in attributes)
+            kwargs['ExpressionAttributeNames'] = {'#' + attribute: attribute for attribute in attributes}
+
+        while True:
+            response = self.table.scan(**kwargs)
+            for user in response.get('Items', []):
+                yield user
+
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def batch_get_users(self, user_ids):
+        """
+        Gets many users from the database, issuing one BatchGetItem call per 100 IDs and retrying unprocessed keys with
+        exponential backoff.
+        :param user_ids: An iterable of user IDs. It is consumed lazily, so it may be a generator.
+        :return: A generator of dicts representing the users found, in no particular order. IDs that could not be
+                 found are skipped.
+        """
+        for chunk in _chunk(_unique(user_ids), self.BATCH_GET_LIMIT):
+            request_items = {self.table.name: {'Keys': [{'id': user_id} for user_id in chunk]}}
+            for response in self._send_batch(self.table.meta.client.batch_get_item, request_items, 'UnprocessedKeys'):
+                for user in response.get('Responses', {}).get(self.table.name, []):
+                    yield user
+
+    def batch_write_users(self, users):
+        """
+        Adds or replaces many users in the database, issuing one BatchWriteItem call per 25 users and retrying
+        unprocessed items with exponential backoff. When the same ID appears more than once in a batch, the last user
+        wins.
+        :param users: An iterable of dicts representing users, each containing at minimum an 'id' value. It is consumed
+                      lazily, so it may be a generator.
+        :return: The number of users written.
+        """
+        written = 0
+        for chunk in _chunk(users, self.BATCH_WRITE_LIMIT):
+            users_by_id = {user['id']: user for user in chunk}
+            request_items = {self.table.name: [{'PutRequest': {'Item': user}} for user in users_by_id.values()]}
+            for _ in self._send_batch(self.table.meta.client.batch_write_item, request_items, 'UnprocessedItems'):
+                pass
+            written += len(users_by_id)
+
+        return written
+
+    def _send_batch(self, operation, request_items, unprocessed_field):
+        attempt = 0
+        while request_items:
+            if attempt:
+                if attempt >= self.MAX_BATCH_ATTEMPTS:
+                    raise RuntimeError('Batch request on {} still had unprocessed requests after {} attempts.'.format(
+                        self.table.name, attempt))
+                time.sleep(random.uniform(0, self.BATCH_BACKOFF * 2 ** attempt))
+
+            response = operation(RequestItems=request_items)
+            yield response
+            request_items = response.get(unprocessed_field) or {}
+            attempt += 1
+
+    @staticmethod
+    def _build_update(attributes):
+        # Placeholders are derived from attribute names rather than values, so the same update always produces the same
+        # expression.
         expression_attribute_names = {}
         expression_attribute_values = {}
+        assignments = []
 
-        for key, value in kwargs.items():
+        for key, value in attributes.items():
             key_placeholder = '#{}'.format(key)
-            value_placeholder = ':{}'.format(value.replace(' ', ''))
+            value_placeholder = ':{}'.format(key)
             expression_attribute_names[key_placeholder] = key
             expression_attribute_values[value_placeholder] = value
-            update_expression += '{} = {}, '.format(key_placeholder, value_placeholder)
+            assignments.append('{} = {}'.format(key_placeholder, value_placeholder))
 
-        update_expression = update_expression[: -2]
+        return 'SET ' + ', '.join(assignments), expression_attribute_names, expression_attribute_values
 
-        self.table.update_item(
-            Key={'id': user_id},
-            UpdateExpression=update_expression,
-            ExpressionAttributeNames=expression_attribute_names,
-            ExpressionAttributeValues=expression_attribute_values
-        )
+
+def _unique(values):
+    seen = set()
+    for value in values:
+        if value not in seen:
+            seen.add(value)
+            yield value
+
+
+def _chunk(values, size):
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+
+
+class EtaEngine:
+    """
+    Chooses the arrival time to speak for each upcoming arrival. Realtime predictions from 511 are preferred over the
+    schedule, but successive predictions for the same vehicle at the same stop jitter by tens of seconds from one
+    snapshot to the next, so the engine keeps an exponentially weighted average of each vehicle's delay and reports
+    that instead. A vehicle's recent delay is also carried over to its scheduled-only arrivals.
+    """
+    DEFAULT_SMOOTHING = 0.5
+    DEFAULT_MAX_VEHICLES = 4096
+    DEFAULT_VEHICLE_TTL = 600
+    DEFAULT_GRACE = 30
+    MAX_JUMP = 120
+
+    def __init__(self, smoothing=DEFAULT_SMOOTHING, max_vehicles=DEFAULT_MAX_VEHICLES, vehicle_ttl=DEFAULT_VEHICLE_TTL,
+                 grace=DEFAULT_GRACE):
+        """
+        Constructs a new EtaEngine instance.
+        :param smoothing: The weight, between 0 and 1, given to a new prediction over the running average. 1 disables
+                          smoothing.
+        :param max_vehicles: The maximum number of (stop, vehicle) predictions to remember.
+        :param vehicle_ttl: The number of seconds a vehicle's delay is remembered after it was last observed.
+        :param grace: The number of seconds an arrival is kept after its arrival time, since the vehicle may still be
+                      at the stop.
+        """
+        if not 0 < smoothing <= 1:
+            raise ValueError('Smoothing must be greater than 0 and at most 1, not {}.'.format(smoothing))
+
+        self.smoothing = smoothing
+        self.max_vehicles = max_vehicles
+        self.vehicle_ttl = vehicle_ttl
+        self.grace = grace
+        self._predictions = OrderedDict()
+        self._vehicle_delays = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stop_id, arrivals, observed_at):
+        """
+        Records the predictions in a fresh set of arrivals at a stop and smooths them against earlier ones. Observing
+        the same or an older set of arrivals again does not move the averages, so cached arrivals can be passed back in
+        freely.
+        :param stop_id: The ID of the stop.
+        :param arrivals: A list of model.Arrival, as returned by 511 or read from a snapshot.
+        :param observed_at: The epoch second the arrivals were fetched at.
+        :return: A new list of model.Arrival sorted by arrival time.
+        """
+        with self._lock:
+            self._expire(observed_at)
+            estimated = [self._estimate(stop_id, arrival, observed_at) for arrival in arrivals]
+
+        estimated.sort(key=lambda arrival: arrival.arrival_time)
+        return estimated
+
+    def age(self, arrivals, now):
+        """
+        Brings previously fetched arrivals forward to the present, so they can be served again instead of being
+        refetched.
+        :param arrivals: A list of model.Arrival sorted by arrival time.
+        :param now: The current epoch second.
+        :return: The arrivals that have not yet left the stop.
+        """
+        departed_before = now - self.grace
+        return [arrival for arrival in arrivals if arrival.arrival_time >= departed_before]
+
+    def _estimate(self, stop_id, arrival, observed_at):
+        if arrival.vehicle is None or arrival.aimed_time is None:
+            return arrival
+
+        if not arrival.realtime:
+            vehicle_delay = self._vehicle_delays.get(arrival.vehicle)
+            if vehicle_delay is None:
+                return arrival
+            return arrival._replace(arrival_time=arrival.aimed_time + int(round(vehicle_delay[0])))
+
+        key = (stop_id, arrival.vehicle, arrival.aimed_time)
+        prediction = self._predictions.get(key)
+        if prediction is not None and observed_at <= prediction[1]:
+            return arrival._replace(arrival_time=arrival.aimed_time + int(round(prediction[0])))
+        if prediction is None or abs(arrival.delay - prediction[0]) > self.MAX_JUMP:
+            # A large change is a real event, such as the vehicle being held, rather than noise to average away.
+            delay = arrival.delay
+        else:
+            delay = prediction[0] + self.smoothing * (arrival.delay - prediction[0])
+
+        self._predictions[key] = (delay, observed_at)
+        self._predictions.move_to_end(key)
+        self._vehicle_delays[arrival.vehicle] = (delay, observed_at)
+        while len(self._predictions) > self.max_vehicles:
+            self._predictions.popitem(last=False)
+
+        return arrival._replace(arrival_time=arrival.aimed_time + int(round(delay)))
+
+    def _expire(self, now):
+        expired_before = now - self.vehicle_ttl
+        while self._predictions:
+            key, (_, observed_at) = next(iter(self._predictions.items()))
+            if observed_at >= expired_before:
+                break
+            del self._predictions[key]
+        for vehicle in [vehicle for vehicle, (_, observed_at) in self._vehicle_delays.items()
+                        if observed_at < expired_before]:
+            del self._vehicle_delays[vehicle]
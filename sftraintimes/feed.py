@@ -0,0 +1,359 @@
+"""
+Ingests 511's agency-wide StopMonitoring feed and publishes it as a compact per-stop snapshot, so per-user lookups read
+one shared file instead of each calling 511 for a single stop.
+"""
+import codecs
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+
+from sftraintimes.metrics import timed
+from sftraintimes.model import Arrival
+from sftraintimes.util import LazyModule, parse_epoch, parse_epochs
+
+LOG = logging.getLogger('log')
+botocore_exceptions = LazyModule('botocore.exceptions')
+
+VISITS_KEY = 'MonitoredStopVisit'
+# Typecodes of a snapshot stop's columns: line, direction, destination, arrival time, aimed time, realtime flag,
+# vehicle, latitude and longitude. Missing coordinates are stored as NaN.
+_COLUMN_TYPECODES = ('I', 'I', 'I', 'q', 'q', 'B', 'I', 'd', 'd')
+_NAN = float('nan')
+
+
+def iter_json_array(chunks, key):
+    """
+    Incrementally parses the elements of the first JSON array stored under the given key, without holding the whole
+    document in memory. Elements are decoded one at a time as soon as the bytes for them have arrived.
+    :param chunks: An iterable of bytes making up a UTF-8 JSON document, optionally starting with a byte order mark.
+    :param key: The name of the key whose array value should be parsed (ex: 'MonitoredStopVisit').
+    :return: A generator of the decoded array elements.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    marker = '"{}"'.format(key)
+    chunks = iter(chunks)
+    buffer = ''
+    position = None
+
+    def read_more():
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                return text
+        return None
+
+    # Find the marker, keeping enough of the buffer that a marker split across chunks is still found.
+    while position is None:
+        index = buffer.find(marker)
+        if index >= 0:
+            position = index + len(marker)
+            break
+        buffer = buffer[-len(marker):]
+        text = read_more()
+        if text is None:
+            return
+        buffer += text
+
+    # Skip the colon and opening bracket, then decode elements until the closing bracket.
+    expected = [':', '[']
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer):
+            text = read_more()
+            if text is None:
+                raise ValueError('Unexpected end of document while parsing {}.'.format(key))
+            buffer = buffer[position:] + text
+            position = 0
+            continue
+
+        if expected:
+            if buffer[position] != expected[0]:
+                raise ValueError('Expected {!r} after {} but found {!r}.'.format(expected[0], marker, buffer[position]))
+            expected.pop(0)
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            text = read_more()
+            if text is None:
+                raise
+            buffer = buffer[position:] + text
+            position = 0
+            continue
+
+        yield element
+        position = end
+        if position > len(buffer) // 2:
+            buffer = buffer[position:]
+            position = 0
+
+
+def to_arrival(visit):
+    """
+    Converts a MonitoredStopVisit from the StopMonitoring API to an Arrival.
+    :param visit: A MonitoredStopVisit dict.
+    :return: A model.Arrival, or None if the visit has neither an expected nor an aimed arrival time.
+    """
+    fields = _get_journey_fields(visit['MonitoredVehicleJourney'])
+    return _to_arrival(fields, _to_epoch(fields[-2]), _to_epoch(fields[-1]))
+
+
+def to_arrivals(visits):
+    """
+    Converts MonitoredStopVisits from the StopMonitoring API to Arrivals, parsing their arrival times as columns.
+    :param visits: A list of MonitoredStopVisit dicts.
+    :return: A list of model.Arrival sorted by arrival time. Visits with neither an expected nor an aimed arrival
+             time are left out.
+    """
+    rows = [_get_journey_fields(visit['MonitoredVehicleJourney']) for visit in visits]
+    arrivals = [arrival for arrival in _to_arrivals(rows) if arrival is not None]
+    arrivals.sort(key=lambda arrival: arrival.arrival_time)
+
+    return arrivals
+
+
+class StopSnapshot:
+    """
+    Upcoming arrivals for every stop of an agency at a point in time. Each stop holds parallel arrays, sorted by
+    arrival, of estimated and aimed arrival epochs, realtime flags, vehicle coordinates, and indexes into one shared
+    table of line, direction, destination and vehicle names, so a snapshot of the whole of Muni stays small.
+    """
+    def __init__(self, generated_at, strings, stops):
+        """
+        Constructs a new StopSnapshot instance. Use build() or from_bytes() rather than calling this directly.
+        :param generated_at: The epoch second the snapshot was taken at.
+        :param strings: A list of the line IDs, directions, destinations and vehicle references indexed by the stops.
+        :param stops: A dict mapping a stop ID to a tuple of arrays, one per model.Arrival field.
+        """
+        self.generated_at = generated_at
+        self.strings = strings
+        self.stops = stops
+
+    def get_arrivals(self, stop_id, after=None):
+        """
+        Gets the upcoming arrivals at a stop.
+        :param stop_id: The ID of the stop.
+        :param after: If given, arrivals estimated before this epoch second are left out.
+        :return: A list of model.Arrival sorted by arrival time, or None if the stop is not in the snapshot.
+        """
+        stop = self.stops.get(stop_id)
+        if stop is None:
+            return None
+
+        strings = self.strings
+        return [Arrival(strings[line], strings[direction], strings[destination], arrival_time, aimed_time,
+                        bool(realtime), strings[vehicle], _to_coordinate(latitude), _to_coordinate(longitude))
+                for line, direction, destination, arrival_time, aimed_time, realtime, vehicle, latitude, longitude
+                in zip(*stop) if after is None or arrival_time >= after]
+
+    def to_bytes(self):
+        """
+        Serializes the snapshot to compact JSON.
+        :return: The snapshot as UTF-8 bytes.
+        """
+        document = {
+            'generatedAt': self.generated_at,
+            'strings': self.strings,
+            'stops': {stop_id: [list(array_) for array_ in stop] for stop_id, stop in self.stops.items()}
+        }
+        return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def from_bytes(data):
+        """
+        Reads a snapshot written by to_bytes().
+        :param data: The serialized snapshot.
+        :return: A StopSnapshot instance.
+        """
+        document = json.loads(data.decode('utf-8'))
+        stops = {stop_id: _to_arrays(columns) for stop_id, columns in document['stops'].items()}
+
+        return StopSnapshot(document['generatedAt'], document['strings'], stops)
+
+    @staticmethod
+    def build(visits, generated_at):
+        """
+        Groups MonitoredStopVisit elements by stop.
+        :param visits: An iterable of MonitoredStopVisit dicts from the StopMonitoring API.
+        :param generated_at: The epoch second the visits were fetched at.
+        :return: A StopSnapshot instance.
+        """
+        stop_ids = []
+        rows = []
+        for visit in visits:
+            stop_ids.append(visit['MonitoringRef'])
+            rows.append(_get_journey_fields(visit['MonitoredVehicleJourney']))
+
+        string_indexes = {}
+        grouped = {}
+        for stop_id, arrival in zip(stop_ids, _to_arrivals(rows)):
+            if arrival is None:
+                continue
+            grouped.setdefault(stop_id, []).append((
+                string_indexes.setdefault(arrival.line, len(string_indexes)),
+                string_indexes.setdefault(arrival.direction, len(string_indexes)),
+                string_indexes.setdefault(arrival.destination, len(string_indexes)),
+                arrival.arrival_time,
+                arrival.aimed_time if arrival.aimed_time is not None else arrival.arrival_time,
+                int(arrival.realtime),
+                string_indexes.setdefault(arrival.vehicle, len(string_indexes)),
+                _from_coordinate(arrival.latitude),
+                _from_coordinate(arrival.longitude)
+            ))
+
+        stops = {}
+        for stop_id, arrivals in grouped.items():
+            arrivals.sort(key=lambda arrival: arrival[3])
+            stops[stop_id] = _to_arrays(list(zip(*arrivals)))
+
+        return StopSnapshot(generated_at, _by_index(string_indexes), stops)
+
+
+class FileSnapshotStore:
+    """Publishes snapshots to a file on a filesystem shared by the ingest job and its readers."""
+    def __init__(self, path):
+        """
+        Constructs a new FileSnapshotStore instance.
+        :param path: The path of the snapshot file.
+        """
+        self.path = path
+
+    def publish(self, snapshot):
+        """
+        Replaces the published snapshot. The file is written under a temporary name and renamed so readers never see a
+        partially written snapshot.
+        :param snapshot: The StopSnapshot to publish.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary_path = '{}.{}.{}'.format(self.path, os.getpid(), threading.get_ident())
+        with open(temporary_path, 'wb') as snapshot_file:
+            snapshot_file.write(snapshot.to_bytes())
+        os.replace(temporary_path, self.path)
+
+    def load(self):
+        """
+        Reads the published snapshot.
+        :return: A StopSnapshot, or None if none has been published.
+        """
+        try:
+            with open(self.path, 'rb') as snapshot_file:
+                return StopSnapshot.from_bytes(snapshot_file.read())
+        except FileNotFoundError:
+            return None
+
+
+class S3SnapshotStore:
+    """Publishes snapshots to an S3 object."""
+    def __init__(self, s3_client, bucket, key):
+        """
+        Constructs a new S3SnapshotStore instance.
+        :param s3_client: A boto3 S3 client.
+        :param bucket: The bucket holding the snapshot.
+        :param key: The key of the snapshot object.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+
+    @timed('S3SnapshotStore.publish')
+    def publish(self, snapshot):
+        """
+        Replaces the published snapshot.
+        :param snapshot: The StopSnapshot to publish.
+        """
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=snapshot.to_bytes())
+
+    @timed('S3SnapshotStore.load')
+    def load(self):
+        """
+        Reads the published snapshot.
+        :return: A StopSnapshot, or None if none has been published.
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+        except botocore_exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise
+
+        return StopSnapshot.from_bytes(response['Body'].read())
+
+
+def ingest_stop_monitoring(five_eleven_client, agency, snapshot_store, clock=time.time):
+    """
+    Pulls every upcoming visit for an agency in one streamed request and publishes them as a snapshot.
+    :param five_eleven_client: A FiveElevenClient instance.
+    :param agency: The agency to ingest (ex: 'SF').
+    :param snapshot_store: A FileSnapshotStore or S3SnapshotStore to publish to.
+    :param clock: A callable returning the current epoch time in seconds, used for testing.
+    :return: The published StopSnapshot.
+    """
+    generated_at = int(clock())
+    snapshot = StopSnapshot.build(five_eleven_client.iter_agency_stop_visits(agency), generated_at)
+    snapshot_store.publish(snapshot)
+    LOG.info('Published a snapshot of {} stops for {}.'.format(len(snapshot.stops), agency))
+
+    return snapshot
+
+
+def _get_journey_fields(journey):
+    call = journey['MonitoredCall']
+    location = journey.get('VehicleLocation') or {}
+    return (journey['LineRef'], journey['DirectionRef'], journey.get('DestinationName'), journey.get('VehicleRef'),
+            _parse_coordinate(location.get('Latitude')), _parse_coordinate(location.get('Longitude')),
+            call.get('AimedArrivalTime'), call.get('ExpectedArrivalTime'))
+
+
+def _to_arrivals(rows):
+    aimed_times = parse_epochs([row[-2] for row in rows])
+    expected_times = parse_epochs([row[-1] for row in rows])
+    return [_to_arrival(row, aimed_time, expected_time)
+            for row, aimed_time, expected_time in zip(rows, aimed_times, expected_times)]
+
+
+def _to_arrival(fields, aimed_time, expected_time):
+    line, direction, destination, vehicle, latitude, longitude = fields[:6]
+    if expected_time is not None:
+        return Arrival(line, direction, destination, expected_time, aimed_time, True, vehicle, latitude, longitude)
+    if aimed_time is not None:
+        return Arrival(line, direction, destination, aimed_time, aimed_time, False, vehicle, latitude, longitude)
+    return None
+
+
+def _to_epoch(iso_date):
+    return parse_epoch(iso_date) if iso_date else None
+
+
+def _parse_coordinate(value):
+    try:
+        return float(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def _from_coordinate(value):
+    return value if value is not None else _NAN
+
+
+def _to_coordinate(value):
+    return value if value == value else None
+
+
+def _to_arrays(columns):
+    return tuple(array(typecode, column) for typecode, column in zip(_COLUMN_TYPECODES, columns))
+
+
+def _by_index(indexes):
+    values = [None] * len(indexes)
+    for value, index in indexes.items():
+        values[index] = value
+    return values
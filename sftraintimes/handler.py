@@ -1,8 +1,15 @@
-import datetime
+import time
 
-from sftraintimes.config import get_user_service, get_logger, get_setup_controller, get_stop_service
-from sftraintimes.model import Direction
-from sftraintimes.util import ResponseBuilder, parse_datetime, parse_street
+from concurrent.futures import Future
+
+from sftraintimes.config import get_user_service, get_logger, get_setup_controller, get_stop_service, get_executor, \
+    get_api_key_provider, get_five_eleven_client, get_snapshot_store, get_metrics_recorder, get_line_service
+from sftraintimes.feed import ingest_stop_monitoring
+from sftraintimes.model import ArrivalSource, Direction
+from sftraintimes.resilience import Deadline, current_deadline, deadline_scope
+from sftraintimes.router import IntentRouter
+from sftraintimes.service import AGENCY
+from sftraintimes.util import ResponseBuilder, StaticResponse, normalize_street_name
 
 LOG = get_logger()
 
@@ -14,11 +21,30 @@ HELP_INTENT_MESSAGE = 'I can give you train arrival times for the stop closest t
 FALLBACK_INTENT_MESSAGE = 'Sorry, I don\'t think I can help with that. Some things you can ask me are, get the next ' \
                           'train, or, set my home stop.'
 LAUNCH_INTENT_MESSAGE = 'Welcome to train times. '
+STALE_ARRIVALS_CAVEAT = ' Live times are delayed right now, so this may be a few minutes off.'
+SCHEDULED_ARRIVALS_CAVEAT = ' Live times aren\'t available right now, so this is from the schedule.'
+ARRIVAL_CAVEATS = {
+    ArrivalSource.STALE: STALE_ARRIVALS_CAVEAT,
+    ArrivalSource.SCHEDULE: SCHEDULED_ARRIVALS_CAVEAT
+}
+LAUNCH_RESPONSE = StaticResponse(LAUNCH_INTENT_MESSAGE + HELP_INTENT_MESSAGE)
+HELP_RESPONSE = StaticResponse(HELP_INTENT_MESSAGE)
+FALLBACK_RESPONSE = StaticResponse(FALLBACK_INTENT_MESSAGE)
+USER_SESSION_ATTRIBUTE = 'user'
+PREWARM_STOP_COUNT = 50
+PREWARM_ROUNDS = 1
+PREWARM_INTERVAL = 20
+PATTERN_REFRESH_LINE_IDS = ['KJ', 'L', 'M', 'N', 'T']
+# Seconds a request may take, well inside the 8 seconds Alexa waits, less the time kept back to build the response.
+RESPONSE_BUDGET = 4.0
+RESPONSE_RESERVE = 0.3
 
 
 def handle_request(event, context):
     """
-    Handles an incoming lambda event.
+    Handles an incoming lambda event. When the invocation is sampled, its latency and the time spent in each call to
+    AWS and 511 are written to stdout as CloudWatch metrics. The request's deadline is the sooner of RESPONSE_BUDGET
+    seconds and the Lambda timeout, and calls to 511 that would run past it are cut short.
     :param event: The lambda event.
     :param context: The lambda context object.
     :return: An Alexa response object.
@@ -26,22 +52,102 @@ def handle_request(event, context):
     request = event['request']
     session = event['session']
 
-    try:
-        if request['type'] == 'LaunchRequest':
-            return on_launch()
-        elif request['type'] == 'IntentRequest':
-            return on_intent(request, session)
-        else:
-            raise ValueError('Unrecognized request type: {}'.format(request))
-
-    except Exception as e:
-        LOG.exception(e)
-        output_speech_text = 'Sorry, something went wrong.'
-        response = ResponseBuilder(output_speech_text=output_speech_text).build()
+    with get_metrics_recorder().invocation(_get_request_name(request)), \
+            deadline_scope(Deadline.from_context(context, RESPONSE_BUDGET, RESPONSE_RESERVE)):
+        try:
+            if request['type'] == 'LaunchRequest':
+                return on_launch()
+            elif request['type'] == 'IntentRequest':
+                return on_intent(request, session)
+            else:
+                raise ValueError('Unrecognized request type: {}'.format(request))
+
+        except Exception as e:
+            LOG.exception(e)
+            output_speech_text = 'Sorry, something went wrong.'
+            response = ResponseBuilder(output_speech_text=output_speech_text).build()
 
     return response
 
 
+def handle_prewarm_event(event, context, stop_service=None, user_service=None):
+    """
+    Handles a scheduled lambda event by loading upcoming arrivals for the most popular home stops into the shared visit
+    cache. The event may override how many stops are warmed ('stopCount'), and how many times ('rounds') and how many
+    seconds apart ('interval') they are warmed during the invocation, so a once-a-minute schedule can keep entries
+    fresher than a minute.
+    :param event: The scheduled lambda event.
+    :param context: The lambda context object.
+    :param stop_service: A StopService instance.
+    :param user_service: A UserService instance.
+    :return: A dict containing the stop IDs warmed and the number of them warmed in each round.
+    """
+    stop_service = get_stop_service() if not stop_service else stop_service
+    user_service = get_user_service() if not user_service else user_service
+    stop_count = int(event.get('stopCount', PREWARM_STOP_COUNT))
+    rounds = int(event.get('rounds', PREWARM_ROUNDS))
+    interval = float(event.get('interval', PREWARM_INTERVAL))
+
+    stop_ids = user_service.get_popular_home_stop_ids(stop_count)
+    warmed = []
+    for round_number in range(rounds):
+        started = time.time()
+        warmed.append(stop_service.prewarm_upcoming_arrivals(stop_ids, get_executor()))
+
+        if round_number == rounds - 1 or context.get_remaining_time_in_millis() < 2 * interval * 1000:
+            break
+        time.sleep(max(0.0, interval - (time.time() - started)))
+
+    return {'stopIds': stop_ids, 'warmed': warmed}
+
+
+def handle_ingest_event(event, context, five_eleven_client=None, snapshot_store=None):
+    """
+    Handles a scheduled lambda event by pulling upcoming arrivals for every stop of the agency in one request and
+    publishing them as the snapshot StopService reads.
+    :param event: The scheduled lambda event.
+    :param context: The lambda context object.
+    :param five_eleven_client: A FiveElevenClient instance.
+    :param snapshot_store: A feed.FileSnapshotStore or feed.S3SnapshotStore to publish to.
+    :return: A dict containing the snapshot's timestamp and the number of stops in it.
+    """
+    five_eleven_client = get_five_eleven_client() if not five_eleven_client else five_eleven_client
+    snapshot_store = get_snapshot_store() if not snapshot_store else snapshot_store
+    if snapshot_store is None:
+        raise ValueError('No snapshot store is configured.')
+
+    snapshot = ingest_stop_monitoring(five_eleven_client, AGENCY, snapshot_store)
+
+    return {'generatedAt': snapshot.generated_at, 'stopCount': len(snapshot.stops)}
+
+
+def handle_refresh_patterns_event(event, context, line_service=None):
+    """
+    Handles a scheduled lambda event by fetching the journey patterns of each line from 511 and storing those that
+    changed, so requests never wait on 511 for them. The event may override which lines are refreshed ('lineIds').
+    :param event: The scheduled lambda event.
+    :param context: The lambda context object.
+    :param line_service: A LineService instance.
+    :return: A dict containing the line IDs refreshed, those whose patterns changed, and those that failed.
+    """
+    line_service = get_line_service() if not line_service else line_service
+    line_ids = event.get('lineIds', PATTERN_REFRESH_LINE_IDS)
+
+    changed = []
+    failed = []
+    for line_id in line_ids:
+        try:
+            if line_service.refresh_patterns_for_line(line_id):
+                changed.append(line_id)
+        except Exception:
+            LOG.warning('Failed to refresh the patterns for line {}.'.format(line_id), exc_info=True)
+            failed.append(line_id)
+    if failed and len(failed) == len(line_ids):
+        raise RuntimeError('Failed to refresh the patterns for every line.')
+
+    return {'lineIds': line_ids, 'changed': changed, 'failed': failed}
+
+
 def on_launch():
     """Handles a LaunchRequest from Alexa."""
     return handle_launch_request()
@@ -54,23 +160,7 @@ def on_intent(request, session):
     :param session: The session object from the lambda event.
     :return: An Alexa response object.
     """
-    intent_name = request['intent']['name']
-
-    if intent_name == 'SetHomeStopByIdIntent':
-        response = handle_set_home_stop_by_id_intent(request, session)
-    elif intent_name == 'SetHomeStopIntent':
-        response = handle_set_home_stop_intent(request, session)
-    elif intent_name == 'GetNextTrainIntent':
-        response = handle_get_next_train_intent(session)
-    elif intent_name == 'AMAZON.HelpIntent':
-        response = handle_help_intent()
-    elif intent_name == 'AMAZON.FallbackIntent':
-        response = handle_fallback_intent()
-    else:
-        LOG.warning('Unrecognized IntentRequest: {}'.format(request))
-        response = handle_fallback_intent()
-
-    return response
+    return ROUTER.dispatch(request, session)
 
 
 def handle_launch_request():
@@ -78,8 +168,7 @@ def handle_launch_request():
     Handles a launch request.
     :return: A dict containing the Alexa response.
     """
-    output_speech_text = LAUNCH_INTENT_MESSAGE + HELP_INTENT_MESSAGE
-    return ResponseBuilder(output_speech_text=output_speech_text).build()
+    return LAUNCH_RESPONSE.build()
 
 
 def handle_set_home_stop_intent(request, session, user_service=None, setup_controller=None):
@@ -105,30 +194,24 @@ def handle_set_home_stop_intent(request, session, user_service=None, setup_contr
             slots['direction']['resolutions']['resolutionsPerAuthority'][0]['values'][0]['value']['name'])
         first_street = slots['firstStreet']['value']
         second_street = slots['secondStreet']['value']
-        first_st = parse_street(first_street)
-        second_st = parse_street(second_street)
-        stop_name = '{} & {}'.format(first_st, second_st)
         long_stop_name = '{} and {}'.format(first_street, second_street)
+        stop_name = normalize_street_name(long_stop_name)
 
         home_stop_id = setup_controller.get_stop_id(line_id, stop_name, direction)
 
         user_id = session['user']['userId']
-        user = user_service.get_user(user_id)
-
-        if user is None:
-            user = {'id': user_id, 'homeStopId': home_stop_id}
-            user_service.add_user(user)
-        else:
-            user_service.update_user(user_id, homeStopId=home_stop_id)
+        _, user = user_service.upsert_user(user_id, homeStopId=home_stop_id, homeStopLine=line_id,
+                                           homeStopDirection=direction.value)
 
         output_speech_text = 'I\'ve set your home stop to {} on the {} {} line'.format(long_stop_name,
                                                                                        direction.to_string(), line_id)
 
-        response = ResponseBuilder(output_speech_text=output_speech_text).build()
+        session_attributes = _cache_user(session, user)
+        response = ResponseBuilder(output_speech_text=output_speech_text, session_attributes=session_attributes).build()
     else:
         response = {
             'version': '1.0',
-            'sessionAttributes': {},
+            'sessionAttributes': _get_session_attributes(session),
             'response': {}
         }
         response['response']['directives'] = [
@@ -158,70 +241,119 @@ def handle_set_home_stop_by_id_intent(request, session, user_service=None):
 
     home_stop_id = request['intent']['slots']['stopId']['value']
     user_id = session['user']['userId']
-    user = user_service.get_user(user_id)
-
-    if user is None:
-        user = {'id': user_id, 'homeStopId': home_stop_id}
-        user_service.add_user(user)
-    else:
-        user_service.update_user(user_id, homeStopId=home_stop_id)
+    _, user = user_service.upsert_user(user_id, homeStopId=home_stop_id)
 
     output_speech_text = 'I\'ve set your home stop to {}.'.format(home_stop_id)
-    response = ResponseBuilder(output_speech_text=output_speech_text).build()
+    session_attributes = _cache_user(session, user)
+    response = ResponseBuilder(output_speech_text=output_speech_text, session_attributes=session_attributes).build()
 
     return response
 
 
-def handle_get_next_train_intent(session, stop_service=None, user_service=None):
+def handle_get_next_train_intent(session, stop_service=None, user_service=None, deadline=None):
     """
-    Handles a GetNextTrainIntent request.
+    Handles a GetNextTrainIntent request. When live arrivals cannot be had in time, older or scheduled arrivals are
+    given instead with a caveat saying so.
     :param session: The Alexa session object.
     :param stop_service: A StopController instance.
     :param user_service: A UserService instance.
+    :param deadline: An optional resilience.Deadline the response is needed by.
     :return: An Alexa response object.
     """
-    stop_service = get_stop_service() if not stop_service else stop_service
-    user_service = get_user_service() if not user_service else user_service
+    executor = get_executor()
+    stop_service_future = _completed_future(stop_service) if stop_service else executor.submit(_build_stop_service)
 
-    user_id = session['user']['userId']
-    user = user_service.get_user(user_id)
+    # Earlier turns in this session may have resolved the user already, in which case DynamoDB is skipped entirely.
+    user = _get_cached_user(session)
+    if user is None:
+        user_service = get_user_service() if not user_service else user_service
+        user = user_service.get_user(session['user']['userId'])
     if user is None:
         output_speech_text = 'Sorry, you\'ll need to set your home stop before asking for train times.'
-        response = ResponseBuilder(output_speech_text=output_speech_text).build()
+        response = ResponseBuilder(output_speech_text=output_speech_text,
+                                   session_attributes=_get_session_attributes(session)).build()
         return response
 
-    next_stops = stop_service.get_upcoming_visits(user['homeStopId'])
-    diff_min = _get_wait_time(next_stops[0]['MonitoredVehicleJourney']['MonitoredCall']['AimedArrivalTime'])
+    session_attributes = _cache_user(session, user)
+    upcoming = stop_service_future.result().lookup_upcoming_arrivals(user['homeStopId'], deadline)
+    next_arrivals = upcoming.arrivals
+    diff_min = _get_wait_time(next_arrivals[0].arrival_time)
 
-    if diff_min < 5:
-        next_visit_diff = _get_wait_time(next_stops[1]['MonitoredVehicleJourney']['MonitoredCall']['AimedArrivalTime'])
+    if diff_min < 5 and len(next_arrivals) > 1:
+        next_visit_diff = _get_wait_time(next_arrivals[1].arrival_time)
         output_speech_text = NEXT_TWO_TRAINS_MESSAGE.format(diff_min, next_visit_diff)
-        response = ResponseBuilder(output_speech_text=output_speech_text).build()
     else:
         output_speech_text = NEXT_TRAIN_MESSAGE.format(diff_min)
-        response = ResponseBuilder(output_speech_text=output_speech_text).build()
+    output_speech_text += ARRIVAL_CAVEATS.get(upcoming.source, '')
+    response = ResponseBuilder(output_speech_text=output_speech_text, session_attributes=session_attributes).build()
 
     return response
 
 
-def handle_help_intent():
+def handle_help_intent(session=None):
     """
     Handles the built-in AMAZON.HelpIntent.
+    :param session: The Alexa session object, whose attributes are carried into the response.
     :return: An Alexa response object.
     """
-    return ResponseBuilder(output_speech_text=HELP_INTENT_MESSAGE).build()
+    return HELP_RESPONSE.build(_get_session_attributes(session))
 
 
-def handle_fallback_intent():
+def handle_fallback_intent(session=None):
     """
     Handles the built-in AMAZON.FallbackIntent
+    :param session: The Alexa session object, whose attributes are carried into the response.
     :return: An Alexa response object.
     """
-    return ResponseBuilder(output_speech_text=FALLBACK_INTENT_MESSAGE).build()
+    return FALLBACK_RESPONSE.build(_get_session_attributes(session))
+
+
+# Unrecognized intents are logged by the router and answered like AMAZON.FallbackIntent.
+ROUTER = IntentRouter(fallback=lambda request, session: handle_fallback_intent(session))
+ROUTER.register(handle_set_home_stop_by_id_intent, 'SetHomeStopByIdIntent')
+ROUTER.register(handle_set_home_stop_intent, 'SetHomeStopIntent')
+ROUTER.register(lambda request, session: handle_get_next_train_intent(session, deadline=current_deadline()),
+                'GetNextTrainIntent')
+ROUTER.register(lambda request, session: handle_help_intent(session), 'AMAZON.HelpIntent')
+ROUTER.register(lambda request, session: handle_fallback_intent(session), 'AMAZON.FallbackIntent')
+
+
+def _get_request_name(request):
+    intent = request.get('intent')
+    return intent.get('name') if intent else request.get('type')
+
+
+def _build_stop_service():
+    stop_service = get_stop_service()
+    get_api_key_provider().get_key()
+    return stop_service
+
+
+def _get_session_attributes(session):
+    if not session:
+        return {}
+    return dict(session.get('attributes') or {})
+
+
+def _get_cached_user(session):
+    user = _get_session_attributes(session).get(USER_SESSION_ATTRIBUTE)
+    if user and user.get('id') == session['user']['userId'] and user.get('homeStopId'):
+        return user
+    return None
+
+
+def _cache_user(session, user):
+    session_attributes = _get_session_attributes(session)
+    session_attributes[USER_SESSION_ATTRIBUTE] = user
+    return session_attributes
+
 
+def _completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
 
-def _get_wait_time(arrival_time):
-    arrival = parse_datetime(arrival_time)
-    diff = arrival - datetime.datetime.utcnow()
 
-    return int(diff.total_seconds() // 60)
+def _get_wait_time(arrival_epoch):
+    # An arrival a few seconds past its estimate is kept while the train may still be at the platform.
+    return max(0, int((arrival_epoch - time.time()) // 60))
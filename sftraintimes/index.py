@@ -0,0 +1,151 @@
+"""
+Builds and loads the stop-name index used to resolve spoken stop names to stop IDs without calling 511.
+
+To refresh the bundled index offline, run from the repository root with a 511 API key in FIVE_ELEVEN_API_KEY:
+
+    python -m sftraintimes.index KJ L M N T
+"""
+import argparse
+import json
+import os
+from os import environ
+
+from sftraintimes.matching import StopMatch, StopMatcher
+from sftraintimes.util import normalize_street_name
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(__file__), 'data', 'stop_index.json')
+
+
+class StopIndex:
+    """Maps a (line, direction, normalized stop name) triple to a stop ID."""
+    def __init__(self):
+        """Constructs a new, empty StopIndex instance."""
+        self._stop_ids = {}
+        self._lines = {}
+        self._matchers = {}
+
+    def has_line(self, line_id):
+        """
+        Checks whether the index holds stops for a line.
+        :param line_id: The ID of the line.
+        :return: True if the line has been added to the index.
+        """
+        return line_id in self._lines
+
+    def get_stop_id(self, line_id, direction, stop_name):
+        """
+        Gets a stop ID from a stop's human-readable name.
+        :param line_id: The line the stop lies on.
+        :param direction: The direction reference of the stop ('IB' or 'OB').
+        :param stop_name: The name of the stop (ex: 'church st & 24th st').
+        :return: The ID of the stop, or None if it is not in the index.
+        """
+        return self._stop_ids.get((line_id, direction, normalize_street_name(stop_name)))
+
+    def find_stop(self, line_id, direction, stop_name, min_confidence=StopMatcher.DEFAULT_MIN_CONFIDENCE):
+        """
+        Finds the stop best matching a human-readable name, tolerating speech-recognition variance. An exact match is
+        returned with a confidence of 1.0; otherwise the closest stop on the line and direction is returned.
+        :param line_id: The line the stop lies on.
+        :param direction: The direction reference of the stop ('IB' or 'OB').
+        :param stop_name: The name of the stop (ex: 'church st & 24th st').
+        :param min_confidence: The lowest confidence, between 0 and 1, accepted as a match.
+        :return: A matching.StopMatch, or None if no stop matches closely enough.
+        """
+        normalized_name = normalize_street_name(stop_name)
+        stop_id = self._stop_ids.get((line_id, direction, normalized_name))
+        if stop_id is not None:
+            return StopMatch(stop_id, normalized_name, 1.0)
+
+        matcher = self._get_matcher(line_id, direction)
+        return matcher.match(normalized_name, min_confidence) if matcher is not None else None
+
+    def add_line(self, line_id, patterns):
+        """
+        Adds every stop on a line to the index, replacing any stops previously indexed for it. When patterns disagree
+        on a name, the first stop point seen wins, matching the order SetupController has always searched them in.
+        :param line_id: The ID of the line.
+        :param patterns: The journey patterns for the line, as returned by LineService.get_patterns_for_line.
+        """
+        stops = {}
+        for journey_pattern in patterns:
+            direction = journey_pattern['DirectionRef']
+            points = journey_pattern['PointsInSequence']
+            for point in points.get('StopPointInJourneyPattern', []) + points.get('TimingPointInJourneyPattern', []):
+                stops.setdefault(direction, {}).setdefault(point['Name'], point['ScheduledStopPointRef'])
+
+        self._add_stops(line_id, stops)
+
+    def to_dict(self):
+        """
+        Gets the contents of the index in the format written by save().
+        :return: A dict of the form {line_id: {direction: {stop_name: stop_id}}}.
+        """
+        return {line_id: {direction: dict(names) for direction, names in directions.items()}
+                for line_id, directions in self._lines.items()}
+
+    def save(self, path=DEFAULT_INDEX_PATH):
+        """
+        Writes the index to a compact JSON file.
+        :param path: The path of the file to write.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as index_file:
+            json.dump(self.to_dict(), index_file, separators=(',', ':'), sort_keys=True)
+
+    @staticmethod
+    def load(path=DEFAULT_INDEX_PATH):
+        """
+        Reads an index written by save().
+        :param path: The path of the file to read.
+        :return: A StopIndex instance, empty if the file does not exist.
+        """
+        index = StopIndex()
+        if not os.path.exists(path):
+            return index
+
+        with open(path, encoding='utf-8') as index_file:
+            for line_id, stops in json.load(index_file).items():
+                index._add_stops(line_id, stops)
+
+        return index
+
+    def _add_stops(self, line_id, stops):
+        for key in [key for key in self._stop_ids if key[0] == line_id]:
+            del self._stop_ids[key]
+
+        self._lines[line_id] = stops
+        for key in [key for key in self._matchers if key[0] == line_id]:
+            del self._matchers[key]
+        for direction, names in stops.items():
+            for name, stop_id in names.items():
+                self._stop_ids.setdefault((line_id, direction, normalize_street_name(name)), stop_id)
+
+    def _get_matcher(self, line_id, direction):
+        key = (line_id, direction)
+        if key not in self._matchers:
+            names = self._lines.get(line_id, {}).get(direction)
+            if not names:
+                return None
+            self._matchers[key] = StopMatcher({normalize_street_name(name): stop_id for name, stop_id in names.items()})
+        return self._matchers[key]
+
+
+def main():
+    from sftraintimes.client import FiveElevenClient
+    from sftraintimes.service import LineService
+
+    parser = argparse.ArgumentParser(description='Rebuilds the bundled stop-name index from 511 journey patterns.')
+    parser.add_argument('line_ids', nargs='+', help='The lines to index (ex: KJ L M N T)')
+    parser.add_argument('--output', default=DEFAULT_INDEX_PATH, help='The path of the index file to write.')
+    args = parser.parse_args()
+
+    line_service = LineService(FiveElevenClient(api_key=environ['FIVE_ELEVEN_API_KEY']))
+    index = StopIndex.load(args.output)
+    for line_id in args.line_ids:
+        index.add_line(line_id, line_service.get_patterns_for_line(line_id))
+    index.save(args.output)
+
+
+if __name__ == '__main__':
+    main()
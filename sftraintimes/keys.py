@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+import time
+from os import environ
+
+from sftraintimes.metrics import timed
+
+LOG = logging.getLogger('log')
+
+
+class S3KeySource:
+    """Loads the 511 API key from a JSON document stored in S3."""
+    def __init__(self, s3_client, bucket, path):
+        """
+        Constructs a new S3KeySource instance.
+        :param s3_client: A boto3 S3 client.
+        :param bucket: The bucket holding the key document.
+        :param path: The object key of the document (ex: 'five_eleven_keys.json').
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.path = path
+
+    @timed('S3KeySource.load')
+    def load(self):
+        """
+        Reads the key document from S3.
+        :return: The API key.
+        """
+        body = self.s3_client.get_object(Bucket=self.bucket, Key=self.path)['Body'].read()
+        return _parse_key_document(body.decode('utf-8'))
+
+
+class FileKeySource:
+    """Loads the 511 API key from a JSON document on the local filesystem."""
+    def __init__(self, path):
+        """
+        Constructs a new FileKeySource instance.
+        :param path: The path of a file with the same contents as the S3 key document.
+        """
+        self.path = path
+
+    def load(self):
+        """
+        Reads the key document from disk.
+        :return: The API key.
+        """
+        with open(self.path, encoding='utf-8') as key_file:
+            return _parse_key_document(key_file.read())
+
+
+class EnvironmentKeySource:
+    """Loads the 511 API key from an environment variable."""
+    def __init__(self, variable):
+        """
+        Constructs a new EnvironmentKeySource instance.
+        :param variable: The name of the environment variable holding the raw key.
+        """
+        self.variable = variable
+
+    def load(self):
+        """
+        Reads the key from the environment.
+        :return: The API key.
+        """
+        key = environ.get(self.variable)
+        if not key:
+            raise KeyError('Environment variable {} is not set.'.format(self.variable))
+        return key
+
+
+class ApiKeyProvider:
+    """
+    Serves the 511 API key from memory. Only the first call blocks on the key source; after that the key is refreshed
+    on a background thread once it is within refresh_margin seconds of its TTL, and the last good key keeps being served
+    if the source is slow or failing.
+    """
+    DEFAULT_TTL = 3600
+    DEFAULT_REFRESH_MARGIN = 300
+    DEFAULT_RETRY_INTERVAL = 30
+
+    def __init__(self, source, ttl=DEFAULT_TTL, refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 retry_interval=DEFAULT_RETRY_INTERVAL, clock=time.monotonic):
+        """
+        Constructs a new ApiKeyProvider instance.
+        :param source: An object with a load() method returning the key, such as S3KeySource.
+        :param ttl: Seconds a loaded key is considered fresh.
+        :param refresh_margin: Seconds before expiry at which a background refresh starts.
+        :param retry_interval: Seconds to wait before retrying after a failed refresh.
+        :param clock: A callable returning the current time in seconds, used for testing.
+        """
+        self.source = source
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._clock = clock
+        self._key = None
+        self._next_refresh_at = 0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def get_key(self):
+        """
+        Gets the API key. Blocks only when no key has been loaded yet.
+        :return: The API key.
+        """
+        if self._key is None:
+            with self._lock:
+                if self._key is None:
+                    self._store(self.source.load())
+            return self._key
+
+        if self._clock() >= self._next_refresh_at:
+            self._start_background_refresh()
+
+        return self._key
+
+    def refresh(self):
+        """
+        Reloads the key from its source on the calling thread. The previous key is kept if loading fails.
+        :return: True if a new key was loaded, False otherwise.
+        """
+        try:
+            key = self.source.load()
+        except Exception:
+            LOG.warning('Failed to refresh the 511 API key; serving the last good key.', exc_info=True)
+            with self._lock:
+                self._next_refresh_at = self._clock() + self.retry_interval
+            return False
+
+        with self._lock:
+            self._store(key)
+        return True
+
+    def _store(self, key):
+        self._key = key
+        self._next_refresh_at = self._clock() + max(self.ttl - self.refresh_margin, 0)
+
+    def _start_background_refresh(self):
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return
+            # Push the deadline out so concurrent callers don't queue up refreshes while this one runs.
+            self._next_refresh_at = self._clock() + self.retry_interval
+            self._refresh_thread = threading.Thread(target=self.refresh, name='api-key-refresh', daemon=True)
+            self._refresh_thread.start()
+
+
+def _parse_key_document(document):
+    return json.loads(document)['api_key']
@@ -0,0 +1,166 @@
+from collections import Counter, namedtuple
+
+
+StopMatch = namedtuple('StopMatch', ['stop_id', 'name', 'confidence'])
+
+_SOUNDEX_CODES = {letter: code
+                  for letters, code in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'),
+                                        ('r', '6'))
+                  for letter in letters}
+
+
+class StopMatcher:
+    """
+    Finds the stop whose name best matches a possibly misheard stop name. Candidates are drawn from a trigram index
+    over every stop name and pre-ranked by trigram and phonetic token overlap; only the few best are then scored with
+    normalized edit distance, so a lookup stays well under a millisecond even over every stop in the system.
+    """
+    DEFAULT_MIN_CONFIDENCE = 0.6
+    CANDIDATE_LIMIT = 16
+    MIN_SCORED = 2
+
+    def __init__(self, stops):
+        """
+        Constructs a new StopMatcher instance.
+        :param stops: A dict mapping normalized stop names (ex: 'church st & 24th st') to stop IDs.
+        """
+        self._names = list(stops)
+        self._stop_ids = [stops[name] for name in self._names]
+        self._name_trigrams = [_trigrams(name) for name in self._names]
+        self._token_codes = [_phonetic_tokens(name) for name in self._names]
+        self._trigram_index = {}
+        for position, trigrams in enumerate(self._name_trigrams):
+            for trigram in trigrams:
+                self._trigram_index.setdefault(trigram, []).append(position)
+        # Trigrams such as ' st' appear in most names and say little about which stop was meant.
+        self._common_threshold = max(self.CANDIDATE_LIMIT, len(self._names) // 8)
+
+    def match(self, query, min_confidence=DEFAULT_MIN_CONFIDENCE):
+        """
+        Gets the best matching stop for a stop name.
+        :param query: The normalized stop name to look for.
+        :param min_confidence: The lowest confidence, between 0 and 1, accepted as a match.
+        :return: A StopMatch, or None if no stop matches with at least min_confidence.
+        """
+        ranked = self.rank(query, limit=1)
+        if ranked and ranked[0].confidence >= min_confidence:
+            return ranked[0]
+        return None
+
+    def rank(self, query, limit=5):
+        """
+        Ranks the stops most similar to a stop name.
+        :param query: The normalized stop name to look for.
+        :param limit: The maximum number of stops to return.
+        :return: A list of StopMatch instances, most confident first.
+        """
+        query_variants = _street_orderings(query)
+        query_trigrams = [_trigrams(variant) for variant in query_variants]
+        query_codes = _phonetic_tokens(query)
+
+        postings = [self._trigram_index[trigram] for trigram in query_trigrams[0] if trigram in self._trigram_index]
+        selective_postings = [posting for posting in postings if len(posting) <= self._common_threshold] or postings
+        shared_trigrams = Counter()
+        for posting in selective_postings:
+            shared_trigrams.update(posting)
+
+        token_scores = {}
+        pre_scores = {}
+        best_variants = {}
+        for position, _ in shared_trigrams.most_common(self.CANDIDATE_LIMIT):
+            name_trigrams = self._name_trigrams[position]
+            trigram_score, best_variants[position] = max(
+                (_dice(trigrams, name_trigrams), variant) for trigrams, variant in zip(query_trigrams, query_variants))
+            token_scores[position] = _jaccard(query_codes, self._token_codes[position])
+            pre_scores[position] = trigram_score + token_scores[position]
+
+        matches = []
+        for position in sorted(pre_scores, key=pre_scores.get, reverse=True)[:max(limit, self.MIN_SCORED)]:
+            name = self._names[position]
+            edit_score = _edit_similarity(best_variants[position], name)
+            confidence = round((edit_score + token_scores[position]) / 2, 4)
+            matches.append(StopMatch(self._stop_ids[position], name, confidence))
+
+        matches.sort(key=lambda match: match.confidence, reverse=True)
+        return matches[:limit]
+
+
+def _trigrams(text):
+    padded = '  {} '.format(text)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _street_orderings(name):
+    streets = [street.strip() for street in name.split('&')]
+    if len(streets) != 2:
+        return [name]
+    return [name, '{} & {}'.format(streets[1], streets[0])]
+
+
+def _phonetic_tokens(name):
+    return frozenset(_soundex(token) for token in name.replace('&', ' ').split())
+
+
+def _soundex(token):
+    if not token.isalpha():
+        return token
+
+    code = token[0]
+    previous = _SOUNDEX_CODES.get(token[0], '')
+    for letter in token[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+        if letter not in 'hw':
+            previous = digit
+
+    return (code + '000')[:4]
+
+
+def _dice(first, second):
+    if not first and not second:
+        return 1.0
+    return 2 * len(first & second) / (len(first) + len(second))
+
+
+def _jaccard(first, second):
+    if not first and not second:
+        return 1.0
+    return len(first & second) / len(first | second)
+
+
+def _edit_similarity(first, second):
+    longest = max(len(first), len(second))
+    if longest == 0:
+        return 1.0
+    # Names more than a third rewritten are not worth an exact distance; they score as entirely different.
+    distance = _levenshtein(first, second, longest // 3)
+    return 1 - distance / longest if distance is not None else 0.0
+
+
+def _levenshtein(first, second, max_distance):
+    # Returns None as soon as the distance is known to exceed max_distance.
+    prefix = 0
+    while prefix < len(first) and prefix < len(second) and first[prefix] == second[prefix]:
+        prefix += 1
+    first, second = first[prefix:], second[prefix:]
+    while first and second and first[-1] == second[-1]:
+        first, second = first[:-1], second[:-1]
+
+    if len(first) < len(second):
+        first, second = second, first
+    if len(first) - len(second) > max_distance:
+        return None
+
+    previous_row = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current_row = [i]
+        for j, second_char in enumerate(second, 1):
+            current_row.append(min(previous_row[j] + 1,
+                                   current_row[j - 1] + 1,
+                                   previous_row[j - 1] + (first_char != second_char)))
+        if min(current_row) > max_distance:
+            return None
+        previous_row = current_row
+
+    return previous_row[-1]
@@ -0,0 +1,181 @@
+"""
+Lightweight per-invocation latency tracing. Calls to AWS, 511 and other slow dependencies are wrapped in named spans,
+and the durations recorded during a sampled invocation are written to stdout as a single CloudWatch Embedded Metric
+Format (EMF) log line, which CloudWatch turns into metrics without any API calls from the Lambda. Outside of a sampled
+invocation a span costs one global lookup.
+"""
+import functools
+import json
+import random
+import sys
+import threading
+import time
+
+NAMESPACE = 'TrainTimes'
+DIMENSION = 'Request'
+DURATION_METRIC = 'Duration'
+
+# The invocation being recorded. Lambda runs one invocation per container at a time, so it is shared by every thread,
+# which lets work handed to an executor record into it too.
+_invocation = None
+
+
+class Invocation:
+    """The spans recorded during one sampled invocation."""
+    def __init__(self, name):
+        """
+        Constructs a new Invocation instance.
+        :param name: The name the invocation's metrics are reported under, such as its intent name.
+        """
+        self.name = name
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def record(self, span_name, milliseconds):
+        """
+        Records the duration of a span. Spans with the same name are reported as one metric with several values.
+        :param span_name: The name of the span (ex: 'UserDAO.get_user').
+        :param milliseconds: How long the span took.
+        """
+        with self._lock:
+            self.spans.setdefault(span_name, []).append(round(milliseconds, 3))
+
+
+class MetricsRecorder:
+    """Decides which invocations are sampled and writes each sampled invocation's spans as an EMF log line."""
+    DEFAULT_SAMPLE_RATE = 1.0
+
+    def __init__(self, namespace=NAMESPACE, sample_rate=DEFAULT_SAMPLE_RATE, stream=None, sample=random.random,
+                 clock=time.time):
+        """
+        Constructs a new MetricsRecorder instance.
+        :param namespace: The CloudWatch namespace the metrics are published to.
+        :param sample_rate: The fraction of invocations to record, between 0 and 1.
+        :param stream: The file-like object EMF lines are written to. Defaults to sys.stdout at the time of writing.
+        :param sample: A callable returning a random float in [0, 1), used for testing.
+        :param clock: A callable returning the current epoch time in seconds, used for testing.
+        """
+        self.namespace = namespace
+        self.sample_rate = sample_rate
+        self.stream = stream
+        self._sample = sample
+        self._clock = clock
+
+    def invocation(self, name):
+        """
+        Records the spans of an invocation if it is sampled, and writes them out when it ends.
+        :param name: The name the invocation's metrics are reported under, such as its intent name.
+        :return: A context manager yielding the Invocation, or None if the invocation is not sampled.
+        """
+        return _InvocationContext(self, name)
+
+    def emit(self, invocation, milliseconds):
+        """
+        Writes an invocation's spans as a CloudWatch EMF log line.
+        :param invocation: The Invocation to write.
+        :param milliseconds: How long the whole invocation took.
+        """
+        metrics = {DURATION_METRIC: round(milliseconds, 3)}
+        metrics.update(invocation.spans)
+        document = {
+            '_aws': {
+                'Timestamp': int(self._clock() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [[DIMENSION]],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in metrics]
+                }]
+            },
+            DIMENSION: invocation.name
+        }
+        document.update(metrics)
+
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(json.dumps(document, separators=(',', ':')) + '\n')
+        stream.flush()
+
+
+class _InvocationContext:
+    def __init__(self, recorder, name):
+        self._recorder = recorder
+        self._name = name
+        self._invocation = None
+        self._started = None
+
+    def __enter__(self):
+        global _invocation
+        if self._recorder.sample_rate <= 0 or self._recorder._sample() >= self._recorder.sample_rate:
+            return None
+
+        self._invocation = _invocation = Invocation(self._name)
+        self._started = time.perf_counter()
+        return self._invocation
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _invocation
+        if self._invocation is None:
+            return
+        milliseconds = (time.perf_counter() - self._started) * 1000
+        _invocation = None
+        self._recorder.emit(self._invocation, milliseconds)
+
+
+class _Span:
+    __slots__ = ('_invocation', '_name', '_started')
+
+    def __init__(self, invocation, name):
+        self._invocation = invocation
+        self._name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._invocation.record(self._name, (time.perf_counter() - self._started) * 1000)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """
+    Times a block of code as part of the current invocation.
+    :param name: The name of the span (ex: 'S3KeySource.load').
+    :return: A context manager. It records nothing if no sampled invocation is in progress.
+    """
+    invocation = _invocation
+    if invocation is None:
+        return _NO_SPAN
+    return _Span(invocation, name)
+
+
+def timed(name):
+    """
+    Decorates a function to time each call to it as a span of the current invocation.
+    :param name: The name of the span (ex: 'UserDAO.get_user').
+    :return: A decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            invocation = _invocation
+            if invocation is None:
+                return func(*args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                invocation.record(name, (time.perf_counter() - started) * 1000)
+        return wrapper
+    return decorator
@@ -1,3 +1,4 @@
+from collections import namedtuple
 from enum import Enum
 
 
@@ -15,3 +16,35 @@ class Direction(Enum):
         if string == 'OB':
             return Direction.OUTBOUND
         raise ValueError('String {} does not match values for Direction.'.format(string))
+
+
+class Arrival(namedtuple('Arrival', ['line', 'direction', 'destination', 'arrival_time', 'aimed_time', 'realtime',
+                                     'vehicle', 'latitude', 'longitude'])):
+    """
+    An upcoming arrival of a train at a stop. arrival_time is the best estimate in epoch seconds: the realtime
+    prediction when realtime is True, otherwise the schedule. aimed_time is the scheduled time, and vehicle, latitude
+    and longitude identify and locate the train when 511 reports them.
+    """
+    __slots__ = ()
+
+    @property
+    def delay(self):
+        """Seconds the estimate is behind the schedule, or 0 if the schedule is unknown."""
+        return self.arrival_time - self.aimed_time if self.aimed_time is not None else 0
+
+
+Arrival.__new__.__defaults__ = (None, False, None, None, None)
+
+
+class ArrivalSource(Enum):
+    LIVE = 'live'
+    STALE = 'stale'
+    SCHEDULE = 'schedule'
+
+
+class UpcomingArrivals(namedtuple('UpcomingArrivals', ['arrivals', 'source'])):
+    """
+    The upcoming arrivals at a stop and where they came from: LIVE when they are current predictions, STALE when 511
+    could not be reached in time and older predictions were served, and SCHEDULE when only the timetable was available.
+    """
+    __slots__ = ()
@@ -0,0 +1,220 @@
+"""
+Stores each line's 511 journey patterns, which change only at service changes, so they are downloaded out of band
+rather than on every request, and derives from them the ordered stops each line serves in each direction.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+
+from sftraintimes.metrics import timed
+from sftraintimes.util import LazyModule
+
+botocore_exceptions = LazyModule('botocore.exceptions')
+
+DEFAULT_KEY_PREFIX = 'patterns/'
+
+
+class PatternRecord(namedtuple('PatternRecord', ['agency', 'line_id', 'version', 'fetched_at', 'patterns'])):
+    """
+    A line's journey patterns as fetched from 511. version is a hash of the patterns' content, so a refresh can tell
+    whether anything changed without comparing the patterns themselves.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def build(agency, line_id, patterns, fetched_at):
+        """
+        Builds a record, hashing the patterns for its version.
+        :param agency: The agency operating the line (ex: 'SF').
+        :param line_id: The ID of the line.
+        :param patterns: The journey patterns, as returned by LineService.get_patterns_for_line.
+        :param fetched_at: The epoch second the patterns were fetched at.
+        :return: A PatternRecord instance.
+        """
+        content = json.dumps(patterns, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return PatternRecord(agency, line_id, hashlib.sha256(content).hexdigest()[:16], fetched_at, patterns)
+
+    def to_bytes(self):
+        """
+        Serializes the record as JSON.
+        :return: The UTF-8 encoded document.
+        """
+        return json.dumps({'agency': self.agency, 'lineId': self.line_id, 'version': self.version,
+                           'fetchedAt': self.fetched_at, 'patterns': self.patterns},
+                          separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def from_bytes(data):
+        """
+        Reads a record written by to_bytes().
+        :param data: The UTF-8 encoded document.
+        :return: A PatternRecord instance.
+        """
+        document = json.loads(data.decode('utf-8'))
+        return PatternRecord(document['agency'], document['lineId'], document['version'], document['fetchedAt'],
+                             document['patterns'])
+
+
+class FilePatternStore:
+    """Keeps pattern records as JSON files in a directory, one per agency and line."""
+    def __init__(self, directory):
+        """
+        Constructs a new FilePatternStore instance.
+        :param directory: The directory holding the records. It is created on the first save.
+        """
+        self.directory = directory
+
+    def save(self, record):
+        """
+        Replaces the stored record for the record's agency and line. The file is written under a temporary name and
+        renamed so readers never see a partially written record.
+        :param record: The PatternRecord to store.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(record.agency, record.line_id)
+        temporary_path = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+        with open(temporary_path, 'wb') as record_file:
+            record_file.write(record.to_bytes())
+        os.replace(temporary_path, path)
+
+    def load(self, agency, line_id):
+        """
+        Reads the stored record for a line.
+        :param agency: The agency operating the line (ex: 'SF').
+        :param line_id: The ID of the line.
+        :return: A PatternRecord, or None if none has been stored.
+        """
+        try:
+            with open(self._path(agency, line_id), 'rb') as record_file:
+                return PatternRecord.from_bytes(record_file.read())
+        except FileNotFoundError:
+            return None
+
+    def _path(self, agency, line_id):
+        return os.path.join(self.directory, '{}-{}.json'.format(agency, line_id))
+
+
+class S3PatternStore:
+    """Keeps pattern records as S3 objects, one per agency and line."""
+    def __init__(self, s3_client, bucket, prefix=DEFAULT_KEY_PREFIX):
+        """
+        Constructs a new S3PatternStore instance.
+        :param s3_client: A boto3 S3 client.
+        :param bucket: The bucket holding the records.
+        :param prefix: The prefix of the records' keys.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    @timed('S3PatternStore.save')
+    def save(self, record):
+        """
+        Replaces the stored record for the record's agency and line.
+        :param record: The PatternRecord to store.
+        """
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._key(record.agency, record.line_id),
+                                  Body=record.to_bytes())
+
+    @timed('S3PatternStore.load')
+    def load(self, agency, line_id):
+        """
+        Reads the stored record for a line.
+        :param agency: The agency operating the line (ex: 'SF').
+        :param line_id: The ID of the line.
+        :return: A PatternRecord, or None if none has been stored.
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(agency, line_id))
+        except botocore_exceptions.ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise
+
+        return PatternRecord.from_bytes(response['Body'].read())
+
+    def _key(self, agency, line_id):
+        return '{}{}/{}.json'.format(self.prefix, agency, line_id)
+
+
+class LineTopology:
+    """
+    The ordered stops of each of a line's journey patterns, by direction. A line usually has several patterns per
+    direction, such as short turns and trips that start at the yard, and a stop is served if any pattern visits it.
+    """
+    def __init__(self, sequences):
+        """
+        Constructs a new LineTopology instance. Use from_patterns() to build one from 511 journey patterns.
+        :param sequences: A dict mapping each direction ('IB' or 'OB') to a list of stop ID tuples in travel order.
+        """
+        self.sequences = sequences
+        self._positions = {direction: [_get_positions(sequence) for sequence in direction_sequences]
+                           for direction, direction_sequences in sequences.items()}
+        self._stop_ids = {direction: frozenset(stop_id for sequence in direction_sequences for stop_id in sequence)
+                          for direction, direction_sequences in sequences.items()}
+
+    def serves_stop(self, stop_id, direction=None):
+        """
+        Checks whether the line stops at a stop.
+        :param stop_id: The ID of the stop.
+        :param direction: If given, only patterns in this direction ('IB' or 'OB') are considered.
+        :return: True if a pattern visits the stop.
+        """
+        if direction is not None:
+            return stop_id in self._stop_ids.get(direction, ())
+        return any(stop_id in stop_ids for stop_ids in self._stop_ids.values())
+
+    def get_stops_between(self, origin, destination, direction=None):
+        """
+        Gets the stops a train passes between two stops, taking the shortest pattern segment that runs from one to the
+        other.
+        :param origin: The ID of the stop boarded at.
+        :param destination: The ID of the stop alighted at.
+        :param direction: If given, only patterns in this direction ('IB' or 'OB') are considered.
+        :return: A list of stop IDs in travel order, excluding origin and destination, or None if no pattern runs from
+                 origin to destination.
+        """
+        directions = [direction] if direction is not None else sorted(self.sequences)
+        best = None
+        for candidate_direction in directions:
+            sequences = self.sequences.get(candidate_direction, [])
+            for sequence, positions in zip(sequences, self._positions.get(candidate_direction, [])):
+                start, end = positions.get(origin), positions.get(destination)
+                if start is None or end is None or end <= start:
+                    continue
+                if best is None or end - start - 1 < len(best):
+                    best = list(sequence[start + 1:end])
+
+        return best
+
+    @staticmethod
+    def from_patterns(patterns):
+        """
+        Builds the topology of a line.
+        :param patterns: The journey patterns for the line, as returned by LineService.get_patterns_for_line.
+        :return: A LineTopology instance.
+        """
+        sequences = {}
+        for journey_pattern in patterns:
+            points = journey_pattern['PointsInSequence']
+            points = points.get('StopPointInJourneyPattern', []) + points.get('TimingPointInJourneyPattern', [])
+            if all('Order' in point for point in points):
+                points = sorted(points, key=lambda point: int(point['Order']))
+
+            sequence = []
+            for point in points:
+                if not sequence or sequence[-1] != point['ScheduledStopPointRef']:
+                    sequence.append(point['ScheduledStopPointRef'])
+            if sequence:
+                sequences.setdefault(journey_pattern['DirectionRef'], []).append(tuple(sequence))
+
+        return LineTopology(sequences)
+
+
+def _get_positions(sequence):
+    positions = {}
+    for position, stop_id in enumerate(sequence):
+        positions.setdefault(stop_id, position)
+    return positions
@@ -0,0 +1,199 @@
+"""
+Keeps calls to 511 within the time Alexa allows for a response. A Deadline bounds how long a request may wait,
+call_hedged() sends a second copy of a slow call and takes whichever answers first, and a CircuitBreaker stops calling
+511 at all for a while after it has failed repeatedly, so callers go straight to their fallbacks.
+"""
+import contextlib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# The deadline of the request being handled. Lambda runs one invocation per container at a time, so like the current
+# metrics invocation it is shared by every thread.
+_deadline = None
+
+
+class DeadlineExceededError(RuntimeError):
+    """Raised when a call is cut short because its deadline passed."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of making a call while its circuit breaker is open."""
+
+
+class Deadline:
+    """A point in time by which a request must be answered."""
+    def __init__(self, seconds, clock=time.monotonic):
+        """
+        Constructs a new Deadline instance.
+        :param seconds: Seconds from now until the deadline.
+        :param clock: A callable returning a monotonic time in seconds, used for testing.
+        """
+        self._clock = clock
+        self.expires_at = clock() + seconds
+
+    def remaining(self):
+        """
+        Gets the time left until the deadline.
+        :return: Seconds until the deadline, or 0 if it has passed.
+        """
+        return max(0.0, self.expires_at - self._clock())
+
+    def expired(self):
+        """
+        Checks whether the deadline has passed.
+        :return: True if no time is left.
+        """
+        return self.remaining() <= 0
+
+    @staticmethod
+    def from_context(context, budget, reserve=0.0):
+        """
+        Builds the deadline for a Lambda invocation.
+        :param context: The lambda context object, or None outside of Lambda.
+        :param budget: The most seconds the request may take, such as the time Alexa waits for a response.
+        :param reserve: Seconds kept back before the end of the invocation or budget to build the response.
+        :return: A Deadline at whichever of the budget and the Lambda timeout comes first, less the reserve.
+        """
+        seconds = budget
+        if context is not None:
+            seconds = min(seconds, context.get_remaining_time_in_millis() / 1000)
+        return Deadline(max(0.0, seconds - reserve))
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    """
+    Makes a deadline the current one for the duration of a block.
+    :param deadline: The Deadline of the request being handled.
+    :return: A context manager yielding the deadline.
+    """
+    global _deadline
+    previous, _deadline = _deadline, deadline
+    try:
+        yield deadline
+    finally:
+        _deadline = previous
+
+
+def current_deadline():
+    """
+    Gets the deadline of the request being handled.
+    :return: The Deadline set by deadline_scope(), or None outside of one.
+    """
+    return _deadline
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of a call and, once there are failure_threshold of them, opens to refuse the call for
+    reset_timeout seconds. After that one trial call is let through: it closes the breaker if it succeeds and reopens
+    it if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_RESET_TIMEOUT = 30
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        """
+        Constructs a new CircuitBreaker instance.
+        :param failure_threshold: The number of consecutive failures that opens the breaker.
+        :param reset_timeout: Seconds the breaker stays open before a trial call is allowed.
+        :param clock: A callable returning a monotonic time in seconds, used for testing.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_count = 0
+        self._clock = clock
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """The state of the breaker: CLOSED, OPEN or HALF_OPEN."""
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self._trial_in_flight or self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def allow(self):
+        """
+        Checks whether a call may be made now. While the breaker is half open only the first caller is allowed, and it
+        must report the outcome with record_success() or record_failure().
+        :return: True if the call may be made.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_flight or self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        """Records a successful call, closing the breaker."""
+        with self._lock:
+            self.failure_count = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Records a failed call, opening the breaker if it was a trial call or the threshold is reached."""
+        with self._lock:
+            self.failure_count += 1
+            if self._trial_in_flight or self.failure_count >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+    def call(self, func):
+        """
+        Makes a call through the breaker, recording its outcome.
+        :param func: A no-argument callable.
+        :return: The result of func.
+        """
+        if not self.allow():
+            raise CircuitOpenError('The circuit breaker is open.')
+        try:
+            result = func()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+def call_hedged(func, executor, timeout, hedge_after=None):
+    """
+    Calls func on an executor and waits for it until the timeout. If it has not answered after hedge_after seconds,
+    a second copy is started and whichever succeeds first is returned. Calls cut short by the timeout keep running in
+    the background and their results are discarded.
+    :param func: A no-argument callable, safe to call twice at once.
+    :param executor: A concurrent.futures.Executor to make the calls on.
+    :param timeout: Seconds to wait for a result.
+    :param hedge_after: Seconds to wait before sending the second copy. No copy is sent if not given.
+    :return: The result of the first copy to succeed.
+    """
+    expires_at = time.monotonic() + timeout
+    pending = {executor.submit(func)}
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = wait(pending, timeout=hedge_after)
+        if not done:
+            pending.add(executor.submit(func))
+
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, expires_at - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceededError('No response within {:.3f} seconds.'.format(timeout))
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+
+    raise error
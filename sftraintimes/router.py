@@ -0,0 +1,104 @@
+import logging
+
+LOG = logging.getLogger('log')
+
+
+class IntentRouter:
+    """
+    Dispatches Alexa IntentRequests to the handler registered for their intent name. Handlers are called with the
+    request and session objects and return an Alexa response. Middleware registered for an intent, or for every
+    intent, wraps its handler, for example to time it. The chain for each intent is composed when handlers or
+    middleware are registered, so dispatching is a single dict lookup and call.
+    """
+    def __init__(self, fallback=None):
+        """
+        Constructs a new IntentRouter instance.
+        :param fallback: The handler for intent names nothing is registered for. Unrecognized intents raise a
+                         ValueError if not given.
+        """
+        self.fallback = fallback
+        self._handlers = {}
+        self._middleware = []
+        self._chains = {}
+        self._fallback_chain = None
+        self._compose()
+
+    def intent(self, *intent_names):
+        """
+        Decorates a handler to register it for the given intent names.
+        :param intent_names: The names of the intents the handler serves, ex: 'AMAZON.HelpIntent'.
+        :return: A decorator that registers the handler and returns it unchanged.
+        """
+        def decorator(handler):
+            self.register(handler, *intent_names)
+            return handler
+        return decorator
+
+    def register(self, handler, *intent_names):
+        """
+        Registers a handler for the given intent names, replacing any handler already registered for them.
+        :param handler: A callable taking the request and session objects and returning an Alexa response.
+        :param intent_names: The names of the intents the handler serves.
+        """
+        if not intent_names:
+            raise ValueError('At least one intent name is required to register {}.'.format(handler))
+
+        for intent_name in intent_names:
+            self._handlers[intent_name] = handler
+        self._compose()
+
+    def add_middleware(self, middleware, *intent_names):
+        """
+        Wraps the handlers for the given intent names, or for every intent if none are given. Middleware added first
+        runs outermost.
+        :param middleware: A callable taking the intent name, the request and session objects, and a call_next callable
+                           that takes the request and session and runs the rest of the chain. It returns an Alexa
+                           response. The intent name is None when the fallback handles an unrecognized intent.
+        :param intent_names: The names of the intents to wrap.
+        """
+        self._middleware.append((middleware, frozenset(intent_names)))
+        self._compose()
+
+    def intent_names(self):
+        """
+        Gets the intents handlers are registered for.
+        :return: A sorted list of intent names.
+        """
+        return sorted(self._handlers)
+
+    def dispatch(self, request, session):
+        """
+        Handles an IntentRequest with the handler registered for its intent.
+        :param request: The request object from the lambda event.
+        :param session: The session object from the lambda event.
+        :return: An Alexa response object.
+        """
+        intent_name = request['intent']['name']
+        chain = self._chains.get(intent_name)
+        if chain is None:
+            if self.fallback is None:
+                raise ValueError('Unrecognized IntentRequest: {}'.format(request))
+            LOG.warning('Unrecognized IntentRequest: {}'.format(request))
+            chain = self._fallback_chain
+
+        return chain(request, session)
+
+    def _compose(self):
+        self._chains = {intent_name: self._build_chain(intent_name, handler)
+                        for intent_name, handler in self._handlers.items()}
+        if self.fallback is not None:
+            self._fallback_chain = self._build_chain(None, self.fallback)
+
+    def _build_chain(self, intent_name, handler):
+        chain = handler
+        for middleware, intent_names in reversed(self._middleware):
+            if intent_names and intent_name not in intent_names:
+                continue
+            chain = _wrap(middleware, intent_name, chain)
+        return chain
+
+
+def _wrap(middleware, intent_name, call_next):
+    def call(request, session):
+        return middleware(intent_name, request, session, call_next)
+    return call
@@ -0,0 +1,307 @@
+"""
+Compiles and queries the SFMTA GTFS static schedule, so upcoming departures can still be given when 511 is unavailable.
+
+The GTFS feed is compiled offline into one binary file of flat arrays: every stop time, grouped by stop and sorted by
+time within each stop, plus a row per trip. At runtime the file is memory-mapped and the arrays are read in place, so
+loading costs no parsing and a query is a binary search over a stop's range. To rebuild the bundled schedule from an
+unzipped GTFS feed, run from the repository root:
+
+    python -m sftraintimes.schedule path/to/gtfs
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import date, timedelta
+
+from sftraintimes.model import Arrival
+
+DEFAULT_SCHEDULE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'schedule.bin')
+MAGIC = b'SFTGTFS1'
+# SFMTA's GTFS direction_id is 0 for outbound and 1 for inbound trips.
+DIRECTIONS = ('OB', 'IB')
+_HEADER_LENGTH = struct.Struct('<I')
+_ALIGNMENT = 8
+_EPOCH_DATE = date(1970, 1, 1)
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+_COLUMNS = (('times', 'i'), ('trips', 'I'), ('trip_routes', 'H'), ('trip_directions', 'B'), ('trip_headsigns', 'H'),
+            ('trip_services', 'H'))
+
+
+class Schedule:
+    """
+    Answers "the next departures at a stop after a time" from a compiled GTFS schedule. Stop times are held as seconds
+    since the start of their service day, which may exceed 24 hours for trips running past midnight, and each query
+    converts them to epoch seconds for the service days around the requested time. Local time is US Pacific time.
+    """
+    def __init__(self, header, columns, buffer=None):
+        """
+        Constructs a new Schedule instance. Use load() rather than calling this directly.
+        :param header: The dict of string tables, stop ranges and service calendars written by compile_gtfs().
+        :param columns: A dict mapping each column name to an indexable sequence of numbers.
+        :param buffer: The mmap the columns are read from, closed by close().
+        """
+        self.stops = header['stops']
+        self.routes = header['routes']
+        self.headsigns = header['headsigns']
+        self.services = header['services']
+        self.exceptions = header['exceptions']
+        self.columns = columns
+        self._buffer = buffer
+        self._active_services = {}
+
+    def get_departures(self, stop_id, after, limit=3):
+        """
+        Gets the next scheduled departures at a stop.
+        :param stop_id: The 511 ID of the stop, which is its GTFS stop_code.
+        :param after: The epoch second to look from. Departures at exactly this second are included.
+        :param limit: The maximum number of departures to return.
+        :return: A list of model.Arrival sorted by departure time, with realtime False. It is empty if the stop is not
+                 in the schedule.
+        """
+        stop_range = self.stops.get(stop_id)
+        if stop_range is None:
+            return []
+
+        start, end = stop_range
+        departures = []
+        service_day = _to_local_date(after)
+        for service_date in (service_day - timedelta(days=1), service_day, service_day + timedelta(days=1)):
+            departures.extend(self._get_day_departures(service_date, start, end, after, limit))
+        departures.sort()
+
+        return [self._to_arrival(trip, epoch) for epoch, trip in departures[:limit]]
+
+    def close(self):
+        """Releases the memory-mapped file. The schedule cannot be queried afterwards."""
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+
+    @staticmethod
+    def load(path=DEFAULT_SCHEDULE_PATH):
+        """
+        Memory-maps a schedule written by compile_gtfs().
+        :param path: The path of the compiled schedule.
+        :return: A Schedule instance.
+        """
+        with open(path, 'rb') as schedule_file:
+            buffer = mmap.mmap(schedule_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if buffer[:len(MAGIC)] != MAGIC:
+            buffer.close()
+            raise ValueError('{} is not a compiled schedule.'.format(path))
+        header_start = len(MAGIC) + _HEADER_LENGTH.size
+        header_length, = _HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+        header = json.loads(buffer[header_start:header_start + header_length].decode('utf-8'))
+        data_start = _align(header_start + header_length)
+
+        columns = {}
+        view = memoryview(buffer)
+        for name, (offset, typecode, length) in header['columns'].items():
+            start = data_start + offset
+            column = view[start:start + length * array(typecode).itemsize]
+            if header['byteorder'] == sys.byteorder:
+                columns[name] = column.cast(typecode)
+            else:
+                columns[name] = array(typecode, column.tobytes())
+                columns[name].byteswap()
+        view.release()
+
+        return Schedule(header, columns, buffer)
+
+    def _get_day_departures(self, service_date, start, end, after, limit):
+        active = self._get_active_services(service_date)
+        if not any(active):
+            return []
+
+        day_start = _get_service_day_start(service_date)
+        times = self.columns['times']
+        trips = self.columns['trips']
+        trip_services = self.columns['trip_services']
+        departures = []
+        for index in range(bisect_left(times, after - day_start, start, end), end):
+            trip = trips[index]
+            if active[trip_services[trip]]:
+                departures.append((day_start + times[index], trip))
+                if len(departures) == limit:
+                    break
+        return departures
+
+    def _get_active_services(self, service_date):
+        active = self._active_services.get(service_date)
+        if active is not None:
+            return active
+
+        date_key = int(service_date.strftime('%Y%m%d'))
+        weekday_bit = 1 << service_date.weekday()
+        active = bytearray(1 if weekday_mask & weekday_bit and start_date <= date_key <= end_date else 0
+                           for weekday_mask, start_date, end_date in self.services)
+        added, removed = self.exceptions.get(str(date_key), ([], []))
+        for service in added:
+            active[service] = 1
+        for service in removed:
+            active[service] = 0
+
+        if len(self._active_services) > 16:
+            self._active_services.clear()
+        self._active_services[service_date] = active
+        return active
+
+    def _to_arrival(self, trip, epoch):
+        return Arrival(self.routes[self.columns['trip_routes'][trip]],
+                       DIRECTIONS[self.columns['trip_directions'][trip]],
+                       self.headsigns[self.columns['trip_headsigns'][trip]], epoch, epoch, False)
+
+
+def compile_gtfs(gtfs_directory, path=DEFAULT_SCHEDULE_PATH):
+    """
+    Compiles a GTFS feed into the binary file Schedule.load() reads.
+    :param gtfs_directory: A directory holding the feed's stops.txt, routes.txt, trips.txt, stop_times.txt, and
+                           calendar.txt and/or calendar_dates.txt.
+    :param path: The path of the file to write.
+    """
+    stop_codes = {row['stop_id']: row.get('stop_code') or row['stop_id']
+                  for row in _read_csv(gtfs_directory, 'stops.txt')}
+    route_names = {row['route_id']: row.get('route_short_name') or row['route_id']
+                   for row in _read_csv(gtfs_directory, 'routes.txt')}
+
+    services, service_indexes = [], {}
+    for row in _read_csv(gtfs_directory, 'calendar.txt'):
+        weekday_mask = sum(1 << day for day, name in enumerate(_WEEKDAYS) if row[name] == '1')
+        service_indexes[row['service_id']] = len(services)
+        services.append([weekday_mask, int(row['start_date']), int(row['end_date'])])
+
+    exceptions = {}
+    for row in _read_csv(gtfs_directory, 'calendar_dates.txt'):
+        service = service_indexes.get(row['service_id'])
+        if service is None:
+            service = service_indexes[row['service_id']] = len(services)
+            services.append([0, 0, 0])
+        exceptions.setdefault(row['date'], ([], []))[0 if row['exception_type'] == '1' else 1].append(service)
+
+    routes, headsigns = {}, {}
+    trip_indexes, trip_columns = {}, ([], [], [], [])
+    for row in _read_csv(gtfs_directory, 'trips.txt'):
+        if row['service_id'] not in service_indexes:
+            continue
+        trip_indexes[row['trip_id']] = len(trip_indexes)
+        trip_columns[0].append(routes.setdefault(route_names.get(row['route_id'], row['route_id']), len(routes)))
+        trip_columns[1].append(int(row.get('direction_id') or 0))
+        trip_columns[2].append(headsigns.setdefault(row.get('trip_headsign') or '', len(headsigns)))
+        trip_columns[3].append(service_indexes[row['service_id']])
+
+    stop_times = []
+    for row in _read_csv(gtfs_directory, 'stop_times.txt'):
+        trip = trip_indexes.get(row['trip_id'])
+        time = row.get('departure_time') or row.get('arrival_time')
+        if trip is not None and time:
+            stop_times.append((stop_codes.get(row['stop_id'], row['stop_id']), _parse_time(time), trip))
+    stop_times.sort()
+
+    stops = {}
+    for index, (stop_id, _, _) in enumerate(stop_times):
+        stops.setdefault(stop_id, [index, index])[1] = index + 1
+
+    columns = {'times': [row[1] for row in stop_times], 'trips': [row[2] for row in stop_times]}
+    columns.update(zip(('trip_routes', 'trip_directions', 'trip_headsigns', 'trip_services'), trip_columns))
+    header = {
+        'byteorder': sys.byteorder,
+        'stops': stops,
+        'routes': _by_index(routes),
+        'headsigns': _by_index(headsigns),
+        'services': services,
+        'exceptions': exceptions
+    }
+    _write(path, header, [(name, array(typecode, columns[name])) for name, typecode in _COLUMNS])
+
+
+def _write(path, header, columns):
+    header['columns'] = {}
+    offset = 0
+    for name, column in columns:
+        header['columns'][name] = [offset, column.typecode, len(column)]
+        offset = _align(offset + len(column) * column.itemsize)
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as schedule_file:
+        schedule_file.write(MAGIC + _HEADER_LENGTH.pack(len(header_bytes)) + header_bytes)
+        schedule_file.write(b'\0' * (_align(schedule_file.tell()) - schedule_file.tell()))
+        for _, column in columns:
+            column_bytes = column.tobytes()
+            schedule_file.write(column_bytes + b'\0' * (_align(len(column_bytes)) - len(column_bytes)))
+    os.replace(temporary_path, path)
+
+
+def _read_csv(gtfs_directory, name):
+    path = os.path.join(gtfs_directory, name)
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8-sig', newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield row
+
+
+def _parse_time(time):
+    hours, minutes, seconds = time.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _by_index(indexes):
+    values = [None] * len(indexes)
+    for value, index in indexes.items():
+        values[index] = value
+    return values
+
+
+def _to_local_date(epoch):
+    return _EPOCH_DATE + timedelta(days=(epoch + _get_pacific_offset(epoch)) // 86400)
+
+
+def _get_service_day_start(service_date):
+    # GTFS measures stop times from noon minus 12 hours, which is midnight except on daylight saving changeovers.
+    noon = _to_epoch(service_date) + 43200
+    return noon - _get_pacific_offset(noon + 8 * 3600) - 43200
+
+
+def _get_pacific_offset(epoch):
+    # US daylight saving time runs from 2 AM on the second Sunday in March to 2 AM on the first Sunday in November.
+    year = (_EPOCH_DATE + timedelta(days=(epoch - 8 * 3600) // 86400)).year
+    march_8 = date(year, 3, 8)
+    november_1 = date(year, 11, 1)
+    dst_start = _to_epoch(march_8 + timedelta(days=6 - march_8.weekday())) + 10 * 3600
+    dst_end = _to_epoch(november_1 + timedelta(days=6 - november_1.weekday())) + 9 * 3600
+    return -7 * 3600 if dst_start <= epoch < dst_end else -8 * 3600
+
+
+def _to_epoch(day):
+    return (day - _EPOCH_DATE).days * 86400
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compiles an unzipped GTFS feed into the bundled schedule.')
+    parser.add_argument('gtfs_directory', help='The directory holding the GTFS text files.')
+    parser.add_argument('--output', default=DEFAULT_SCHEDULE_PATH, help='The path of the schedule file to write.')
+    args = parser.parse_args()
+
+    compile_gtfs(args.gtfs_directory, args.output)
+
+
+if __name__ == '__main__':
+    main()
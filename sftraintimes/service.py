@@ -1,5 +1,21 @@
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+
+from sftraintimes.eta import EtaEngine
+from sftraintimes.feed import to_arrivals
+from sftraintimes.model import Arrival, ArrivalSource, UpcomingArrivals
+from sftraintimes.patterns import LineTopology, PatternRecord
+from sftraintimes.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceededError, call_hedged
+
 AGENCY = 'SF'
 
+LOG = logging.getLogger('log')
+
 
 class UserService:
     """Service class for manipulating user data."""
@@ -34,36 +50,334 @@ class UserService:
         """
         return self.user_dao.update_user(user_id, **kwargs)
 
+    def upsert_user(self, user_id, **kwargs):
+        """
+        Sets attributes on a user in a single write, adding the user if it does not exist.
+        :param user_id: The ID of the user to update.
+        :param kwargs: Key-value pairs representing each attribute to set.
+        :return: A tuple of (old_user, new_user) dicts. old_user is None if the user did not exist.
+        """
+        return self.user_dao.upsert_user(user_id, **kwargs)
+
+    def get_popular_home_stop_ids(self, limit):
+        """
+        Gets the stops the most users have set as their home stop.
+        :param limit: The maximum number of stop IDs to return.
+        :return: A list of stop IDs, most popular first.
+        """
+        users = self.user_dao.scan_users('homeStopId')
+        counts = Counter(user['homeStopId'] for user in users if user.get('homeStopId'))
+
+        return [stop_id for stop_id, _ in counts.most_common(limit)]
+
+    def batch_get_users(self, user_ids):
+        """
+        Gets many users by ID.
+        :param user_ids: An iterable of user IDs.
+        :return: A generator of the users found. IDs that could not be found are skipped.
+        """
+        return self.user_dao.batch_get_users(user_ids)
+
+    def batch_write_users(self, users):
+        """
+        Adds or replaces many users in the service.
+        :param users: An iterable of dicts representing the users to write.
+        :return: The number of users written.
+        """
+        return self.user_dao.batch_write_users(users)
+
 
 class StopService:
     """Service class for getting stop information."""
-    def __init__(self, five_eleven_client):
+    SNAPSHOT_REFRESH_INTERVAL = 15
+    SNAPSHOT_MAX_AGE = 120
+    SCHEDULE_DEPARTURE_COUNT = 3
+    STALE_MAX_AGE = 600
+    HEDGE_DELAY = 0.5
+    FALLBACK_RESERVE = 0.2
+
+    def __init__(self, five_eleven_client, visit_cache=None, snapshot_store=None, eta_engine=None, schedule=None,
+                 circuit_breaker=None, executor=None, clock=time.time):
         """
         Constructs a new StopService instance.
         :param five_eleven_client: A FiveElevenClient instance for making API calls.
+        :param visit_cache: An optional cache.TieredCache for upcoming arrivals, keyed by (agency, stop_id).
+        :param snapshot_store: An optional feed.FileSnapshotStore or feed.S3SnapshotStore holding agency-wide arrivals,
+                               consulted before calling 511 for a single stop. With an executor, it is reloaded in the
+                               background every SNAPSHOT_REFRESH_INTERVAL seconds.
+        :param eta_engine: An eta.EtaEngine that smooths realtime predictions across fetches. A new one is created if
+                           not given.
+        :param schedule: An optional schedule.Schedule whose scheduled departures are returned when 511 cannot be
+                         reached.
+        :param circuit_breaker: A resilience.CircuitBreaker guarding calls to 511. A new one is created if not given.
+        :param executor: An optional concurrent.futures.Executor that calls to 511 made with a deadline run on, so they
+                         can be cut short and hedged. Without one, a deadline is not enforced.
+        :param clock: A callable returning the current epoch time in seconds, used for testing.
         """
         self.five_eleven_client = five_eleven_client
+        self.visit_cache = visit_cache
+        self.snapshot_store = snapshot_store
+        self.eta_engine = eta_engine if eta_engine is not None else EtaEngine()
+        self.schedule = schedule
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        self.executor = executor
+        self._clock = clock
+        self._snapshot = None
+        self._snapshot_loaded_at = None
+        self._snapshot_refresh = None
+        self._snapshot_executor = None
+        self._snapshot_lock = threading.Lock()
+
+    def get_upcoming_arrivals(self, stop_id, deadline=None):
+        """
+        Gets upcoming arrivals at the specified stop, as lookup_upcoming_arrivals does, without saying where they came
+        from.
+        :param stop_id: The ID of the stop.
+        :param deadline: An optional resilience.Deadline the arrivals are needed by.
+        :return: A list of model.Arrival sorted by arrival time.
+        """
+        return self.lookup_upcoming_arrivals(stop_id, deadline).arrivals
 
-    def get_upcoming_visits(self, stop_id):
+    def lookup_upcoming_arrivals(self, stop_id, deadline=None):
         """
-        Gets upcoming visits to the specified stop. Usually this returns the next 3 arrivals at the stop, but the exact
-        number of arrivals is not guaranteed.
+        Gets upcoming arrivals at the specified stop, from the published agency snapshot when it is recent and covers
+        the stop, or from 511 otherwise. Usually this returns the next 3 arrivals at the stop, but the exact number of
+        arrivals is not guaranteed. Realtime predictions are preferred over the schedule and smoothed across fetches by
+        the ETA engine. When a visit cache is configured, cached arrivals up to its TTL old are served with departed
+        arrivals dropped, and the stop is refetched only once none are left.
+
+        With a deadline and an executor, loading the snapshot and calling 511 are given until FALLBACK_RESERVE seconds
+        before the deadline, with the snapshot taking at most half of that, and a second request is sent if 511 has not
+        answered after HEDGE_DELAY seconds. After repeated failures the circuit breaker skips 511 entirely for a while.
+        Whenever 511 fails, is cut short or is skipped, the arrivals last cached or published for the stop are served if
+        they are at most STALE_MAX_AGE seconds old and still upcoming, and otherwise the stop's next scheduled
+        departures if a schedule is configured.
         :param stop_id: The ID of the stop.
-        :return: A list of dicts containing upcoming visits to the stop.
+        :param deadline: An optional resilience.Deadline the arrivals are needed by.
+        :return: A model.UpcomingArrivals whose arrivals are sorted by arrival time.
+        """
+        now = self._clock()
+        snapshot = self._get_snapshot(deadline)
+        if snapshot is not None and now - snapshot.generated_at < self.SNAPSHOT_MAX_AGE:
+            arrivals = self._get_snapshot_arrivals(snapshot, stop_id, now)
+            if arrivals:
+                return UpcomingArrivals(arrivals, ArrivalSource.LIVE)
+
+        try:
+            return UpcomingArrivals(self._get_live_arrivals(stop_id, now, deadline), ArrivalSource.LIVE)
+        except Exception:
+            fallback = self._get_fallback_arrivals(stop_id, snapshot)
+            if fallback is None:
+                raise
+            LOG.warning('Serving {} arrivals for stop {}.'.format(fallback.source.value, stop_id), exc_info=True)
+            return fallback
+
+    def get_next_arrivals(self, stop_ids, line_ids=None, directions=None, limit=None, executor=None, deadline=None):
+        """
+        Gets the soonest arrivals across several stops as one time-ordered list. Each stop is read as
+        get_upcoming_arrivals would read it, so cached and snapshot stops cost no call to 511. A stop that fails to load
+        is logged and left out, unless every stop fails.
+        :param stop_ids: An iterable of stop IDs. Duplicates are ignored.
+        :param line_ids: If given, only arrivals on these lines are kept.
+        :param directions: If given, only arrivals in these directions ('IB' or 'OB') are kept.
+        :param limit: The maximum number of arrivals to return. Every matching arrival is returned if not given.
+        :param executor: A concurrent.futures.Executor to load stops on concurrently. Stops are loaded one after
+                         another if not given. It must not be the executor this service calls 511 on, whose threads
+                         would otherwise wait on calls queued behind them.
+        :param deadline: An optional resilience.Deadline the arrivals are needed by, applied to every stop.
+        :return: A list of (stop_id, model.Arrival) tuples sorted by arrival time.
+        """
+        if executor is not None and executor is self.executor:
+            raise ValueError('Stops must be loaded on a different executor than the one 511 is called on.')
+
+        stop_ids = list(dict.fromkeys(stop_ids))
+        if executor is not None and len(stop_ids) > 1:
+            futures = [executor.submit(self.get_upcoming_arrivals, stop_id, deadline) for stop_id in stop_ids]
+            results = [_get_result(future.result) for future in futures]
+        else:
+            results = [_get_result(lambda: self.get_upcoming_arrivals(stop_id, deadline)) for stop_id in stop_ids]
+
+        errors = [error for _, error in results if error is not None]
+        if errors and len(errors) == len(results):
+            raise errors[0]
+
+        streams = []
+        for stop_id, (arrivals, error) in zip(stop_ids, results):
+            if error is not None:
+                LOG.warning('Failed to get upcoming arrivals for stop {}.'.format(stop_id), exc_info=error)
+                continue
+            streams.append([(arrival.arrival_time, index, stop_id, arrival) for index, arrival in enumerate(arrivals)
+                            if (line_ids is None or arrival.line in line_ids) and
+                            (directions is None or arrival.direction in directions)])
+
+        merged = heapq.merge(*streams)
+        return [(stop_id, arrival) for _, _, stop_id, arrival in islice(merged, limit)]
+
+    def prewarm_upcoming_arrivals(self, stop_ids, executor):
         """
+        Fetches upcoming arrivals for many stops in parallel and stores them in the visit cache, so later calls to
+        get_upcoming_arrivals for those stops are served without calling 511. Stops that fail to load are logged and
+        skipped.
+        :param stop_ids: An iterable of stop IDs.
+        :param executor: A concurrent.futures.Executor to fetch the stops on.
+        :return: The number of stops written to the cache.
+        """
+        if self.visit_cache is None:
+            raise ValueError('Pre-warming requires a visit cache.')
+
+        futures = {stop_id: executor.submit(self._fetch_upcoming_arrivals, stop_id) for stop_id in stop_ids}
+        warmed = 0
+        for stop_id, future in futures.items():
+            try:
+                self.visit_cache.put((AGENCY, stop_id), future.result())
+                warmed += 1
+            except Exception:
+                LOG.warning('Failed to pre-warm upcoming arrivals for stop {}.'.format(stop_id), exc_info=True)
+
+        return warmed
+
+    def _get_live_arrivals(self, stop_id, now, deadline):
+        if self.visit_cache is None:
+            return self._call_five_eleven(stop_id, deadline)
+
+        key = (AGENCY, stop_id)
+        loaded = []
+
+        def load():
+            loaded.append(True)
+            return self._call_five_eleven(stop_id, deadline)
+
+        cached = _to_arrival_list(self.visit_cache.get(key, load))
+        arrivals = self.eta_engine.age(cached, now)
+        # A stop whose cached arrivals have all departed is refetched, but an empty answer from 511, such as for a stop
+        # with no trains overnight, is cached until its TTL like any other.
+        if not arrivals and cached and not loaded:
+            arrivals = self._call_five_eleven(stop_id, deadline)
+            self.visit_cache.put(key, arrivals)
+        return arrivals
+
+    def _call_five_eleven(self, stop_id, deadline):
+        if self.circuit_breaker.state == CircuitBreaker.OPEN:
+            raise CircuitOpenError('Skipping 511 for stop {} while the circuit breaker is open.'.format(stop_id))
+
+        def fetch():
+            return self.circuit_breaker.call(lambda: self._fetch_upcoming_arrivals(stop_id))
+
+        if deadline is None or self.executor is None:
+            return fetch()
+        timeout = deadline.remaining() - self.FALLBACK_RESERVE
+        if timeout <= 0:
+            raise DeadlineExceededError('No time is left to call 511 for stop {}.'.format(stop_id))
+        return call_hedged(fetch, self.executor, timeout, self.HEDGE_DELAY)
+
+    def _get_fallback_arrivals(self, stop_id, snapshot):
+        now = self._clock()
+        arrivals = []
+        entry = self.visit_cache.peek((AGENCY, stop_id)) if self.visit_cache is not None else None
+        if entry is not None and now - entry.stored_at < self.STALE_MAX_AGE:
+            arrivals = self.eta_engine.age(_to_arrival_list(entry.value), now)
+        if not arrivals and snapshot is not None and now - snapshot.generated_at < self.STALE_MAX_AGE:
+            arrivals = self._get_snapshot_arrivals(snapshot, stop_id, now)
+        if arrivals:
+            return UpcomingArrivals(arrivals, ArrivalSource.STALE)
+
+        if self.schedule is not None:
+            departures = self.schedule.get_departures(stop_id, now, self.SCHEDULE_DEPARTURE_COUNT)
+            if departures:
+                return UpcomingArrivals(departures, ArrivalSource.SCHEDULE)
+        return None
+
+    def _get_snapshot_arrivals(self, snapshot, stop_id, now):
+        arrivals = snapshot.get_arrivals(stop_id)
+        if not arrivals:
+            return arrivals
+        return self.eta_engine.age(self.eta_engine.observe(stop_id, arrivals, snapshot.generated_at), now)
+
+    def _get_snapshot(self, deadline=None):
+        # The snapshot covers every stop, so downloading and decoding it is kept off the request path when there is
+        # an executor: requests are served the last decoded copy while a newer one is loaded in the background. The
+        # load gets a thread of its own rather than a place in the executor's queue, since lookups may themselves be
+        # running on the executor's threads and waiting for it.
+        if self.snapshot_store is None:
+            return None
+
+        with self._snapshot_lock:
+            due = self._snapshot_loaded_at is None or \
+                self._clock() - self._snapshot_loaded_at >= self.SNAPSHOT_REFRESH_INTERVAL
+            if due and self._snapshot_refresh is None and self.executor is not None:
+                if self._snapshot_executor is None:
+                    self._snapshot_executor = ThreadPoolExecutor(max_workers=1)
+                self._snapshot_refresh = self._snapshot_executor.submit(self._refresh_snapshot)
+            refresh = self._snapshot_refresh
+            snapshot = self._snapshot
+
+        timeout = deadline.remaining() - self.FALLBACK_RESERVE if deadline is not None else None
+        if self.executor is None:
+            if due and (timeout is None or timeout > 0):
+                self._refresh_snapshot()
+            return self._snapshot
+        if snapshot is None and refresh is not None and (timeout is None or timeout > 0):
+            # Nothing has been loaded in this container yet, so the first requests wait for it, but for at most half
+            # the time the deadline leaves so that 511 can still be called.
+            wait([refresh], timeout=timeout / 2 if timeout is not None else None)
+            snapshot = self._snapshot
+        return snapshot
+
+    def _refresh_snapshot(self):
+        try:
+            snapshot = self.snapshot_store.load()
+        except Exception:
+            LOG.warning('Failed to load the stop snapshot.', exc_info=True)
+            snapshot = self._snapshot
+
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+            self._snapshot_loaded_at = self._clock()
+            self._snapshot_refresh = None
+
+    def _fetch_upcoming_arrivals(self, stop_id):
         response = self.five_eleven_client.get_real_time_stop_monitoring(AGENCY, stop_id)
+        arrivals = to_arrivals(response['ServiceDelivery']['StopMonitoringDelivery']['MonitoredStopVisit'])
+
+        return self.eta_engine.observe(stop_id, arrivals, self._clock())
+
+
+def _to_arrival_list(values):
+    # Entries read back from a shared cache tier are plain JSON lists rather than Arrivals.
+    return [value if isinstance(value, Arrival) else Arrival(*value) for value in values]
 
-        return response['ServiceDelivery']['StopMonitoringDelivery']['MonitoredStopVisit']
+
+def _get_result(call):
+    try:
+        return call(), None
+    except Exception as e:
+        return None, e
 
 
 class LineService:
-    """Service class for getting line information."""
-    def __init__(self, five_eleven_client):
+    """
+    Service class for getting line information. Journey patterns change only at service changes, so once a line's
+    patterns are loaded they are kept in memory for PATTERN_TTL seconds, read from the pattern store when one is
+    configured, and fetched from 511 only when the store has none. refresh_patterns_for_line() fetches them again out
+    of band.
+    """
+    PATTERN_TTL = 3600
+
+    def __init__(self, five_eleven_client, pattern_store=None, ttl=PATTERN_TTL, clock=time.time):
         """
         Constructs a new LineService instance.
         :param five_eleven_client: A FiveElevenClient instance for making API calls.
+        :param pattern_store: An optional patterns.FilePatternStore or patterns.S3PatternStore shared by every
+                              container and the refresh job.
+        :param ttl: Seconds loaded patterns are used before they are read again.
+        :param clock: A callable returning the current epoch time in seconds, used for testing.
         """
         self.five_eleven_client = five_eleven_client
+        self.pattern_store = pattern_store
+        self.ttl = ttl
+        self._clock = clock
+        self._records = {}
+        self._topologies = {}
 
     def get_patterns_for_line(self, line_id):
         """
@@ -71,6 +385,89 @@ class LineService:
         :param line_id: The ID of the line.
         :return: A list of patterns serviced by the line.
         """
+        return self._get_record(line_id).patterns
+
+    def get_topology(self, line_id):
+        """
+        Gets the ordered stops of the specified line's patterns. It is derived once per version of the patterns.
+        :param line_id: The ID of the line.
+        :return: A patterns.LineTopology instance.
+        """
+        record = self._get_record(line_id)
+        version, topology = self._topologies.get(line_id, (None, None))
+        if version != record.version:
+            topology = LineTopology.from_patterns(record.patterns)
+            self._topologies[line_id] = (record.version, topology)
+        return topology
+
+    def serves_stop(self, line_id, stop_id, direction=None):
+        """
+        Checks whether a line stops at a stop.
+        :param line_id: The ID of the line.
+        :param stop_id: The ID of the stop.
+        :param direction: If given, only patterns in this direction ('IB' or 'OB') are considered.
+        :return: True if one of the line's patterns visits the stop.
+        """
+        return self.get_topology(line_id).serves_stop(stop_id, direction)
+
+    def get_stops_between(self, line_id, origin, destination, direction=None):
+        """
+        Gets the stops a train on a line passes between two stops.
+        :param line_id: The ID of the line.
+        :param origin: The ID of the stop boarded at.
+        :param destination: The ID of the stop alighted at.
+        :param direction: If given, only patterns in this direction ('IB' or 'OB') are considered.
+        :return: A list of stop IDs in travel order, excluding origin and destination, or None if the line does not run
+                 from origin to destination.
+        """
+        return self.get_topology(line_id).get_stops_between(origin, destination, direction)
+
+    def refresh_patterns_for_line(self, line_id):
+        """
+        Fetches a line's patterns from 511 and stores them if they differ from the stored version.
+        :param line_id: The ID of the line.
+        :return: True if the patterns changed or none were stored.
+        """
+        record = self._fetch_record(line_id)
+        stored = None
+        if self.pattern_store is not None:
+            try:
+                stored = self.pattern_store.load(AGENCY, line_id)
+            except Exception:
+                LOG.warning('Failed to load the stored patterns for line {}.'.format(line_id), exc_info=True)
+        changed = stored is None or stored.version != record.version
+        if changed and self.pattern_store is not None:
+            self.pattern_store.save(record)
+
+        self._records[line_id] = (record, self._clock())
+        return changed
+
+    def _get_record(self, line_id):
+        record, loaded_at = self._records.get(line_id, (None, None))
+        if record is not None and self._clock() - loaded_at < self.ttl:
+            return record
+
+        stored = None
+        if self.pattern_store is not None:
+            try:
+                stored = self.pattern_store.load(AGENCY, line_id)
+            except Exception:
+                # The store is only a cache of 511, so the patterns already held are kept, or fetched from 511 if there
+                # are none.
+                LOG.warning('Failed to load the stored patterns for line {}.'.format(line_id), exc_info=True)
+                stored = record
+        if stored is None:
+            stored = self._fetch_record(line_id)
+            if self.pattern_store is not None:
+                try:
+                    self.pattern_store.save(stored)
+                except Exception:
+                    LOG.warning('Failed to store the patterns for line {}.'.format(line_id), exc_info=True)
+
+        self._records[line_id] = (stored, self._clock())
+        return stored
+
+    def _fetch_record(self, line_id):
         response = self.five_eleven_client.get_patterns_for_line(AGENCY, line_id)
 
-        return response['journeyPatterns']
+        return PatternRecord.build(AGENCY, line_id, response['journeyPatterns'], int(self._clock()))
@@ -0,0 +1,382 @@
+"""Local stand-ins for the AWS services and 511 API used by sftraintimes, for tests and benchmarks that run offline."""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlparse
+
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+_SERIALIZER = TypeSerializer()
+
+
+class FakeS3Client:
+    """A minimal in-memory S3 client supporting put_object and get_object, with optional injected latency."""
+    def __init__(self, latency=0, missing_key_code='NoSuchKey'):
+        """
+        Constructs a new FakeS3Client instance.
+        :param latency: Seconds every call sleeps before answering.
+        :param missing_key_code: The error code get_object raises for a missing key. S3 answers 'AccessDenied' instead
+                                 of 'NoSuchKey' when the caller lacks s3:ListBucket.
+        """
+        self.latency = latency
+        self.missing_key_code = missing_key_code
+        self.objects = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        self._record_call()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+    def get_object(self, Bucket, Key):
+        self._record_call()
+        if (Bucket, Key) not in self.objects:
+            raise _client_error(self.missing_key_code, 'Not Found', 'GetObject')
+        return {'Body': BytesIO(self.objects[(Bucket, Key)])}
+
+    def _record_call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeFiveElevenServer:
+    """
+    A local HTTP/1.1 server standing in for api.511.org. Responses are configured per path, latency and error
+    responses can be injected, and every request and accepted connection is counted so tests can check connection reuse.
+    """
+    def __init__(self, routes=None, latency=0, error_rate=0, seed=0):
+        """
+        Constructs a new FakeFiveElevenServer instance. Call start() or use it as a context manager to serve requests.
+        :param routes: A dict mapping a path (ex: '/transit/StopMonitoring') to the bytes body returned for it, or to a
+                       callable taking the parsed query parameters and returning the body.
+        :param latency: Seconds every request sleeps before answering, or a no-argument callable returning them.
+        :param error_rate: The fraction of requests, chosen at random, that answer 503.
+        :param seed: The seed for choosing which requests fail.
+        """
+        self.routes = dict(routes or {})
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.connection_count = 0
+        self.requests = []
+        self._queued_statuses = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """The URL to pass to FiveElevenClient as its base_url."""
+        return 'http://127.0.0.1:{}/transit'.format(self._server.server_address[1])
+
+    def fail_next(self, count, status=503):
+        """
+        Makes the next requests answer with an error status.
+        :param count: The number of requests that should fail.
+        :param status: The status code to respond with.
+        """
+        with self._lock:
+            self._queued_statuses.extend([status] * count)
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with server._lock:
+                    server.connection_count += 1
+
+            def do_GET(self):
+                status, body = server._respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up waiting, as it does when a hedged copy answers first.
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _respond(self, raw_path):
+        parsed = urlparse(raw_path)
+        params = dict(parse_qsl(parsed.query))
+        with self._lock:
+            self.request_count += 1
+            self.requests.append((parsed.path, params))
+            status = self._queued_statuses.pop(0) if self._queued_statuses else None
+            if status is None and self.error_rate and self._random.random() < self.error_rate:
+                status = 503
+
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        if status is not None:
+            return status, b'{}'
+
+        route = self.routes.get(parsed.path)
+        if route is None:
+            return 404, b'{}'
+        body = route(params) if callable(route) else route
+        return 200, body
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeDynamoDBTable:
+    """
+    A minimal in-memory DynamoDB table with a string hash key, named 'id' unless told otherwise. It enforces the batch
+    request size limits and can leave part of each batch unprocessed, as DynamoDB does when throttled.
+    """
+    def __init__(self, name='User-test', latency=0, unprocessed_batches=0, page_size=100, hash_key='id'):
+        """
+        Constructs a new FakeDynamoDBTable instance.
+        :param name: The table name.
+        :param latency: Seconds every call sleeps before answering.
+        :param unprocessed_batches: The number of batch calls that leave half of their keys or items unprocessed.
+        :param page_size: The number of items each scan call returns.
+        :param hash_key: The name of the hash key. Batch calls and scans assume it is 'id'.
+        """
+        self.name = name
+        self.hash_key = hash_key
+        self.latency = latency
+        self.unprocessed_batches = unprocessed_batches
+        self.page_size = page_size
+        self.items = {}
+        self.calls = {}
+        self.meta = type('Meta', (), {'client': _FakeDynamoDBClient(self)})()
+        self._lock = threading.Lock()
+
+    def get_item(self, Key):
+        self._record_call('get_item')
+        item = self.items.get(Key[self.hash_key])
+        return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, Item):
+        self._record_call('put_item')
+        self.items[Item[self.hash_key]] = dict(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ConditionExpression=None, ReturnValues='NONE', ReturnValuesOnConditionCheckFailure='NONE'):
+        # Supports the SET expressions and conditions UserDAO writes.
+        self._record_call('update_item')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        old_item = self.items.get(Key[self.hash_key])
+
+        if ConditionExpression and not _evaluate_condition(ConditionExpression, old_item or {}, names, values):
+            error = _client_error('ConditionalCheckFailedException', 'The conditional request failed', 'UpdateItem')
+            if ReturnValuesOnConditionCheckFailure == 'ALL_OLD' and old_item is not None:
+                # Error payloads are not deserialized by the boto3 resource layer, so the item keeps its wire format.
+                error.response['Item'] = {name: _SERIALIZER.serialize(value) for name, value in old_item.items()}
+            raise error
+
+        item = dict(old_item or Key)
+        for assignment in UpdateExpression[len('SET '):].split(','):
+            name, value = (part.strip() for part in assignment.split('='))
+            item[names.get(name, name)] = values[value]
+        self.items[Key[self.hash_key]] = item
+
+        return {'Attributes': dict(old_item)} if ReturnValues == 'ALL_OLD' and old_item is not None else {}
+
+    def scan(self, ProjectionExpression=None, ExpressionAttributeNames=None, ExclusiveStartKey=None):
+        self._record_call('scan')
+        ids = sorted(self.items)
+        start = ids.index(ExclusiveStartKey['id']) + 1 if ExclusiveStartKey else 0
+        page = ids[start:start + self.page_size]
+
+        if ProjectionExpression:
+            names = [ExpressionAttributeNames.get(name.strip(), name.strip())
+                     for name in ProjectionExpression.split(',')]
+            items = [{name: self.items[item_id][name] for name in names if name in self.items[item_id]}
+                     for item_id in page]
+        else:
+            items = [dict(self.items[item_id]) for item_id in page]
+
+        response = {'Items': items}
+        if start + self.page_size < len(ids):
+            response['LastEvaluatedKey'] = {'id': page[-1]}
+        return response
+
+    def _record_call(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _take_unprocessed(self):
+        with self._lock:
+            if self.unprocessed_batches <= 0:
+                return False
+            self.unprocessed_batches -= 1
+            return True
+
+
+class _FakeDynamoDBClient:
+    def __init__(self, table):
+        self.table = table
+
+    def batch_get_item(self, RequestItems):
+        self.table._record_call('batch_get_item')
+        keys = RequestItems[self.table.name]['Keys']
+        _validate_batch(keys, 100, 'BatchGetItem')
+
+        processed, unprocessed = self._split(keys)
+        response = {'Responses': {self.table.name: [dict(self.table.items[key['id']]) for key in processed
+                                                    if key['id'] in self.table.items]}}
+        response['UnprocessedKeys'] = {self.table.name: {'Keys': unprocessed}} if unprocessed else {}
+        return response
+
+    def batch_write_item(self, RequestItems):
+        self.table._record_call('batch_write_item')
+        requests = RequestItems[self.table.name]
+        _validate_batch([request['PutRequest']['Item'] for request in requests], 25, 'BatchWriteItem')
+
+        processed, unprocessed = self._split(requests)
+        for request in processed:
+            item = request['PutRequest']['Item']
+            self.table.items[item['id']] = dict(item)
+        return {'UnprocessedItems': {self.table.name: unprocessed} if unprocessed else {}}
+
+    def _split(self, requests):
+        if self.table._take_unprocessed():
+            middle = len(requests) // 2
+            return requests[:middle], requests[middle:]
+        return requests, []
+
+
+def _validate_batch(keys, limit, operation):
+    if len(keys) > limit or len({key['id'] for key in keys}) != len(keys):
+        raise _client_error('ValidationException', 'Invalid batch', operation)
+
+
+def _evaluate_condition(expression, item, names, values):
+    # Handles attribute_not_exists(name) and name <> value terms joined by OR. As in DynamoDB, a comparison with a
+    # missing attribute is false.
+    for term in expression.split(' OR '):
+        term = term.strip()
+        if term.startswith('attribute_not_exists(') and term.endswith(')'):
+            name = term[len('attribute_not_exists('):-1]
+            if names.get(name, name) not in item:
+                return True
+        else:
+            name, value = (part.strip() for part in term.split('<>'))
+            name = names.get(name, name)
+            if name in item and item[name] != values[value]:
+                return True
+    return False
+
+
+def _client_error(code, message, operation):
+    # Some tests replace ClientError.__init__ with a Mock, so the response is also set directly.
+    error_response = {'Error': {'Code': code, 'Message': message}}
+    error = ClientError(error_response, operation)
+    error.response = error_response
+    return error
+
+
+def build_stop_monitoring_feed(stop_count, visits_per_stop=3, start=1541372400, seed=0):
+    """
+    Builds an agency-wide StopMonitoring response shaped like 511's, for tests and benchmarks of the bulk ingest.
+    :param stop_count: The number of stops in the feed. Stop IDs are consecutive integers starting at 10000.
+    :param visits_per_stop: The number of upcoming visits at each stop.
+    :param start: The epoch second arrivals are scheduled from.
+    :param seed: The seed for the random lines, directions and arrival times.
+    :return: The response body as UTF-8 bytes, starting with a byte order mark as 511's responses do.
+    """
+    rng = random.Random(seed)
+    visits = []
+    for stop_index in range(stop_count):
+        stop_id = str(10000 + stop_index)
+        for _ in range(visits_per_stop):
+            line_id = rng.choice(['J', 'KT', 'L', 'M', 'N', '1', '14', '22', '38', '49'])
+            direction = rng.choice(['IB', 'OB'])
+            arrival_time = _format_epoch(start + rng.randrange(60, 3600))
+            visits.append({
+                'RecordedAtTime': _format_epoch(start),
+                'MonitoringRef': stop_id,
+                'MonitoredVehicleJourney': {
+                    'LineRef': line_id,
+                    'DirectionRef': direction,
+                    'FramedVehicleJourneyRef': {'DataFrameRef': '2018-11-04',
+                                                'DatedVehicleJourneyRef': str(rng.randrange(8000000, 9000000))},
+                    'PublishedLineName': 'LINE ' + line_id,
+                    'OperatorRef': 'SF',
+                    'OriginRef': str(rng.randrange(10000, 20000)),
+                    'OriginName': 'Origin St & First Ave',
+                    'DestinationRef': str(rng.randrange(10000, 20000)),
+                    'DestinationName': 'Destination St & Last Ave',
+                    'Monitored': True,
+                    'InCongestion': None,
+                    'VehicleLocation': {'Longitude': '-122.4{:04d}'.format(rng.randrange(10000)),
+                                        'Latitude': '37.7{:04d}'.format(rng.randrange(10000))},
+                    'Bearing': None,
+                    'Occupancy': None,
+                    'VehicleRef': str(rng.randrange(1000, 2000)),
+                    'MonitoredCall': {
+                        'StopPointRef': stop_id,
+                        'StopPointName': 'Stop {}'.format(stop_id),
+                        'VehicleLocationAtStop': '',
+                        'VehicleAtStop': '',
+                        'AimedArrivalTime': arrival_time,
+                        'ExpectedArrivalTime': arrival_time,
+                        'AimedDepartureTime': arrival_time,
+                        'ExpectedDepartureTime': None,
+                        'Distances': ''
+                    }
+                }
+            })
+
+    document = {
+        'ServiceDelivery': {
+            'ResponseTimestamp': _format_epoch(start),
+            'ProducerRef': 'SF',
+            'Status': True,
+            'StopMonitoringDelivery': {
+                'version': '1.4',
+                'ResponseTimestamp': _format_epoch(start),
+                'Status': True,
+                'MonitoredStopVisit': visits
+            }
+        }
+    }
+    return b'\xef\xbb\xbf' + json.dumps(document).encode('utf-8')
+
+
+def _format_epoch(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
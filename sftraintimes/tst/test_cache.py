@@ -0,0 +1,180 @@
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sftraintimes.cache import CacheEntry, DynamoDBCache, FileCache, LRUCache, TieredCache
+
+
+class LRUCacheTest(TestCase):
+    ENTRY = CacheEntry('value', 1.0)
+
+    def setUp(self):
+        self.cache = LRUCache(max_size=2)
+
+    def test_get(self):
+        self.cache.put('key', self.ENTRY)
+
+        result = self.cache.get('key')
+
+        self.assertEqual(result, self.ENTRY)
+
+    def test_get__missing_key(self):
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_put__evicts_least_recently_used(self):
+        self.cache.put('first', self.ENTRY)
+        self.cache.put('second', self.ENTRY)
+        self.cache.get('first')
+
+        self.cache.put('third', self.ENTRY)
+
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.get('first'), self.ENTRY)
+        self.assertEqual(self.cache.get('third'), self.ENTRY)
+
+
+class FileCacheTest(TestCase):
+    KEY = ('SF', '12345')
+    ENTRY = CacheEntry([{'foo': 'bar'}], 1.5)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = FileCache(self.directory.name)
+
+    def test_get(self):
+        self.cache.put(self.KEY, self.ENTRY)
+
+        result = FileCache(self.directory.name).get(self.KEY)
+
+        self.assertEqual(result, self.ENTRY)
+
+    def test_get__missing_key(self):
+        self.assertIsNone(self.cache.get(self.KEY))
+
+
+class DynamoDBCacheTest(TestCase):
+    KEY = ('SF', '12345')
+
+    def setUp(self):
+        self.mock_table = type('Table', (), {})
+        self.cache = DynamoDBCache(self.mock_table, retention=60)
+
+    def test_get(self):
+        item = {'key': 'SF-12345', 'value': '[{"foo":"bar"}]', 'storedAt': Decimal('1.5')}
+        self.mock_table.get_item = Mock(return_value={'Item': item})
+
+        result = self.cache.get(self.KEY)
+
+        self.assertEqual(result, CacheEntry([{'foo': 'bar'}], 1.5))
+        self.mock_table.get_item.assert_called_with(Key={'key': 'SF-12345'})
+
+    def test_get__missing_key(self):
+        self.mock_table.get_item = Mock(return_value={})
+
+        self.assertIsNone(self.cache.get(self.KEY))
+
+    def test_put(self):
+        self.mock_table.put_item = Mock()
+
+        self.cache.put(self.KEY, CacheEntry([{'foo': 'bar'}], 1.5))
+
+        self.mock_table.put_item.assert_called_with(Item={
+            'key': 'SF-12345',
+            'value': '[{"foo":"bar"}]',
+            'storedAt': Decimal('1.5'),
+            'expiresAt': 61
+        })
+
+
+class TieredCacheTest(TestCase):
+    KEY = ('SF', '12345')
+    TTL = 20
+
+    def setUp(self):
+        self.now = 1000
+        self.shared = LRUCache()
+        self.cache = TieredCache(ttl=self.TTL, shared=self.shared, clock=lambda: self.now)
+        self.loader = Mock(return_value='value')
+
+    def test_get(self):
+        first = self.cache.get(self.KEY, self.loader)
+        second = self.cache.get(self.KEY, self.loader)
+
+        self.assertEqual(first, 'value')
+        self.assertEqual(second, 'value')
+        self.loader.assert_called_once_with()
+        self.assertEqual(self.shared.get(self.KEY), CacheEntry('value', 1000))
+
+    def test_peek(self):
+        self.cache.get(self.KEY, self.loader)
+        self.now += self.TTL * 10
+
+        result = self.cache.peek(self.KEY)
+
+        self.assertEqual(result, CacheEntry('value', 1000))
+        self.loader.assert_called_once_with()
+
+    def test_peek__missing(self):
+        self.assertIsNone(self.cache.peek(self.KEY))
+
+    def test_get__expired_entry(self):
+        self.cache.get(self.KEY, self.loader)
+        self.loader.return_value = 'newValue'
+        self.now += self.TTL
+
+        result = self.cache.get(self.KEY, self.loader)
+
+        self.assertEqual(result, 'newValue')
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_get__shared_tier_hit(self):
+        self.shared.put(self.KEY, CacheEntry('sharedValue', self.now - 1))
+
+        result = self.cache.get(self.KEY, self.loader)
+
+        self.assertEqual(result, 'sharedValue')
+        self.loader.assert_not_called()
+        self.assertEqual(self.cache.local.get(self.KEY), CacheEntry('sharedValue', self.now - 1))
+
+    def test_get__shared_tier_exception(self):
+        self.cache.shared = Mock()
+        self.cache.shared.get = Mock(side_effect=RuntimeError('foo'))
+        self.cache.shared.put = Mock(side_effect=RuntimeError('foo'))
+
+        result = self.cache.get(self.KEY, self.loader)
+
+        self.assertEqual(result, 'value')
+        self.loader.assert_called_once_with()
+
+    def test_get__loader_exception(self):
+        self.loader.side_effect = RuntimeError('foo')
+
+        with self.assertRaises(RuntimeError):
+            self.cache.get(self.KEY, self.loader)
+        self.assertIsNone(self.cache.local.get(self.KEY))
+
+    def test_get__coalesces_concurrent_loads(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_loader():
+            calls.append(1)
+            release.wait()
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get(self.KEY, slow_loader)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
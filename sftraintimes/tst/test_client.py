@@ -0,0 +1,174 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from sftraintimes import client
+from sftraintimes.client import FiveElevenClient, HttpTransport
+from sftraintimes.tst.fakes import FakeFiveElevenServer, build_stop_monitoring_feed
+
+
+class FiveElevenClientTest(TestCase):
+    API_KEY = 'key'
+    AGENCY = 'SF'
+    STOP_ID = '12345'
+    LINE_ID = 'J'
+    STOP_MONITORING_PATH = '/transit/StopMonitoring'
+    PATTERNS_PATH = '/transit/patterns'
+    STOP_MONITORING_BODY = b'{"ServiceDelivery": {"StopMonitoringDelivery": {"MonitoredStopVisit": []}}}'
+    PATTERNS_BODY = b'\xef\xbb\xbf{"journeyPatterns": []}'
+
+    def setUp(self):
+        self.server = FakeFiveElevenServer(routes={
+            self.STOP_MONITORING_PATH: self.STOP_MONITORING_BODY,
+            self.PATTERNS_PATH: self.PATTERNS_BODY
+        }).start()
+        self.addCleanup(self.server.stop)
+        self.transport = HttpTransport(connect_timeout=1, read_timeout=0.5, max_retries=2, backoff=0.001)
+        self.addCleanup(self.transport.close)
+        self.client = FiveElevenClient(self.API_KEY, transport=self.transport, base_url=self.server.base_url)
+
+    def test_get_real_time_stop_monitoring(self):
+        expected = {'ServiceDelivery': {'StopMonitoringDelivery': {'MonitoredStopVisit': []}}}
+
+        result = self.client.get_real_time_stop_monitoring(self.AGENCY, self.STOP_ID)
+
+        self.assertEqual(result, expected)
+        self.assertEqual(self.server.requests, [
+            (self.STOP_MONITORING_PATH, {'api_key': self.API_KEY, 'agency': self.AGENCY, 'stopCode': self.STOP_ID})
+        ])
+
+    def test_get_real_time_stop_monitoring__unexpected_status(self):
+        self.server.fail_next(1, status=401)
+
+        with self.assertRaises(RuntimeError):
+            self.client.get_real_time_stop_monitoring(self.AGENCY, self.STOP_ID)
+        self.assertEqual(self.server.request_count, 1)
+
+    def test_get_patterns_for_line(self):
+        expected = {'journeyPatterns': []}
+
+        result = self.client.get_patterns_for_line(self.AGENCY, self.LINE_ID)
+
+        self.assertEqual(result, expected)
+        self.assertEqual(self.server.requests, [
+            (self.PATTERNS_PATH, {'api_key': self.API_KEY, 'operator_id': self.AGENCY, 'line_id': self.LINE_ID})
+        ])
+
+    def test_iter_agency_stop_visits(self):
+        self.server.routes[self.STOP_MONITORING_PATH] = build_stop_monitoring_feed(50)
+
+        result = list(self.client.iter_agency_stop_visits(self.AGENCY, chunk_size=1024))
+
+        self.assertEqual(len(result), 150)
+        self.assertEqual(result[0]['MonitoringRef'], '10000')
+        self.assertEqual(self.server.requests, [(self.STOP_MONITORING_PATH, {'api_key': self.API_KEY,
+                                                                            'agency': self.AGENCY})])
+
+    def test_iter_agency_stop_visits__retries_and_reuses_connection(self):
+        self.server.routes[self.STOP_MONITORING_PATH] = build_stop_monitoring_feed(5)
+        self.server.fail_next(1, status=503)
+
+        first = list(self.client.iter_agency_stop_visits(self.AGENCY))
+        second = list(self.client.iter_agency_stop_visits(self.AGENCY))
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.server.request_count, 3)
+        self.assertEqual(self.server.connection_count, 1)
+
+    def test_iter_agency_stop_visits__unexpected_status(self):
+        self.server.fail_next(1, status=401)
+
+        with self.assertRaises(RuntimeError):
+            list(self.client.iter_agency_stop_visits(self.AGENCY))
+
+    def test_connection_reuse(self):
+        for _ in range(5):
+            self.client.get_real_time_stop_monitoring(self.AGENCY, self.STOP_ID)
+            self.client.get_patterns_for_line(self.AGENCY, self.LINE_ID)
+
+        self.assertEqual(self.server.request_count, 10)
+        self.assertEqual(self.server.connection_count, 1)
+
+
+class ParseJsonTest(TestCase):
+    PATH = ('ServiceDelivery', 'StopMonitoringDelivery', 'MonitoredStopVisit')
+    BODY = b'\xef\xbb\xbf{"ServiceDelivery": {"ResponseTimestamp": "MonitoredStopVisit", "StopMonitoringDelivery": ' \
+           b'{"version": "1.4", "MonitoredStopVisit" : [{"MonitoringRef": "\xc3\xa9"}], "Status": true}}}'
+    EXPECTED = {'ServiceDelivery': {'StopMonitoringDelivery': {'MonitoredStopVisit': [{'MonitoringRef': '\xe9'}]}}}
+
+    def test_parse_json(self):
+        for backend in self._get_backends():
+            with patch('sftraintimes.client.orjson', backend):
+                self.assertEqual(FiveElevenClient._parse_json(self.BODY, self.PATH), self.EXPECTED)
+
+    def test_parse_json__no_path(self):
+        for backend in self._get_backends():
+            with patch('sftraintimes.client.orjson', backend):
+                result = FiveElevenClient._parse_json(self.BODY)
+
+            self.assertEqual(result['ServiceDelivery']['StopMonitoringDelivery']['version'], '1.4')
+
+    def test_parse_json__missing_key(self):
+        body = b'{"ServiceDelivery": {"StopMonitoringDelivery": {"Status": false}}}'
+
+        for backend in self._get_backends():
+            with patch('sftraintimes.client.orjson', backend):
+                result = FiveElevenClient._parse_json(body, self.PATH)
+
+            self.assertEqual(result, {'ServiceDelivery': {'StopMonitoringDelivery': {'Status': False}}})
+
+    @staticmethod
+    def _get_backends():
+        orjson = client.import_orjson()
+        return [None, orjson] if orjson is not None else [None]
+
+
+class HttpTransportTest(TestCase):
+    PATH = '/transit/StopMonitoring'
+
+    def setUp(self):
+        self.server = FakeFiveElevenServer(routes={self.PATH: b'{}'}).start()
+        self.addCleanup(self.server.stop)
+        self.url = self.server.base_url + '/StopMonitoring'
+        self.transport = HttpTransport(connect_timeout=1, read_timeout=0.2, max_retries=2, backoff=0.001)
+        self.addCleanup(self.transport.close)
+
+    def test_get(self):
+        result = self.transport.get(self.url, params={'foo': 'bar'})
+
+        self.assertEqual(result.status, 200)
+        self.assertEqual(result.data, b'{}')
+        self.assertEqual(self.transport.metrics.request_count, 1)
+        self.assertIsNotNone(self.transport.metrics.last_latency_ms)
+
+    def test_get__retries_retryable_status(self):
+        self.server.fail_next(2, status=503)
+
+        result = self.transport.get(self.url)
+
+        self.assertEqual(result.status, 200)
+        self.assertEqual(self.server.request_count, 3)
+        self.assertEqual(self.transport.metrics.retry_count, 2)
+
+    def test_get__retries_exhausted(self):
+        self.server.fail_next(3, status=503)
+
+        result = self.transport.get(self.url)
+
+        self.assertEqual(result.status, 503)
+        self.assertEqual(self.server.request_count, 3)
+
+    def test_get__does_not_retry_client_error(self):
+        self.server.fail_next(1, status=400)
+
+        result = self.transport.get(self.url)
+
+        self.assertEqual(result.status, 400)
+        self.assertEqual(self.server.request_count, 1)
+
+    def test_get__read_timeout(self):
+        self.server.latency = 0.5
+
+        with self.assertRaises(RuntimeError):
+            self.transport.get(self.url)
+        self.assertEqual(self.server.request_count, 3)
+        self.assertEqual(self.transport.metrics.failure_count, 1)
@@ -0,0 +1,175 @@
+import logging
+import os
+import tempfile
+from io import BytesIO
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from sftraintimes import config
+from sftraintimes.config import Registry
+from sftraintimes.schedule import Schedule, compile_gtfs
+from sftraintimes.tst.test_schedule import GTFS_DIRECTORY
+
+
+class RegistryTest(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_get(self):
+        factory = Mock(return_value='instance')
+
+        first = self.registry.get('name', factory)
+        second = self.registry.get('name', factory)
+
+        self.assertEqual(first, 'instance')
+        self.assertIs(first, second)
+        factory.assert_called_once_with()
+
+    def test_get__none(self):
+        factory = Mock(return_value=None)
+
+        first = self.registry.get('name', factory)
+        second = self.registry.get('name', factory)
+
+        self.assertIsNone(first)
+        self.assertIsNone(second)
+        factory.assert_called_once_with()
+
+    def test_get__factory_exception(self):
+        factory = Mock(side_effect=[RuntimeError('foo'), 'instance'])
+
+        with self.assertRaises(RuntimeError):
+            self.registry.get('name', factory)
+        result = self.registry.get('name', factory)
+
+        self.assertEqual(result, 'instance')
+        self.assertEqual(factory.call_count, 2)
+
+    def test_override(self):
+        factory = Mock(return_value='built')
+        self.registry.override('name', 'overridden')
+
+        result = self.registry.get('name', factory)
+
+        self.assertEqual(result, 'overridden')
+        factory.assert_not_called()
+
+    def test_reset(self):
+        factory = Mock(side_effect=['first', 'second'])
+        self.registry.get('name', factory)
+
+        self.registry.reset()
+        result = self.registry.get('name', factory)
+
+        self.assertEqual(result, 'second')
+        self.assertEqual(factory.call_count, 2)
+
+
+class ConfigTest(TestCase):
+    API_KEYS = b'{"api_key": "key"}'
+
+    def setUp(self):
+        config.reset()
+        self.boto3_patcher = patch('sftraintimes.config.boto3')
+        self.mock_boto3 = self.boto3_patcher.start()
+        self.mock_s3 = self.mock_boto3.client.return_value
+        self.mock_s3.get_object = Mock(side_effect=lambda **kwargs: {'Body': BytesIO(self.API_KEYS)})
+
+    def tearDown(self):
+        self.boto3_patcher.stop()
+        config.reset()
+
+    def test_get_user_service(self):
+        first = config.get_user_service()
+        second = config.get_user_service()
+
+        self.assertIs(first, second)
+        self.mock_boto3.resource.assert_called_once_with('dynamodb')
+
+    def test_get_stop_service(self):
+        first = config.get_stop_service()
+        second = config.get_stop_service()
+
+        self.assertIs(first, second)
+        self.mock_s3.get_object.assert_not_called()
+
+    def test_get_setup_controller(self):
+        setup_controller = config.get_setup_controller()
+        stop_service = config.get_stop_service()
+
+        self.assertIs(setup_controller.line_service.five_eleven_client, stop_service.five_eleven_client)
+
+    def test_get_api_key_provider(self):
+        first = config.get_api_key_provider().get_key()
+        second = config.get_api_key_provider().get_key()
+
+        self.assertEqual(first, 'key')
+        self.assertEqual(second, 'key')
+        self.mock_s3.get_object.assert_called_once_with(Bucket=config.KEY_STORAGE_BUCKET, Key=config.KEY_STORAGE_PATH)
+
+    @patch.dict('sftraintimes.config.environ', {'FIVE_ELEVEN_API_KEY': 'environmentKey'})
+    def test_get_api_key_provider__environment_variable(self):
+        result = config.get_api_key_provider().get_key()
+
+        self.assertEqual(result, 'environmentKey')
+        self.mock_s3.get_object.assert_not_called()
+
+    @patch.dict('sftraintimes.config.environ', {'STOP_SNAPSHOT_BUCKET': 'bucket'})
+    def test_get_snapshot_store(self):
+        result = config.get_snapshot_store()
+
+        self.assertEqual((result.bucket, result.key), ('bucket', config.SNAPSHOT_KEY))
+        self.assertIs(config.get_stop_service().snapshot_store, result)
+
+    def test_get_snapshot_store__not_configured(self):
+        self.assertIsNone(config.get_snapshot_store())
+
+    @patch.dict('sftraintimes.config.environ', {'PATTERN_BUCKET': 'bucket'})
+    def test_get_pattern_store(self):
+        result = config.get_pattern_store()
+
+        self.assertEqual((result.bucket, result.prefix), ('bucket', 'patterns/'))
+        self.assertIs(config.get_line_service().pattern_store, result)
+        self.assertIs(config.get_setup_controller().line_service, config.get_line_service())
+
+    def test_get_pattern_store__not_configured(self):
+        self.assertIsNone(config.get_pattern_store())
+
+    def test_get_schedule(self):
+        with tempfile.TemporaryDirectory() as directory:
+            schedule_path = os.path.join(directory, 'schedule.bin')
+            compile_gtfs(GTFS_DIRECTORY, schedule_path)
+
+            with patch.dict('sftraintimes.config.environ', {'GTFS_SCHEDULE_FILE': schedule_path}):
+                result = config.get_schedule()
+                stop_service = config.get_stop_service()
+            result.close()
+
+        self.assertIsInstance(result, Schedule)
+        self.assertIs(stop_service.schedule, result)
+
+    @patch.dict('sftraintimes.config.environ', {'GTFS_SCHEDULE_FILE': '/nonexistent/schedule.bin'})
+    def test_get_schedule__missing_file(self):
+        self.assertIsNone(config.get_schedule())
+        self.assertIsNone(config.get_stop_service().schedule)
+
+    @patch.dict('sftraintimes.config.environ', {'METRICS_SAMPLE_RATE': '0.1'})
+    def test_get_metrics_recorder(self):
+        result = config.get_metrics_recorder()
+
+        self.assertEqual(result.sample_rate, 0.1)
+        self.assertIs(config.get_metrics_recorder(), result)
+
+    @patch.dict('sftraintimes.config.environ', {'LOG_LEVEL': 'debug'})
+    def test_get_logger(self):
+        self.addCleanup(logging.getLogger('log').setLevel, logging.getLogger('log').level)
+
+        self.assertEqual(config.get_logger().level, logging.DEBUG)
+
+    def test_reset(self):
+        config.get_api_key_provider().get_key()
+
+        config.reset()
+        config.get_api_key_provider().get_key()
+
+        self.assertEqual(self.mock_s3.get_object.call_count, 2)
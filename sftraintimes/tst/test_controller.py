@@ -3,6 +3,7 @@ from unittest.mock import Mock
 
 from sftraintimes.client import FiveElevenClient
 from sftraintimes.controller import SetupController
+from sftraintimes.index import StopIndex
 from sftraintimes.model import Direction
 
 
@@ -35,6 +36,43 @@ class SetupControllerTest(TestCase):
         self.assertIsNone(result)
         self.mock_client.get_patterns_for_line.assert_called_with(self.LINE_ID)
 
+    def test_get_stop_id__indexed_line(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value=self._get_line_patterns())
+        self.setup_controller.get_stop_id(self.LINE_ID, self.STOP_NAME, self.DIRECTION)
+
+        result = self.setup_controller.get_stop_id(self.LINE_ID, 'church st & 18th st', self.DIRECTION)
+
+        self.assertEqual(result, '13895')
+        self.mock_client.get_patterns_for_line.assert_called_once_with(self.LINE_ID)
+
+    def test_get_stop_id__misheard_name(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value=self._get_line_patterns())
+        expected = '13996'
+
+        result = self.setup_controller.get_stop_id(self.LINE_ID, 'chirch st & 24th st', self.DIRECTION)
+
+        self.assertEqual(result, expected)
+
+    def test_find_stop(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value=self._get_line_patterns())
+
+        result = self.setup_controller.find_stop(self.LINE_ID, 'chirch st & 24th st', self.DIRECTION)
+
+        self.assertEqual(result.stop_id, '13996')
+        self.assertEqual(result.name, self.STOP_NAME)
+        self.assertLess(result.confidence, 1.0)
+
+    def test_get_stop_id__preloaded_index(self):
+        stop_index = StopIndex()
+        stop_index.add_line(self.LINE_ID, self._get_line_patterns())
+        self.mock_client.get_patterns_for_line = Mock()
+        setup_controller = SetupController(self.mock_client, stop_index)
+
+        result = setup_controller.get_stop_id(self.LINE_ID, self.STOP_NAME, self.DIRECTION)
+
+        self.assertEqual(result, '13996')
+        self.mock_client.get_patterns_for_line.assert_not_called()
+
     @staticmethod
     def _get_line_patterns():
         return [
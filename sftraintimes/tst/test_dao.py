@@ -4,6 +4,7 @@ from unittest.mock import Mock
 from botocore.exceptions import ClientError
 
 from sftraintimes.dao import UserDAO
+from sftraintimes.tst.fakes import FakeDynamoDBTable
 
 
 class UserDAOTest(TestCase):
@@ -51,8 +52,8 @@ class UserDAOTest(TestCase):
     def test_update_user(self):
         kwargs = {'firstAttribute': 'firstValue', 'secondAttribute': 'secondValue'}
         expected_exp_attr_names = {'#firstAttribute': 'firstAttribute', '#secondAttribute': 'secondAttribute'}
-        expected_exp_attr_values = {':firstValue': 'firstValue', ':secondValue': 'secondValue'}
-        expected_update_expression = 'SET #firstAttribute = :firstValue, #secondAttribute = :secondValue'
+        expected_exp_attr_values = {':firstAttribute': 'firstValue', ':secondAttribute': 'secondValue'}
+        expected_update_expression = 'SET #firstAttribute = :firstAttribute, #secondAttribute = :secondAttribute'
         self.mock_table.update_item = Mock()
 
         self.user_dao.update_user(self.USER_ID, **kwargs)
@@ -77,3 +78,171 @@ class UserDAOTest(TestCase):
         with self.assertRaises(ClientError):
             self.user_dao.update_user(self.USER_ID, **kwargs)
         self.mock_table.update_item.assert_called()
+
+    def test_upsert_user(self):
+        old_user = {'id': 'userId', 'homeStopId': 'oldStopId', 'homeStopLine': 'N'}
+        self.mock_table.update_item = Mock(return_value={'Attributes': old_user})
+        expected_new_user = {'id': 'userId', 'homeStopId': 'newStopId', 'homeStopLine': 'N'}
+
+        result = self.user_dao.upsert_user(self.USER_ID, homeStopId='newStopId')
+
+        self.assertEqual(result, (old_user, expected_new_user))
+        self.mock_table.update_item.assert_called_once_with(
+            Key=self.USER_KEY,
+            UpdateExpression='SET #homeStopId = :homeStopId',
+            ConditionExpression='attribute_not_exists(#id) OR #homeStopId <> :homeStopId',
+            ExpressionAttributeNames={'#homeStopId': 'homeStopId', '#id': 'id'},
+            ExpressionAttributeValues={':homeStopId': 'newStopId'},
+            ReturnValues='ALL_OLD'
+        )
+
+    def test_upsert_user__new_user(self):
+        self.mock_table.update_item = Mock(return_value={})
+
+        result = self.user_dao.upsert_user(self.USER_ID, homeStopId='newStopId')
+
+        self.assertEqual(result, (None, {'id': 'userId', 'homeStopId': 'newStopId'}))
+
+    def test_upsert_user__unchanged(self):
+        user = {'id': 'userId', 'homeStopId': 'stopId', 'homeStopLine': 'N'}
+        mock_client_error = ClientError('foo', 'bar')
+        mock_client_error.response = {'Error': {'Code': 'ConditionalCheckFailedException'},
+                                      'Item': {'id': {'S': 'userId'}, 'homeStopId': {'S': 'stopId'}}}
+        self.mock_table.update_item = Mock(side_effect=mock_client_error)
+        self.mock_table.get_item = Mock(return_value={'Item': user})
+
+        result = self.user_dao.upsert_user(self.USER_ID, homeStopId='stopId')
+
+        self.assertEqual(result, (user, user))
+        self.mock_table.get_item.assert_called_once_with(Key=self.USER_KEY)
+
+    def test_upsert_user__no_kwargs(self):
+        self.mock_table.update_item = Mock()
+
+        with self.assertRaises(ValueError):
+            self.user_dao.upsert_user(self.USER_ID)
+        self.mock_table.update_item.assert_not_called()
+
+    def test_upsert_user__dynamodb_exception(self):
+        mock_client_error = ClientError('foo', 'bar')
+        mock_client_error.response = {'Error': {'Code': 'ProvisionedThroughputExceededException'}}
+        self.mock_table.update_item = Mock(side_effect=mock_client_error)
+
+        with self.assertRaises(ClientError):
+            self.user_dao.upsert_user(self.USER_ID, homeStopId='stopId')
+
+
+class UserDAOBatchTest(TestCase):
+    def setUp(self):
+        self.table = FakeDynamoDBTable()
+        self.user_dao = UserDAO(self.table)
+        self.user_dao.BATCH_BACKOFF = 0
+
+    def test_batch_get_users(self):
+        for index in range(250):
+            self.table.items[str(index)] = {'id': str(index), 'homeStopId': '13996'}
+        user_ids = (str(index) for index in range(260))
+
+        result = list(self.user_dao.batch_get_users(user_ids))
+
+        self.assertEqual(sorted(user['id'] for user in result), sorted(str(index) for index in range(250)))
+        self.assertEqual(self.table.calls['batch_get_item'], 3)
+
+    def test_batch_get_users__duplicate_ids(self):
+        self.table.items['userId'] = {'id': 'userId'}
+
+        result = list(self.user_dao.batch_get_users(['userId', 'userId']))
+
+        self.assertEqual(result, [{'id': 'userId'}])
+
+    def test_batch_get_users__unprocessed_keys(self):
+        self.table.unprocessed_batches = 2
+        for index in range(10):
+            self.table.items[str(index)] = {'id': str(index)}
+
+        result = list(self.user_dao.batch_get_users(str(index) for index in range(10)))
+
+        self.assertEqual(len(result), 10)
+        self.assertEqual(self.table.calls['batch_get_item'], 3)
+
+    def test_batch_get_users__lazy(self):
+        result = self.user_dao.batch_get_users(['userId'])
+
+        self.assertNotIn('batch_get_item', self.table.calls)
+        self.assertEqual(list(result), [])
+
+    def test_batch_get_users__unprocessed_keys_exhausted(self):
+        self.table.unprocessed_batches = UserDAO.MAX_BATCH_ATTEMPTS
+        self.table.items['0'] = {'id': '0'}
+        self.table.items['1'] = {'id': '1'}
+
+        with self.assertRaises(RuntimeError):
+            list(self.user_dao.batch_get_users(['0', '1']))
+
+    def test_scan_users(self):
+        self.table.page_size = 2
+        for index in range(5):
+            self.table.items[str(index)] = {'id': str(index), 'homeStopId': '13996', 'homeStopLine': 'N'}
+
+        result = list(self.user_dao.scan_users('homeStopId'))
+
+        self.assertEqual(result, [{'homeStopId': '13996'}] * 5)
+        self.assertEqual(self.table.calls['scan'], 3)
+
+    def test_batch_write_users(self):
+        users = ({'id': str(index), 'homeStopId': '13996'} for index in range(60))
+
+        result = self.user_dao.batch_write_users(users)
+
+        self.assertEqual(result, 60)
+        self.assertEqual(len(self.table.items), 60)
+        self.assertEqual(self.table.calls['batch_write_item'], 3)
+
+    def test_batch_write_users__duplicate_ids(self):
+        users = [{'id': 'userId', 'homeStopId': 'oldStopId'}, {'id': 'userId', 'homeStopId': 'newStopId'}]
+
+        result = self.user_dao.batch_write_users(users)
+
+        self.assertEqual(result, 1)
+        self.assertEqual(self.table.items, {'userId': {'id': 'userId', 'homeStopId': 'newStopId'}})
+
+    def test_batch_write_users__unprocessed_items(self):
+        self.table.unprocessed_batches = 1
+
+        self.user_dao.batch_write_users({'id': str(index)} for index in range(25))
+
+        self.assertEqual(len(self.table.items), 25)
+        self.assertEqual(self.table.calls['batch_write_item'], 2)
+
+
+class UserDAOFakeTableTest(TestCase):
+    USER_ID = 'userId'
+
+    def setUp(self):
+        self.table = FakeDynamoDBTable()
+        self.user_dao = UserDAO(self.table)
+
+    def test_upsert_user(self):
+        self.table.items[self.USER_ID] = {'id': self.USER_ID, 'homeStopId': 'stopId'}
+
+        result = self.user_dao.upsert_user(self.USER_ID, homeStopId='newStopId')
+
+        self.assertEqual(result, ({'id': self.USER_ID, 'homeStopId': 'stopId'},
+                                  {'id': self.USER_ID, 'homeStopId': 'newStopId'}))
+        self.assertEqual(self.table.items[self.USER_ID], {'id': self.USER_ID, 'homeStopId': 'newStopId'})
+
+    def test_upsert_user__new_user(self):
+        result = self.user_dao.upsert_user(self.USER_ID, homeStopId='stopId')
+
+        self.assertEqual(result, (None, {'id': self.USER_ID, 'homeStopId': 'stopId'}))
+        self.assertEqual(self.table.items[self.USER_ID], {'id': self.USER_ID, 'homeStopId': 'stopId'})
+
+    def test_upsert_user__unchanged(self):
+        user = {'id': self.USER_ID, 'homeStopId': 'stopId', 'homeStopLine': 'N'}
+        self.table.items[self.USER_ID] = dict(user)
+
+        result = self.user_dao.upsert_user(self.USER_ID, homeStopId='stopId')
+
+        self.assertEqual(result, (user, user))
+        self.assertEqual(self.table.calls['update_item'], 1)
+        self.assertEqual(self.table.calls['get_item'], 1)
@@ -0,0 +1,100 @@
+from unittest import TestCase
+
+from sftraintimes.eta import EtaEngine
+from sftraintimes.model import Arrival
+
+
+class EtaEngineTest(TestCase):
+    STOP_ID = '13996'
+    AIMED_TIME = 1541373600
+
+    def setUp(self):
+        self.eta_engine = EtaEngine(smoothing=0.5, vehicle_ttl=600, grace=30)
+
+    def test_observe(self):
+        result = self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 60)], 1541372400)
+
+        self.assertEqual(result, [_get_realtime_arrival(self.AIMED_TIME + 60)])
+
+    def test_observe__smoothed(self):
+        self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 60)], 1541372400)
+
+        result = self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME)], 1541372430)
+
+        self.assertEqual(result[0].arrival_time, self.AIMED_TIME + 30)
+
+    def test_observe__same_observation(self):
+        self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 60)], 1541372400)
+        self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME)], 1541372430)
+
+        result = self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME)], 1541372430)
+
+        self.assertEqual(result[0].arrival_time, self.AIMED_TIME + 30)
+
+    def test_observe__large_change(self):
+        self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME)], 1541372400)
+
+        result = self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 300)], 1541372430)
+
+        self.assertEqual(result[0].arrival_time, self.AIMED_TIME + 300)
+
+    def test_observe__expired_prediction(self):
+        self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 60)], 1541372400)
+
+        result = self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME)], 1541373001)
+
+        self.assertEqual(result[0].arrival_time, self.AIMED_TIME)
+
+    def test_observe__scheduled_arrival(self):
+        scheduled = Arrival('N', 'IB', 'Caltrain', self.AIMED_TIME + 1800, self.AIMED_TIME + 1800, False, '1532')
+        self.eta_engine.observe('14449', [_get_realtime_arrival(self.AIMED_TIME + 120)], 1541372400)
+
+        result = self.eta_engine.observe(self.STOP_ID, [scheduled], 1541372430)
+
+        self.assertEqual(result, [scheduled._replace(arrival_time=self.AIMED_TIME + 1920)])
+        self.assertFalse(result[0].realtime)
+
+    def test_observe__scheduled_arrival_unknown_vehicle(self):
+        scheduled = Arrival('N', 'IB', 'Caltrain', self.AIMED_TIME, self.AIMED_TIME)
+
+        result = self.eta_engine.observe(self.STOP_ID, [scheduled], 1541372400)
+
+        self.assertEqual(result, [scheduled])
+
+    def test_observe__sorted(self):
+        early = Arrival('J', 'OB', 'Balboa Park Station', self.AIMED_TIME + 200, self.AIMED_TIME + 200)
+        self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 100)], 1541372400)
+
+        result = self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 210), early],
+                                         1541372430)
+
+        self.assertEqual([arrival.line for arrival in result], ['N', 'J'])
+
+    def test_observe__max_vehicles(self):
+        self.eta_engine = EtaEngine(max_vehicles=1)
+        self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME + 60)], 1541372400)
+        self.eta_engine.observe('14449', [_get_realtime_arrival(self.AIMED_TIME)], 1541372400)
+
+        result = self.eta_engine.observe(self.STOP_ID, [_get_realtime_arrival(self.AIMED_TIME)], 1541372430)
+
+        self.assertEqual(result[0].arrival_time, self.AIMED_TIME)
+
+    def test_observe__invalid_smoothing(self):
+        with self.assertRaises(ValueError):
+            EtaEngine(smoothing=0)
+
+    def test_age(self):
+        arrivals = [Arrival('N', 'IB', 'Caltrain', 1000), Arrival('N', 'IB', 'Caltrain', 1100)]
+
+        result = self.eta_engine.age(arrivals, 1040)
+
+        self.assertEqual(result, [Arrival('N', 'IB', 'Caltrain', 1100)])
+
+    def test_age__within_grace(self):
+        arrivals = [Arrival('N', 'IB', 'Caltrain', 1000)]
+
+        self.assertEqual(self.eta_engine.age(arrivals, 1030), arrivals)
+
+
+def _get_realtime_arrival(arrival_time):
+    return Arrival('N', 'IB', 'Caltrain', arrival_time, EtaEngineTest.AIMED_TIME, True, '1532')
@@ -0,0 +1,177 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sftraintimes.feed import FileSnapshotStore, S3SnapshotStore, StopSnapshot, ingest_stop_monitoring, \
+    iter_json_array, to_arrival, to_arrivals
+from sftraintimes.model import Arrival
+from sftraintimes.tst.fakes import FakeS3Client, build_stop_monitoring_feed
+from sftraintimes.util import parse_epoch
+
+
+class IterJsonArrayTest(TestCase):
+    def test_iter_json_array(self):
+        document = b'\xef\xbb\xbf{"a": {"b": 1, "Items": [{"x": 1}, {"x": "\\u00e9]"}, {"x": [3]}]}, "c": 2}'
+
+        result = list(iter_json_array(_split(document, 3), 'Items'))
+
+        self.assertEqual(result, [{'x': 1}, {'x': 'é]'}, {'x': [3]}])
+
+    def test_iter_json_array__matches_json_loads(self):
+        body = build_stop_monitoring_feed(20)
+        delivery = json.loads(body.decode('utf-8-sig'))['ServiceDelivery']['StopMonitoringDelivery']
+        expected = delivery['MonitoredStopVisit']
+
+        result = list(iter_json_array(_split(body, 1000), 'MonitoredStopVisit'))
+
+        self.assertEqual(result, expected)
+
+    def test_iter_json_array__empty_array(self):
+        self.assertEqual(list(iter_json_array([b'{"Items":[]}'], 'Items')), [])
+
+    def test_iter_json_array__missing_key(self):
+        self.assertEqual(list(iter_json_array([b'{"Other":[1]}'], 'Items')), [])
+
+    def test_iter_json_array__truncated_document(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"Items":[{"x": 1}, {"x"'], 'Items'))
+
+
+class ToArrivalsTest(TestCase):
+    def test_to_arrivals(self):
+        visit = _get_visit('13996', 'N', 'IB', '2018-11-04T23:20:00Z')
+        journey = visit['MonitoredVehicleJourney']
+        journey['MonitoredCall']['ExpectedArrivalTime'] = '2018-11-04T23:22:00Z'
+        journey['VehicleRef'] = '1532'
+        journey['VehicleLocation'] = {'Longitude': '-122.41', 'Latitude': '37.77'}
+
+        result = to_arrivals([visit])
+
+        self.assertEqual(result, [Arrival('N', 'IB', 'Destination', parse_epoch('2018-11-04T23:22:00Z'),
+                                          parse_epoch('2018-11-04T23:20:00Z'), True, '1532', 37.77, -122.41)])
+        self.assertEqual(result[0].delay, 120)
+        self.assertEqual(to_arrival(visit), result[0])
+
+    def test_to_arrivals__scheduled(self):
+        visit = _get_visit('13996', 'N', 'IB', '2018-11-04T23:20:00Z')
+        visit['MonitoredVehicleJourney']['VehicleLocation'] = {'Longitude': '', 'Latitude': ''}
+
+        result = to_arrivals([visit])
+
+        self.assertEqual(result, [_get_scheduled_arrival('N', 'IB', '2018-11-04T23:20:00Z')])
+        self.assertFalse(result[0].realtime)
+        self.assertEqual(result[0].delay, 0)
+
+    def test_to_arrivals__no_arrival_time(self):
+        visit = _get_visit('13996', 'N', 'IB', None)
+
+        self.assertEqual(to_arrivals([visit]), [])
+        self.assertIsNone(to_arrival(visit))
+
+
+class StopSnapshotTest(TestCase):
+    def setUp(self):
+        self.snapshot = StopSnapshot.build([
+            _get_visit('13996', 'N', 'IB', '2018-11-04T23:20:00Z'),
+            _get_visit('13996', 'J', 'OB', '2018-11-04T23:10:00Z'),
+            _get_visit('14449', 'N', 'IB', '2018-11-04T23:15:00Z')
+        ], 1541372400)
+
+    def test_get_arrivals(self):
+        result = self.snapshot.get_arrivals('13996')
+
+        self.assertEqual(result, [_get_scheduled_arrival('J', 'OB', '2018-11-04T23:10:00Z'),
+                                  _get_scheduled_arrival('N', 'IB', '2018-11-04T23:20:00Z')])
+
+    def test_get_arrivals__after(self):
+        result = self.snapshot.get_arrivals('13996', after=parse_epoch('2018-11-04T23:15:00Z'))
+
+        self.assertEqual(result, [_get_scheduled_arrival('N', 'IB', '2018-11-04T23:20:00Z')])
+
+    def test_get_arrivals__missing_stop(self):
+        self.assertIsNone(self.snapshot.get_arrivals('12345'))
+
+    def test_to_bytes(self):
+        result = StopSnapshot.from_bytes(self.snapshot.to_bytes())
+
+        self.assertEqual(result.generated_at, 1541372400)
+        self.assertEqual(result.get_arrivals('13996'), self.snapshot.get_arrivals('13996'))
+        self.assertEqual(result.get_arrivals('14449'), self.snapshot.get_arrivals('14449'))
+
+    def test_to_bytes__realtime_arrival(self):
+        visit = _get_visit('13996', 'N', 'IB', '2018-11-04T23:20:00Z')
+        journey = visit['MonitoredVehicleJourney']
+        journey['MonitoredCall']['ExpectedArrivalTime'] = '2018-11-04T23:19:00Z'
+        journey['VehicleRef'] = '1532'
+        journey['VehicleLocation'] = {'Longitude': '-122.41', 'Latitude': '37.77'}
+        snapshot = StopSnapshot.build([visit], 1541372400)
+
+        result = StopSnapshot.from_bytes(snapshot.to_bytes()).get_arrivals('13996')
+
+        self.assertEqual(result, [Arrival('N', 'IB', 'Destination', parse_epoch('2018-11-04T23:19:00Z'),
+                                          parse_epoch('2018-11-04T23:20:00Z'), True, '1532', 37.77, -122.41)])
+
+
+class SnapshotStoreTest(TestCase):
+    def setUp(self):
+        self.snapshot = StopSnapshot.build([_get_visit('13996', 'N', 'IB', '2018-11-04T23:20:00Z')], 1541372400)
+
+    def test_file_snapshot_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = FileSnapshotStore(os.path.join(directory, 'snapshots', 'stop_snapshot.json'))
+            missing = store.load()
+            store.publish(self.snapshot)
+
+            result = store.load()
+
+        self.assertIsNone(missing)
+        self.assertEqual(result.get_arrivals('13996'), self.snapshot.get_arrivals('13996'))
+
+    def test_s3_snapshot_store(self):
+        store = S3SnapshotStore(FakeS3Client(), 'bucket', 'stop_snapshot.json')
+        store.publish(self.snapshot)
+
+        result = store.load()
+
+        self.assertEqual(result.get_arrivals('13996'), self.snapshot.get_arrivals('13996'))
+
+    def test_s3_snapshot_store__missing_snapshot(self):
+        self.assertIsNone(S3SnapshotStore(FakeS3Client(), 'bucket', 'stop_snapshot.json').load())
+
+
+class IngestStopMonitoringTest(TestCase):
+    def test_ingest_stop_monitoring(self):
+        visits = [_get_visit('13996', 'N', 'IB', '2018-11-04T23:20:00Z'),
+                  _get_visit('14449', 'N', 'OB', '2018-11-04T23:15:00Z')]
+        mock_client = Mock()
+        mock_client.iter_agency_stop_visits = Mock(return_value=iter(visits))
+        mock_store = Mock()
+
+        result = ingest_stop_monitoring(mock_client, 'SF', mock_store, clock=lambda: 1541372400.5)
+
+        self.assertEqual(result.generated_at, 1541372400)
+        self.assertEqual(sorted(result.stops), ['13996', '14449'])
+        mock_client.iter_agency_stop_visits.assert_called_once_with('SF')
+        mock_store.publish.assert_called_once_with(result)
+
+
+def _split(data, size):
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+def _get_scheduled_arrival(line_id, direction, arrival_time):
+    return Arrival(line_id, direction, 'Destination', parse_epoch(arrival_time), parse_epoch(arrival_time))
+
+
+def _get_visit(stop_id, line_id, direction, arrival_time):
+    return {
+        'MonitoringRef': stop_id,
+        'MonitoredVehicleJourney': {
+            'LineRef': line_id,
+            'DirectionRef': direction,
+            'DestinationName': 'Destination',
+            'MonitoredCall': {'AimedArrivalTime': arrival_time}
+        }
+    }
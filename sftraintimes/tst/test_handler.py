@@ -1,13 +1,317 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import time
 from unittest import TestCase
 from unittest.mock import Mock, patch
 
 from sftraintimes.handler import handle_request, on_launch, on_intent, handle_help_intent, handle_fallback_intent, \
-    handle_launch_request, handle_set_home_stop_by_id_intent, handle_set_home_stop_intent, handle_get_next_train_intent
+    handle_launch_request, handle_set_home_stop_by_id_intent, handle_set_home_stop_intent, \
+    handle_get_next_train_intent, handle_prewarm_event, handle_ingest_event, handle_refresh_patterns_event, \
+    HELP_INTENT_MESSAGE, LAUNCH_INTENT_MESSAGE, RESPONSE_RESERVE, SCHEDULED_ARRIVALS_CAVEAT, STALE_ARRIVALS_CAVEAT
+from sftraintimes.metrics import MetricsRecorder
+from sftraintimes.model import Arrival, ArrivalSource, UpcomingArrivals
 
 
 class HandlerTest(TestCase):
+    USER_ID = 'userId'
+    STOP_ID = '13996'
+
     def setUp(self):
-        pass
+        self.mock_user_service = Mock()
+        self.mock_user_service.get_user = Mock(return_value={'id': self.USER_ID, 'homeStopId': self.STOP_ID})
+        self.mock_stop_service = Mock()
+        self.mock_stop_service.lookup_upcoming_arrivals = Mock(return_value=_get_sample_upcoming_arrivals(7, 19))
+
+    def test_handle_get_next_train_intent(self):
+        response = handle_get_next_train_intent(_get_sample_session(self.USER_ID), self.mock_stop_service,
+                                                self.mock_user_service)
+
+        self.assertEqual(response['response']['outputSpeech']['text'],
+                         'The next train at your stop arrives in 7 minutes.')
+        self.mock_user_service.get_user.assert_called_once_with(self.USER_ID)
+        self.mock_stop_service.lookup_upcoming_arrivals.assert_called_once_with(self.STOP_ID, None)
+
+    def test_handle_get_next_train_intent__two_trains(self):
+        self.mock_stop_service.lookup_upcoming_arrivals = Mock(return_value=_get_sample_upcoming_arrivals(3, 12))
+
+        response = handle_get_next_train_intent(_get_sample_session(self.USER_ID), self.mock_stop_service,
+                                                self.mock_user_service)
+
+        self.assertEqual(response['response']['outputSpeech']['text'],
+                         'The next train at your stop arrives in 3 minutes. After that, there\'s one in 12 minutes.')
+
+    def test_handle_get_next_train_intent__stale_arrivals(self):
+        self.mock_stop_service.lookup_upcoming_arrivals = Mock(
+            return_value=_get_sample_upcoming_arrivals(7, 19, source=ArrivalSource.STALE))
+
+        response = handle_get_next_train_intent(_get_sample_session(self.USER_ID), self.mock_stop_service,
+                                                self.mock_user_service)
+
+        self.assertEqual(response['response']['outputSpeech']['text'],
+                         'The next train at your stop arrives in 7 minutes.' + STALE_ARRIVALS_CAVEAT)
+
+    def test_handle_get_next_train_intent__scheduled_arrival(self):
+        self.mock_stop_service.lookup_upcoming_arrivals = Mock(
+            return_value=_get_sample_upcoming_arrivals(3, source=ArrivalSource.SCHEDULE))
+
+        response = handle_get_next_train_intent(_get_sample_session(self.USER_ID), self.mock_stop_service,
+                                                self.mock_user_service)
+
+        self.assertEqual(response['response']['outputSpeech']['text'],
+                         'The next train at your stop arrives in 3 minutes.' + SCHEDULED_ARRIVALS_CAVEAT)
+
+    def test_handle_get_next_train_intent__no_user(self):
+        self.mock_user_service.get_user = Mock(return_value=None)
+
+        response = handle_get_next_train_intent(_get_sample_session(self.USER_ID), self.mock_stop_service,
+                                                self.mock_user_service)
+
+        self.assertEqual(response['response']['outputSpeech']['text'],
+                         'Sorry, you\'ll need to set your home stop before asking for train times.')
+        self.mock_stop_service.lookup_upcoming_arrivals.assert_not_called()
+
+    @patch('sftraintimes.handler.get_api_key_provider')
+    @patch('sftraintimes.handler.get_stop_service')
+    def test_handle_get_next_train_intent__overlaps_service_construction_with_user_read(self, mock_get_stop_service,
+                                                                                         mock_get_api_key_provider):
+        def slow_get_stop_service():
+            time.sleep(0.2)
+            return self.mock_stop_service
+
+        def slow_get_user(user_id):
+            time.sleep(0.2)
+            return {'id': user_id, 'homeStopId': self.STOP_ID}
+
+        mock_get_stop_service.side_effect = slow_get_stop_service
+        self.mock_user_service.get_user = Mock(side_effect=slow_get_user)
+
+        start = time.perf_counter()
+        handle_get_next_train_intent(_get_sample_session(self.USER_ID), user_service=self.mock_user_service)
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 0.35)
+        mock_get_api_key_provider.return_value.get_key.assert_called_once_with()
+
+    def test_handle_get_next_train_intent__caches_user_in_session(self):
+        user = {'id': self.USER_ID, 'homeStopId': self.STOP_ID}
+
+        response = handle_get_next_train_intent(_get_sample_session(self.USER_ID), self.mock_stop_service,
+                                                self.mock_user_service)
+
+        self.assertEqual(response['sessionAttributes'], {'user': user})
+
+    def test_handle_get_next_train_intent__user_cached_in_session(self):
+        session = _get_sample_session(self.USER_ID, attributes={'user': {'id': self.USER_ID, 'homeStopId': '14449'}})
+
+        response = handle_get_next_train_intent(session, self.mock_stop_service, self.mock_user_service)
+
+        self.assertEqual(response['response']['outputSpeech']['text'],
+                         'The next train at your stop arrives in 7 minutes.')
+        self.mock_user_service.get_user.assert_not_called()
+        self.mock_stop_service.lookup_upcoming_arrivals.assert_called_once_with('14449', None)
+
+    def test_handle_get_next_train_intent__session_cached_for_other_user(self):
+        session = _get_sample_session(self.USER_ID, attributes={'user': {'id': 'otherUser', 'homeStopId': '14449'}})
+
+        handle_get_next_train_intent(session, self.mock_stop_service, self.mock_user_service)
+
+        self.mock_user_service.get_user.assert_called_once_with(self.USER_ID)
+        self.mock_stop_service.lookup_upcoming_arrivals.assert_called_once_with(self.STOP_ID, None)
+
+    def test_handle_set_home_stop_by_id_intent(self):
+        request = {'intent': {'slots': {'stopId': {'value': '14449'}}}}
+        session = _get_sample_session(self.USER_ID, attributes={'user': {'id': self.USER_ID, 'homeStopId': '1'}})
+        new_user = {'id': self.USER_ID, 'homeStopId': '14449'}
+        self.mock_user_service.upsert_user = Mock(return_value=({'id': self.USER_ID, 'homeStopId': '1'}, new_user))
+
+        response = handle_set_home_stop_by_id_intent(request, session, self.mock_user_service)
+
+        self.assertEqual(response['sessionAttributes'], {'user': new_user})
+        self.mock_user_service.upsert_user.assert_called_once_with(self.USER_ID, homeStopId='14449')
+        self.mock_user_service.get_user.assert_not_called()
+
+    def test_handle_set_home_stop_intent(self):
+        mock_setup_controller = Mock()
+        mock_setup_controller.get_stop_id = Mock(return_value='14449')
+        session = _get_sample_session(self.USER_ID, attributes={'user': {'id': self.USER_ID, 'homeStopId': '1'}})
+        new_user = {'id': self.USER_ID, 'homeStopId': '14449', 'homeStopLine': 'N', 'homeStopDirection': 'IB'}
+        self.mock_user_service.upsert_user = Mock(return_value=(None, new_user))
+
+        response = handle_set_home_stop_intent(_get_completed_set_home_stop_request(), session, self.mock_user_service,
+                                               mock_setup_controller)
+
+        self.assertEqual(response['response']['outputSpeech']['text'],
+                         'I\'ve set your home stop to duboce avenue and church street on the inbound N line')
+        self.assertEqual(response['sessionAttributes'], {'user': new_user})
+        self.mock_user_service.upsert_user.assert_called_once_with(self.USER_ID, homeStopId='14449', homeStopLine='N',
+                                                                   homeStopDirection='IB')
+        self.mock_user_service.get_user.assert_not_called()
+
+    def test_handle_help_intent__keeps_session_attributes(self):
+        attributes = {'user': {'id': self.USER_ID, 'homeStopId': self.STOP_ID}}
+
+        response = handle_help_intent(_get_sample_session(self.USER_ID, attributes=attributes))
+
+        self.assertEqual(response['sessionAttributes'], attributes)
+
+    @patch('sftraintimes.handler.get_user_service')
+    @patch('sftraintimes.handler.get_stop_service')
+    def test_handle_request__deadline(self, mock_get_stop_service, mock_get_user_service):
+        mock_get_stop_service.return_value = self.mock_stop_service
+        mock_get_user_service.return_value = self.mock_user_service
+        event = {'request': {'type': 'IntentRequest', 'intent': {'name': 'GetNextTrainIntent'}},
+                 'session': _get_sample_session(self.USER_ID)}
+
+        with patch('sftraintimes.handler.get_api_key_provider'):
+            handle_request(event, Mock(get_remaining_time_in_millis=Mock(return_value=2000)))
+
+        deadline = self.mock_stop_service.lookup_upcoming_arrivals.call_args[0][1]
+        self.assertLessEqual(deadline.remaining(), 2.0 - RESPONSE_RESERVE)
+        self.assertGreater(deadline.remaining(), 1.0)
+
+    @patch('sftraintimes.handler.get_metrics_recorder')
+    def test_handle_request__metrics(self, mock_get_metrics_recorder):
+        stream = io.StringIO()
+        mock_get_metrics_recorder.return_value = MetricsRecorder(stream=stream)
+        event = {'request': {'type': 'IntentRequest', 'intent': {'name': 'AMAZON.HelpIntent'}},
+                 'session': _get_sample_session(self.USER_ID)}
+
+        response = handle_request(event, Mock(get_remaining_time_in_millis=Mock(return_value=6000)))
+
+        self.assertEqual(response['response']['outputSpeech']['text'], HELP_INTENT_MESSAGE)
+        self.assertEqual(json.loads(stream.getvalue())['Request'], 'AMAZON.HelpIntent')
+
+    def test_on_intent(self):
+        request = {'type': 'IntentRequest', 'intent': {'name': 'AMAZON.HelpIntent'}}
+
+        response = on_intent(request, _get_sample_session(self.USER_ID))
+
+        self.assertEqual(response, handle_help_intent(_get_sample_session(self.USER_ID)))
+
+    def test_on_intent__unrecognized_intent(self):
+        request = {'type': 'IntentRequest', 'intent': {'name': 'UnknownIntent'}}
+
+        response = on_intent(request, _get_sample_session(self.USER_ID))
+
+        self.assertEqual(response, handle_fallback_intent(_get_sample_session(self.USER_ID)))
+
+    def test_handle_launch_request(self):
+        response = handle_launch_request()
+
+        self.assertEqual(response, {
+            'version': '1.0',
+            'sessionAttributes': {},
+            'response': {'outputSpeech': {'type': 'PlainText', 'text': LAUNCH_INTENT_MESSAGE + HELP_INTENT_MESSAGE}}
+        })
+
+    def test_handle_prewarm_event(self):
+        mock_context = Mock()
+        mock_context.get_remaining_time_in_millis = Mock(return_value=60000)
+        self.mock_user_service.get_popular_home_stop_ids = Mock(return_value=[self.STOP_ID, '14449'])
+        self.mock_stop_service.prewarm_upcoming_arrivals = Mock(return_value=2)
+
+        result = handle_prewarm_event({'stopCount': 10, 'rounds': 3, 'interval': 0}, mock_context,
+                                      self.mock_stop_service, self.mock_user_service)
+
+        self.assertEqual(result, {'stopIds': [self.STOP_ID, '14449'], 'warmed': [2, 2, 2]})
+        self.mock_user_service.get_popular_home_stop_ids.assert_called_once_with(10)
+        self.assertEqual(self.mock_stop_service.prewarm_upcoming_arrivals.call_count, 3)
+
+    def test_handle_prewarm_event__stops_before_timeout(self):
+        mock_context = Mock()
+        mock_context.get_remaining_time_in_millis = Mock(return_value=30000)
+        self.mock_user_service.get_popular_home_stop_ids = Mock(return_value=[self.STOP_ID])
+        self.mock_stop_service.prewarm_upcoming_arrivals = Mock(return_value=1)
+
+        result = handle_prewarm_event({'rounds': 3, 'interval': 20}, mock_context, self.mock_stop_service,
+                                      self.mock_user_service)
+
+        self.assertEqual(result['warmed'], [1])
+
+    @patch('sftraintimes.handler.ingest_stop_monitoring')
+    def test_handle_ingest_event(self, mock_ingest_stop_monitoring):
+        mock_client = Mock()
+        mock_store = Mock()
+        mock_ingest_stop_monitoring.return_value = Mock(generated_at=1541372400, stops={self.STOP_ID: ()})
+
+        result = handle_ingest_event({}, Mock(), mock_client, mock_store)
+
+        self.assertEqual(result, {'generatedAt': 1541372400, 'stopCount': 1})
+        mock_ingest_stop_monitoring.assert_called_once_with(mock_client, 'SF', mock_store)
+
+    def test_handle_refresh_patterns_event(self):
+        mock_line_service = Mock()
+        mock_line_service.refresh_patterns_for_line = Mock(side_effect=[True, False, RuntimeError('511 is down')])
+
+        result = handle_refresh_patterns_event({'lineIds': ['KJ', 'L', 'N']}, Mock(), mock_line_service)
+
+        self.assertEqual(result, {'lineIds': ['KJ', 'L', 'N'], 'changed': ['KJ'], 'failed': ['N']})
+
+    def test_handle_refresh_patterns_event__every_line_failed(self):
+        mock_line_service = Mock()
+        mock_line_service.refresh_patterns_for_line = Mock(side_effect=RuntimeError('511 is down'))
+
+        with self.assertRaises(RuntimeError):
+            handle_refresh_patterns_event({'lineIds': ['KJ', 'L']}, Mock(), mock_line_service)
+
+
+class ColdStartTest(TestCase):
+    # Runs in a fresh interpreter, since this one has already imported everything the other tests use.
+    SCRIPT = '''
+import json
+import sys
+from sftraintimes.handler import handle_request
+session = {'user': {'userId': 'userId'}}
+handle_request({'request': {'type': 'LaunchRequest'}, 'session': session}, None)
+for intent_name in ['AMAZON.HelpIntent', 'AMAZON.FallbackIntent']:
+    handle_request({'request': {'type': 'IntentRequest', 'intent': {'name': intent_name}}, 'session': session}, None)
+print(json.dumps(sorted(name for name in sys.modules if name.split('.')[0] in ('boto3', 'botocore', 'urllib3'))))
+'''
+
+    def test_static_intents__no_aws_or_http_imports(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        output = subprocess.check_output([sys.executable, '-c', self.SCRIPT], cwd=root)
+
+        # Earlier lines are the metrics written for each request.
+        self.assertEqual(json.loads(output.decode('utf-8').splitlines()[-1]), [])
+
+
+def _get_completed_set_home_stop_request():
+    return {
+        'dialogState': 'COMPLETED',
+        'intent': {
+            'slots': {
+                'line': _get_resolved_slot('N'),
+                'direction': _get_resolved_slot('IB'),
+                'firstStreet': {'value': 'duboce avenue'},
+                'secondStreet': {'value': 'church street'}
+            }
+        }
+    }
+
+
+def _get_resolved_slot(name):
+    return {'resolutions': {'resolutionsPerAuthority': [{'values': [{'value': {'name': name}}]}]}}
+
+
+def _get_sample_session(user_id, attributes=None):
+    session = {'user': {'userId': user_id}}
+    if attributes is not None:
+        session['attributes'] = attributes
+    return session
+
+
+def _get_sample_arrivals(*minutes_away):
+    now = int(time.time())
+    return [Arrival('N', 'IB', 'Caltrain', now + minutes * 60 + 30) for minutes in minutes_away]
+
+
+def _get_sample_upcoming_arrivals(*minutes_away, source=ArrivalSource.LIVE):
+    return UpcomingArrivals(_get_sample_arrivals(*minutes_away), source)
 
 
 def _get_sample_request(request_type):
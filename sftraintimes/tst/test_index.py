@@ -0,0 +1,84 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from sftraintimes.index import StopIndex
+
+
+class StopIndexTest(TestCase):
+    LINE_ID = 'J'
+
+    def setUp(self):
+        self.index = StopIndex()
+        self.index.add_line(self.LINE_ID, _get_line_patterns())
+
+    def test_get_stop_id(self):
+        self.assertEqual(self.index.get_stop_id(self.LINE_ID, 'IB', 'church st & 18th st'), '13895')
+        self.assertEqual(self.index.get_stop_id(self.LINE_ID, 'IB', 'Church St  &  24th St'), '13996')
+        self.assertEqual(self.index.get_stop_id(self.LINE_ID, 'OB', 'church street and twenty-fourth street'), '13997')
+
+    def test_get_stop_id__missing_stop(self):
+        self.assertIsNone(self.index.get_stop_id(self.LINE_ID, 'IB', 'market st & castro st'))
+        self.assertIsNone(self.index.get_stop_id('N', 'IB', 'church st & 18th st'))
+
+    def test_find_stop(self):
+        exact = self.index.find_stop(self.LINE_ID, 'IB', 'Church St & 24th St')
+        fuzzy = self.index.find_stop(self.LINE_ID, 'IB', 'chirch st & 24th st')
+
+        self.assertEqual(exact.stop_id, '13996')
+        self.assertEqual(exact.confidence, 1.0)
+        self.assertEqual(fuzzy.stop_id, '13996')
+        self.assertLess(fuzzy.confidence, 1.0)
+
+    def test_find_stop__missing_line(self):
+        self.assertIsNone(self.index.find_stop('N', 'IB', 'church st & 24th st'))
+
+    def test_has_line(self):
+        self.assertTrue(self.index.has_line(self.LINE_ID))
+        self.assertFalse(self.index.has_line('N'))
+
+    def test_add_line__replaces_existing_stops(self):
+        self.index.add_line(self.LINE_ID, [])
+
+        self.assertTrue(self.index.has_line(self.LINE_ID))
+        self.assertIsNone(self.index.get_stop_id(self.LINE_ID, 'IB', 'church st & 18th st'))
+
+    def test_save(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'data', 'stop_index.json')
+            self.index.save(path)
+
+            result = StopIndex.load(path)
+
+        self.assertEqual(result.to_dict(), self.index.to_dict())
+        self.assertEqual(result.get_stop_id(self.LINE_ID, 'IB', 'church st & 24th st'), '13996')
+
+    def test_load__missing_file(self):
+        result = StopIndex.load(os.path.join(tempfile.gettempdir(), 'missing', 'stop_index.json'))
+
+        self.assertEqual(result.to_dict(), {})
+
+
+def _get_line_patterns():
+    return [
+        {
+            'DirectionRef': 'IB',
+            'PointsInSequence': {
+                'StopPointInJourneyPattern': [
+                    {'Name': 'Church St & 18th St', 'ScheduledStopPointRef': '13895'}
+                ],
+                'TimingPointInJourneyPattern': [
+                    {'Name': 'Church St & 24th St', 'ScheduledStopPointRef': '13996'}
+                ]
+            }
+        },
+        {
+            'DirectionRef': 'OB',
+            'PointsInSequence': {
+                'StopPointInJourneyPattern': [
+                    {'Name': 'Church St & 24th St', 'ScheduledStopPointRef': '13997'}
+                ],
+                'TimingPointInJourneyPattern': []
+            }
+        }
+    ]
@@ -0,0 +1,136 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from sftraintimes.keys import ApiKeyProvider, EnvironmentKeySource, FileKeySource, S3KeySource
+from sftraintimes.tst.fakes import FakeS3Client
+
+
+class S3KeySourceTest(TestCase):
+    BUCKET = 'bucket'
+    PATH = 'five_eleven_keys.json'
+
+    def setUp(self):
+        self.s3_client = FakeS3Client()
+        self.source = S3KeySource(self.s3_client, self.BUCKET, self.PATH)
+
+    def test_load(self):
+        self.s3_client.put_object(Bucket=self.BUCKET, Key=self.PATH, Body='{"api_key": "s3Key"}')
+
+        result = self.source.load()
+
+        self.assertEqual(result, 's3Key')
+
+    def test_load__missing_object(self):
+        with self.assertRaises(Exception):
+            self.source.load()
+
+
+class FileKeySourceTest(TestCase):
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'keys.json')
+            with open(path, 'w') as key_file:
+                key_file.write('{"api_key": "fileKey"}')
+
+            result = FileKeySource(path).load()
+
+        self.assertEqual(result, 'fileKey')
+
+
+class EnvironmentKeySourceTest(TestCase):
+    VARIABLE = 'SFTRAINTIMES_TEST_KEY'
+
+    @patch.dict('os.environ', {VARIABLE: 'environmentKey'})
+    def test_load(self):
+        result = EnvironmentKeySource(self.VARIABLE).load()
+
+        self.assertEqual(result, 'environmentKey')
+
+    @patch.dict('os.environ', {}, clear=True)
+    def test_load__unset(self):
+        with self.assertRaises(KeyError):
+            EnvironmentKeySource(self.VARIABLE).load()
+
+
+class ApiKeyProviderTest(TestCase):
+    TTL = 100
+    REFRESH_MARGIN = 10
+    RETRY_INTERVAL = 5
+
+    def setUp(self):
+        self.now = 0
+        self.source = Mock()
+        self.source.load = Mock(return_value='firstKey')
+        self.provider = ApiKeyProvider(self.source, ttl=self.TTL, refresh_margin=self.REFRESH_MARGIN,
+                                       retry_interval=self.RETRY_INTERVAL, clock=lambda: self.now)
+
+    def test_get_key(self):
+        first = self.provider.get_key()
+        self.now = 50
+        second = self.provider.get_key()
+
+        self.assertEqual(first, 'firstKey')
+        self.assertEqual(second, 'firstKey')
+        self.source.load.assert_called_once_with()
+
+    def test_get_key__source_exception_on_first_load(self):
+        self.source.load = Mock(side_effect=RuntimeError('foo'))
+
+        with self.assertRaises(RuntimeError):
+            self.provider.get_key()
+
+    def test_get_key__refreshes_in_background_before_expiry(self):
+        self.provider.get_key()
+        self.source.load = Mock(return_value='secondKey')
+        self.now = self.TTL - self.REFRESH_MARGIN
+
+        self.provider.get_key()
+        self.provider._refresh_thread.join()
+        result = self.provider.get_key()
+
+        self.assertEqual(result, 'secondKey')
+        self.source.load.assert_called_once_with()
+
+    def test_get_key__serves_last_good_key_when_refresh_fails(self):
+        self.provider.get_key()
+        self.source.load = Mock(side_effect=RuntimeError('foo'))
+        self.now = self.TTL * 2
+
+        self.provider.get_key()
+        self.provider._refresh_thread.join()
+        result = self.provider.get_key()
+
+        self.assertEqual(result, 'firstKey')
+        self.source.load.assert_called_once_with()
+
+    def test_get_key__slow_source_does_not_block(self):
+        s3_client = FakeS3Client()
+        s3_client.put_object(Bucket='bucket', Key='path', Body='{"api_key": "s3Key"}')
+        provider = ApiKeyProvider(S3KeySource(s3_client, 'bucket', 'path'), ttl=0, refresh_margin=0)
+        provider.get_key()
+        s3_client.latency = 1
+
+        result = provider.get_key()
+
+        self.assertEqual(result, 's3Key')
+        self.assertTrue(provider._refresh_thread.is_alive())
+
+    def test_refresh(self):
+        self.provider.get_key()
+        self.source.load = Mock(return_value='secondKey')
+
+        result = self.provider.refresh()
+
+        self.assertTrue(result)
+        self.assertEqual(self.provider.get_key(), 'secondKey')
+
+    def test_refresh__source_exception(self):
+        self.provider.get_key()
+        self.source.load = Mock(side_effect=RuntimeError('foo'))
+
+        result = self.provider.refresh()
+
+        self.assertFalse(result)
+        self.assertEqual(self.provider.get_key(), 'firstKey')
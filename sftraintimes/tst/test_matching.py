@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from sftraintimes.matching import StopMatch, StopMatcher
+
+
+class StopMatcherTest(TestCase):
+    STOPS = {
+        'church st & 24th st': '13996',
+        'church st & 18th st': '13895',
+        'church st & 16th st': '13894',
+        'duboce ave & church st': '14449',
+        'san jose ave & glen park station': '16994'
+    }
+
+    def setUp(self):
+        self.matcher = StopMatcher(self.STOPS)
+
+    def test_match(self):
+        result = self.matcher.match('church st & 24th st')
+
+        self.assertEqual(result, StopMatch('13996', 'church st & 24th st', 1.0))
+
+    def test_match__misheard_name(self):
+        result = self.matcher.match('dubose ave & church st')
+
+        self.assertEqual(result.stop_id, '14449')
+        self.assertGreater(result.confidence, 0.9)
+        self.assertLess(result.confidence, 1.0)
+
+    def test_match__misspelled_name(self):
+        result = self.matcher.match('chirch st & 16th st')
+
+        self.assertEqual(result.stop_id, '13894')
+
+    def test_match__streets_in_either_order(self):
+        result = self.matcher.match('24th st & church st')
+
+        self.assertEqual(result.stop_id, '13996')
+        self.assertEqual(result.confidence, 1.0)
+
+    def test_match__no_close_stop(self):
+        self.assertIsNone(self.matcher.match('geary blvd & masonic ave'))
+
+    def test_match__min_confidence(self):
+        self.assertIsNone(self.matcher.match('dubose ave & church st', min_confidence=1.0))
+
+    def test_rank(self):
+        result = self.matcher.rank('church st & 18th st', limit=2)
+
+        self.assertEqual([match.stop_id for match in result], ['13895', '13894'])
+        self.assertGreater(result[0].confidence, result[1].confidence)
+
+    def test_rank__empty_matcher(self):
+        self.assertEqual(StopMatcher({}).rank('church st & 18th st'), [])
@@ -0,0 +1,87 @@
+import io
+import json
+import threading
+from unittest import TestCase
+
+from sftraintimes.metrics import MetricsRecorder, span, timed
+
+
+class MetricsRecorderTest(TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.recorder = MetricsRecorder(namespace='Test', sample_rate=0.5, stream=self.stream, sample=lambda: 0.25,
+                                        clock=lambda: 1541372400.5)
+
+    def test_invocation(self):
+        with self.recorder.invocation('GetNextTrainIntent') as invocation:
+            with span('S3KeySource.load'):
+                pass
+            _get_user()
+            _get_user()
+
+        document = json.loads(self.stream.getvalue())
+        self.assertIsNotNone(invocation)
+        self.assertEqual(document['_aws']['Timestamp'], 1541372400500)
+        self.assertEqual(document['_aws']['CloudWatchMetrics'][0]['Namespace'], 'Test')
+        self.assertEqual(document['_aws']['CloudWatchMetrics'][0]['Dimensions'], [['Request']])
+        self.assertEqual(sorted(metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']),
+                         ['Duration', 'S3KeySource.load', 'UserDAO.get_user'])
+        self.assertEqual(document['Request'], 'GetNextTrainIntent')
+        self.assertEqual(len(document['S3KeySource.load']), 1)
+        self.assertEqual(len(document['UserDAO.get_user']), 2)
+        self.assertGreaterEqual(document['Duration'], 0)
+
+    def test_invocation__not_sampled(self):
+        self.recorder.sample_rate = 0.2
+
+        with self.recorder.invocation('GetNextTrainIntent') as invocation:
+            result = _get_user()
+
+        self.assertIsNone(invocation)
+        self.assertEqual(result, 'user')
+        self.assertEqual(self.stream.getvalue(), '')
+
+    def test_invocation__disabled(self):
+        self.recorder = MetricsRecorder(sample_rate=0, stream=self.stream, sample=lambda: 0.0)
+
+        with self.recorder.invocation('GetNextTrainIntent') as invocation:
+            pass
+
+        self.assertIsNone(invocation)
+        self.assertEqual(self.stream.getvalue(), '')
+
+    def test_invocation__exception(self):
+        with self.assertRaises(RuntimeError):
+            with self.recorder.invocation('GetNextTrainIntent'):
+                _fail()
+
+        document = json.loads(self.stream.getvalue())
+        self.assertEqual(len(document['FiveElevenClient.get_real_time_stop_monitoring']), 1)
+
+    def test_invocation__span_on_other_thread(self):
+        with self.recorder.invocation('GetNextTrainIntent'):
+            thread = threading.Thread(target=_get_user)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(json.loads(self.stream.getvalue())['UserDAO.get_user']), 1)
+
+    def test_span__no_invocation(self):
+        with span('S3KeySource.load'):
+            result = _get_user()
+
+        self.assertEqual(result, 'user')
+        self.assertEqual(self.stream.getvalue(), '')
+
+    def test_timed(self):
+        self.assertEqual(_get_user.__name__, '_get_user')
+
+
+@timed('UserDAO.get_user')
+def _get_user():
+    return 'user'
+
+
+@timed('FiveElevenClient.get_real_time_stop_monitoring')
+def _fail():
+    raise RuntimeError()
@@ -0,0 +1,143 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from botocore.exceptions import ClientError
+
+from sftraintimes.patterns import FilePatternStore, LineTopology, PatternRecord, S3PatternStore
+from sftraintimes.tst.fakes import FakeS3Client
+
+
+class PatternRecordTest(TestCase):
+    def test_build(self):
+        first = PatternRecord.build('SF', 'N', [{'DirectionRef': 'IB', 'Name': 'Caltrain'}], 1541372400)
+        second = PatternRecord.build('SF', 'N', [{'Name': 'Caltrain', 'DirectionRef': 'IB'}], 1541376000)
+
+        self.assertEqual(len(first.version), 16)
+        self.assertEqual(first.version, second.version)
+
+    def test_build__changed_patterns(self):
+        first = PatternRecord.build('SF', 'N', [{'DirectionRef': 'IB'}], 1541372400)
+        second = PatternRecord.build('SF', 'N', [{'DirectionRef': 'OB'}], 1541372400)
+
+        self.assertNotEqual(first.version, second.version)
+
+    def test_from_bytes(self):
+        record = PatternRecord.build('SF', 'N', _get_line_patterns(), 1541372400)
+
+        result = PatternRecord.from_bytes(record.to_bytes())
+
+        self.assertEqual(result, record)
+
+
+class FilePatternStoreTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = FilePatternStore(os.path.join(self.directory.name, 'patterns'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load(self):
+        record = PatternRecord.build('SF', 'N', _get_line_patterns(), 1541372400)
+        self.store.save(record)
+
+        result = self.store.load('SF', 'N')
+
+        self.assertEqual(result, record)
+        self.assertIsNone(self.store.load('SF', 'KJ'))
+
+    def test_load__not_saved(self):
+        self.assertIsNone(self.store.load('SF', 'N'))
+
+
+class S3PatternStoreTest(TestCase):
+    def setUp(self):
+        self.s3_client = FakeS3Client()
+        self.store = S3PatternStore(self.s3_client, 'bucket')
+
+    def test_load(self):
+        record = PatternRecord.build('SF', 'N', _get_line_patterns(), 1541372400)
+        self.store.save(record)
+
+        result = self.store.load('SF', 'N')
+
+        self.assertEqual(result, record)
+        self.assertIn(('bucket', 'patterns/SF/N.json'), self.s3_client.objects)
+
+    def test_load__not_saved(self):
+        self.assertIsNone(self.store.load('SF', 'N'))
+
+    def test_load__access_denied(self):
+        self.store.s3_client.missing_key_code = 'AccessDenied'
+
+        with self.assertRaises(ClientError):
+            self.store.load('SF', 'N')
+
+
+class LineTopologyTest(TestCase):
+    def setUp(self):
+        self.topology = LineTopology.from_patterns(_get_line_patterns())
+
+    def test_from_patterns(self):
+        self.assertEqual(self.topology.sequences, {
+            'IB': [('1', '2', '3', '4', '5'), ('3', '4', '5')],
+            'OB': [('5', '4', '3', '2', '1')]
+        })
+
+    def test_serves_stop(self):
+        self.assertTrue(self.topology.serves_stop('3'))
+        self.assertTrue(self.topology.serves_stop('3', 'OB'))
+        self.assertFalse(self.topology.serves_stop('6'))
+        self.assertFalse(self.topology.serves_stop('3', 'XX'))
+
+    def test_get_stops_between(self):
+        self.assertEqual(self.topology.get_stops_between('1', '4'), ['2', '3'])
+        self.assertEqual(self.topology.get_stops_between('4', '1'), ['3', '2'])
+        self.assertEqual(self.topology.get_stops_between('3', '4'), [])
+
+    def test_get_stops_between__direction(self):
+        self.assertEqual(self.topology.get_stops_between('2', '5', 'IB'), ['3', '4'])
+        self.assertIsNone(self.topology.get_stops_between('2', '5', 'OB'))
+
+    def test_get_stops_between__not_served(self):
+        self.assertIsNone(self.topology.get_stops_between('1', '6'))
+
+
+def _get_line_patterns():
+    return [
+        {
+            'DirectionRef': 'IB',
+            'PointsInSequence': {
+                'StopPointInJourneyPattern': [
+                    {'Order': '2', 'Name': 'Stop 2', 'ScheduledStopPointRef': '2'},
+                    {'Order': '4', 'Name': 'Stop 4', 'ScheduledStopPointRef': '4'}
+                ],
+                'TimingPointInJourneyPattern': [
+                    {'Order': '1', 'Name': 'Stop 1', 'ScheduledStopPointRef': '1'},
+                    {'Order': '3', 'Name': 'Stop 3', 'ScheduledStopPointRef': '3'},
+                    {'Order': '5', 'Name': 'Stop 5', 'ScheduledStopPointRef': '5'}
+                ]
+            }
+        },
+        {
+            'DirectionRef': 'IB',
+            'PointsInSequence': {
+                'StopPointInJourneyPattern': [
+                    {'Name': 'Stop 3', 'ScheduledStopPointRef': '3'},
+                    {'Name': 'Stop 4', 'ScheduledStopPointRef': '4'},
+                    {'Name': 'Stop 5', 'ScheduledStopPointRef': '5'}
+                ]
+            }
+        },
+        {
+            'DirectionRef': 'OB',
+            'PointsInSequence': {
+                'StopPointInJourneyPattern': [
+                    {'Name': 'Stop {}'.format(stop_id), 'ScheduledStopPointRef': stop_id}
+                    for stop_id in ['5', '4', '3', '2', '1']
+                ],
+                'TimingPointInJourneyPattern': []
+            }
+        }
+    ]
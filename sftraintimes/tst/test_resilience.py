@@ -0,0 +1,172 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sftraintimes.resilience import CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceededError, call_hedged, \
+    current_deadline, deadline_scope
+
+
+class DeadlineTest(TestCase):
+    def setUp(self):
+        self.now = 100.0
+
+    def test_remaining(self):
+        deadline = Deadline(2, clock=lambda: self.now)
+        self.now += 0.5
+
+        self.assertEqual(deadline.remaining(), 1.5)
+        self.assertFalse(deadline.expired())
+
+    def test_remaining__passed(self):
+        deadline = Deadline(2, clock=lambda: self.now)
+        self.now += 3
+
+        self.assertEqual(deadline.remaining(), 0)
+        self.assertTrue(deadline.expired())
+
+    def test_from_context(self):
+        context = Mock(get_remaining_time_in_millis=Mock(return_value=1500))
+
+        result = Deadline.from_context(context, budget=4, reserve=0.5)
+
+        self.assertAlmostEqual(result.remaining(), 1.0, places=2)
+
+    def test_from_context__budget(self):
+        context = Mock(get_remaining_time_in_millis=Mock(return_value=60000))
+
+        result = Deadline.from_context(context, budget=4, reserve=0.5)
+
+        self.assertAlmostEqual(result.remaining(), 3.5, places=2)
+
+    def test_from_context__no_context(self):
+        self.assertAlmostEqual(Deadline.from_context(None, budget=4).remaining(), 4, places=2)
+
+    def test_deadline_scope(self):
+        deadline = Deadline(1)
+
+        with deadline_scope(deadline):
+            result = current_deadline()
+
+        self.assertIs(result, deadline)
+        self.assertIsNone(current_deadline())
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: self.now)
+
+    def test_call(self):
+        result = self.breaker.call(lambda: 'result')
+
+        self.assertEqual(result, 'result')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_call__opens_after_threshold(self):
+        func = Mock(side_effect=RuntimeError('511 is down'))
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                self.breaker.call(func)
+
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(func)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(func.call_count, 2)
+
+    def test_call__success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_allow__half_open_allows_one_trial(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+
+        first = self.breaker.allow()
+        second = self.breaker.allow()
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_record_success__trial_closes(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        self.breaker.allow()
+
+        self.breaker.record_success()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_record_failure__trial_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now += 30
+        self.breaker.allow()
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+
+class CallHedgedTest(TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_call_hedged__fast(self):
+        func = Mock(return_value='result')
+
+        result = call_hedged(func, self.executor, timeout=1, hedge_after=0.1)
+
+        self.assertEqual(result, 'result')
+        func.assert_called_once_with()
+
+    def test_call_hedged__hedge_wins(self):
+        delays = iter([0.5, 0])
+        func = Mock(side_effect=lambda: time.sleep(next(delays)) or 'result')
+
+        start = time.perf_counter()
+        result = call_hedged(func, self.executor, timeout=1, hedge_after=0.05)
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result, 'result')
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(func.call_count, 2)
+
+    def test_call_hedged__hedge_fails(self):
+        outcomes = iter([(0.2, 'result'), (0, RuntimeError('throttled'))])
+
+        def func():
+            delay, outcome = next(outcomes)
+            time.sleep(delay)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        result = call_hedged(func, self.executor, timeout=1, hedge_after=0.05)
+
+        self.assertEqual(result, 'result')
+
+    def test_call_hedged__error(self):
+        func = Mock(side_effect=RuntimeError('511 is down'))
+
+        with self.assertRaises(RuntimeError):
+            call_hedged(func, self.executor, timeout=1, hedge_after=0.1)
+        func.assert_called_once_with()
+
+    def test_call_hedged__timeout(self):
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceededError):
+            call_hedged(lambda: time.sleep(0.5), self.executor, timeout=0.1, hedge_after=0.05)
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 0.3)
@@ -0,0 +1,95 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from sftraintimes.router import IntentRouter
+
+
+class IntentRouterTest(TestCase):
+    SESSION = {'user': {'userId': 'userId'}}
+
+    def setUp(self):
+        self.mock_fallback = Mock(return_value='fallback')
+        self.router = IntentRouter(fallback=self.mock_fallback)
+
+    def test_dispatch(self):
+        mock_handler = Mock(return_value='response')
+        self.router.register(mock_handler, 'GetNextTrainIntent', 'AMAZON.RepeatIntent')
+        request = _get_intent_request('AMAZON.RepeatIntent')
+
+        result = self.router.dispatch(request, self.SESSION)
+
+        self.assertEqual(result, 'response')
+        mock_handler.assert_called_once_with(request, self.SESSION)
+        self.assertEqual(self.router.intent_names(), ['AMAZON.RepeatIntent', 'GetNextTrainIntent'])
+
+    def test_dispatch__decorated_handler(self):
+        @self.router.intent('AMAZON.HelpIntent')
+        def handle_help_intent(request, session):
+            return 'help'
+
+        self.assertEqual(self.router.dispatch(_get_intent_request('AMAZON.HelpIntent'), self.SESSION), 'help')
+        self.assertEqual(handle_help_intent(None, None), 'help')
+
+    def test_dispatch__unrecognized_intent(self):
+        request = _get_intent_request('UnknownIntent')
+
+        result = self.router.dispatch(request, self.SESSION)
+
+        self.assertEqual(result, 'fallback')
+        self.mock_fallback.assert_called_once_with(request, self.SESSION)
+
+    def test_dispatch__unrecognized_intent_without_fallback(self):
+        with self.assertRaises(ValueError):
+            IntentRouter().dispatch(_get_intent_request('UnknownIntent'), self.SESSION)
+
+    def test_register__no_intent_names(self):
+        with self.assertRaises(ValueError):
+            self.router.register(Mock())
+
+    def test_add_middleware(self):
+        calls = []
+
+        def outer(intent_name, request, session, call_next):
+            calls.append(('outer', intent_name))
+            return call_next(request, session) + '!'
+
+        def inner(intent_name, request, session, call_next):
+            calls.append(('inner', intent_name))
+            return call_next(request, session)
+
+        self.router.add_middleware(outer)
+        self.router.register(Mock(return_value='response'), 'GetNextTrainIntent')
+        self.router.add_middleware(inner, 'GetNextTrainIntent')
+
+        result = self.router.dispatch(_get_intent_request('GetNextTrainIntent'), self.SESSION)
+
+        self.assertEqual(result, 'response!')
+        self.assertEqual(calls, [('outer', 'GetNextTrainIntent'), ('inner', 'GetNextTrainIntent')])
+
+    def test_add_middleware__other_intent(self):
+        mock_middleware = Mock()
+        self.router.register(Mock(return_value='response'), 'GetNextTrainIntent')
+        self.router.add_middleware(mock_middleware, 'AMAZON.HelpIntent')
+
+        result = self.router.dispatch(_get_intent_request('GetNextTrainIntent'), self.SESSION)
+
+        self.assertEqual(result, 'response')
+        mock_middleware.assert_not_called()
+
+    def test_add_middleware__fallback(self):
+        intent_names = []
+
+        def middleware(intent_name, request, session, call_next):
+            intent_names.append(intent_name)
+            return call_next(request, session)
+
+        self.router.add_middleware(middleware)
+
+        result = self.router.dispatch(_get_intent_request('UnknownIntent'), self.SESSION)
+
+        self.assertEqual(result, 'fallback')
+        self.assertEqual(intent_names, [None])
+
+
+def _get_intent_request(intent_name):
+    return {'type': 'IntentRequest', 'intent': {'name': intent_name}}
@@ -0,0 +1,104 @@
+import calendar
+import os
+import tempfile
+from unittest import TestCase
+
+from sftraintimes.model import Arrival
+from sftraintimes.schedule import Schedule, compile_gtfs
+
+GTFS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'data', 'gtfs')
+
+
+class ScheduleTest(TestCase):
+    STOP_ID = '13996'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'schedule.bin')
+        compile_gtfs(GTFS_DIRECTORY, cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.schedule = Schedule.load(self.path)
+
+    def tearDown(self):
+        self.schedule.close()
+
+    def test_get_departures(self):
+        # Monday, November 5 2018 at 7:59 AM PST.
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 11, 5, 15, 59))
+
+        self.assertEqual(result, [
+            Arrival('N', 'IB', 'Caltrain', _to_epoch(2018, 11, 5, 16, 0), _to_epoch(2018, 11, 5, 16, 0), False),
+            Arrival('J', 'OB', 'Balboa Park Station', _to_epoch(2018, 11, 5, 16, 5), _to_epoch(2018, 11, 5, 16, 5),
+                    False),
+            Arrival('N', 'IB', 'Caltrain', _to_epoch(2018, 11, 5, 16, 10), _to_epoch(2018, 11, 5, 16, 10), False)
+        ])
+
+    def test_get_departures__limit(self):
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 11, 5, 16, 1), limit=1)
+
+        self.assertEqual([arrival.arrival_time for arrival in result], [_to_epoch(2018, 11, 5, 16, 5)])
+
+    def test_get_departures__inclusive(self):
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 11, 5, 16, 5), limit=1)
+
+        self.assertEqual(result[0].line, 'J')
+
+    def test_get_departures__after_midnight(self):
+        # Tuesday at 12:20 AM PST, still served by Monday's 24:30:00 trip.
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 11, 6, 8, 20), limit=1)
+
+        self.assertEqual([arrival.arrival_time for arrival in result], [_to_epoch(2018, 11, 6, 8, 30)])
+
+    def test_get_departures__next_service_day(self):
+        # Friday at 11 PM PST: the next departure is Saturday's 9 AM trip.
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 11, 10, 9, 0), limit=1)
+
+        self.assertEqual([arrival.arrival_time for arrival in result], [_to_epoch(2018, 11, 10, 17, 0)])
+
+    def test_get_departures__weekend(self):
+        # Saturday, November 10 2018 at 6 AM PST.
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 11, 10, 14, 0))
+
+        self.assertEqual([arrival.arrival_time for arrival in result],
+                         [_to_epoch(2018, 11, 10, 17, 0), _to_epoch(2018, 11, 11, 18, 0)])
+
+    def test_get_departures__calendar_date_exception(self):
+        # Thanksgiving, Thursday November 22 2018, runs the Sunday service.
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 11, 22, 14, 0), limit=1)
+
+        self.assertEqual([arrival.arrival_time for arrival in result], [_to_epoch(2018, 11, 22, 18, 0)])
+
+    def test_get_departures__daylight_saving_time(self):
+        # Monday, July 2 2018 at 7:59 AM PDT.
+        result = self.schedule.get_departures(self.STOP_ID, _to_epoch(2018, 7, 2, 14, 59), limit=1)
+
+        self.assertEqual([arrival.arrival_time for arrival in result], [_to_epoch(2018, 7, 2, 15, 0)])
+
+    def test_get_departures__stop_code(self):
+        result = self.schedule.get_departures('14449', _to_epoch(2018, 11, 5, 15, 0), limit=1)
+
+        self.assertEqual([arrival.arrival_time for arrival in result], [_to_epoch(2018, 11, 5, 15, 55)])
+
+    def test_get_departures__missing_stop(self):
+        self.assertEqual(self.schedule.get_departures('12345', _to_epoch(2018, 11, 5, 15, 59)), [])
+
+    def test_get_departures__outside_calendar(self):
+        self.assertEqual(self.schedule.get_departures(self.STOP_ID, _to_epoch(2020, 6, 1, 15, 0)), [])
+
+    def test_load__not_a_schedule(self):
+        with tempfile.NamedTemporaryFile(suffix='.bin') as schedule_file:
+            schedule_file.write(b'not a schedule')
+            schedule_file.flush()
+
+            with self.assertRaises(ValueError):
+                Schedule.load(schedule_file.name)
+
+
+def _to_epoch(year, month, day, hour, minute):
+    return calendar.timegm((year, month, day, hour, minute, 0))
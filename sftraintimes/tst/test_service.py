@@ -1,9 +1,20 @@
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 from unittest.mock import Mock
 
+from sftraintimes.cache import CacheEntry, TieredCache
 from sftraintimes.client import FiveElevenClient
 from sftraintimes.dao import UserDAO
+from sftraintimes.eta import EtaEngine
+from sftraintimes.feed import StopSnapshot
+from sftraintimes.model import Arrival, ArrivalSource, UpcomingArrivals
+from sftraintimes.patterns import FilePatternStore, PatternRecord, S3PatternStore
+from sftraintimes.resilience import CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceededError
 from sftraintimes.service import UserService, StopService, LineService
+from sftraintimes.tst.fakes import FakeS3Client
 
 
 class UserServiceTest(TestCase):
@@ -38,43 +49,476 @@ class UserServiceTest(TestCase):
 
         self.mock_dao.update_user.assert_called_with(self.USER_ID, **kwargs)
 
+    def test_upsert_user(self):
+        expected = (None, {'id': 'userId', 'homeStopId': 'stopId'})
+        self.mock_dao.upsert_user = Mock(return_value=expected)
+
+        result = self.user_service.upsert_user(self.USER_ID, homeStopId='stopId')
+
+        self.assertEqual(result, expected)
+        self.mock_dao.upsert_user.assert_called_with(self.USER_ID, homeStopId='stopId')
+
+    def test_get_popular_home_stop_ids(self):
+        users = [{'id': '1', 'homeStopId': 'a'}, {'id': '2', 'homeStopId': 'b'}, {'id': '3', 'homeStopId': 'b'},
+                 {'id': '4'}]
+        self.mock_dao.scan_users = Mock(return_value=iter(users))
+
+        result = self.user_service.get_popular_home_stop_ids(1)
+
+        self.assertEqual(result, ['b'])
+        self.mock_dao.scan_users.assert_called_with('homeStopId')
+
+    def test_batch_get_users(self):
+        self.mock_dao.batch_get_users = Mock(return_value=iter([self.USER]))
+
+        result = list(self.user_service.batch_get_users([self.USER_ID]))
+
+        self.assertEqual(result, [self.USER])
+        self.mock_dao.batch_get_users.assert_called_with([self.USER_ID])
+
+    def test_batch_write_users(self):
+        self.mock_dao.batch_write_users = Mock(return_value=1)
+
+        result = self.user_service.batch_write_users([self.USER])
+
+        self.assertEqual(result, 1)
+        self.mock_dao.batch_write_users.assert_called_with([self.USER])
+
 
 class StopServiceTest(TestCase):
     AGENCY = 'SF'
     STOP_ID = '12345'
+    FIRST_ARRIVAL = Arrival('J', 'OB', 'Balboa Park Station', 1541373000, 1541373000)
+    SECOND_ARRIVAL = Arrival('N', 'IB', 'Caltrain', 1541373600, 1541373600)
+    NOW = 1541372400
 
     def setUp(self):
         FiveElevenClient.__init__ = Mock(return_value=None)
         self.mock_client = FiveElevenClient('foo')
-        self.stop_service = StopService(self.mock_client)
-
-    def test_get_upcoming_visits(self):
         self.mock_client.get_real_time_stop_monitoring = Mock(return_value=_get_stop_monitoring_response())
-        expected = 'stopVisits'
+        self.now = self.NOW
+        self.stop_service = StopService(self.mock_client, clock=lambda: self.now)
 
-        result = self.stop_service.get_upcoming_visits(self.STOP_ID)
+    def test_get_upcoming_arrivals(self):
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
 
-        self.assertEqual(result, expected)
+        self.assertEqual(result, [self.FIRST_ARRIVAL, self.SECOND_ARRIVAL])
         self.mock_client.get_real_time_stop_monitoring.assert_called_with(self.AGENCY, self.STOP_ID)
 
-    def test_get_upcoming_visits__no_visits(self):
+    def test_get_upcoming_arrivals__no_visits(self):
         response_without_visits = _get_stop_monitoring_response()
         response_without_visits['ServiceDelivery']['StopMonitoringDelivery'].pop('MonitoredStopVisit')
         self.mock_client.get_real_time_stop_monitoring = Mock(return_value=response_without_visits)
 
         with self.assertRaises(KeyError):
-            self.stop_service.get_upcoming_visits(self.STOP_ID)
+            self.stop_service.get_upcoming_arrivals(self.STOP_ID)
         self.mock_client.get_real_time_stop_monitoring.assert_called_with(self.AGENCY, self.STOP_ID)
 
+    def test_get_upcoming_arrivals__cached(self):
+        self.stop_service.visit_cache = TieredCache()
+
+        first = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+        second = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(first, [self.FIRST_ARRIVAL, self.SECOND_ARRIVAL])
+        self.assertEqual(second, first)
+        self.mock_client.get_real_time_stop_monitoring.assert_called_once_with(self.AGENCY, self.STOP_ID)
+
+    def test_get_upcoming_arrivals__cached_arrival_departed(self):
+        self.stop_service.visit_cache = TieredCache()
+        self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+        self.now = self.FIRST_ARRIVAL.arrival_time + EtaEngine.DEFAULT_GRACE + 1
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, [self.SECOND_ARRIVAL])
+        self.mock_client.get_real_time_stop_monitoring.assert_called_once_with(self.AGENCY, self.STOP_ID)
+
+    def test_get_upcoming_arrivals__cached_arrivals_departed(self):
+        self.stop_service.visit_cache = TieredCache()
+        self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+        self.now = self.SECOND_ARRIVAL.arrival_time + EtaEngine.DEFAULT_GRACE + 1
+        self.mock_client.get_real_time_stop_monitoring = Mock(return_value=_get_stop_monitoring_response(
+            [_get_visit('N', 'IB', 'Caltrain', '2018-11-05T00:00:00Z')]))
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual([arrival.arrival_time for arrival in result], [1541376000])
+        self.mock_client.get_real_time_stop_monitoring.assert_called_once_with(self.AGENCY, self.STOP_ID)
+
+    def test_get_upcoming_arrivals__cached_no_arrivals(self):
+        self.stop_service.visit_cache = TieredCache(ttl=20, clock=lambda: self.now)
+        self.mock_client.get_real_time_stop_monitoring = Mock(return_value=_get_stop_monitoring_response([]))
+
+        results = [self.stop_service.get_upcoming_arrivals(self.STOP_ID) for _ in range(3)]
+        calls_within_ttl = self.mock_client.get_real_time_stop_monitoring.call_count
+        self.now += 20
+        self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(results, [[], [], []])
+        self.assertEqual(calls_within_ttl, 1)
+        self.assertEqual(self.mock_client.get_real_time_stop_monitoring.call_count, 2)
+
+    def test_get_upcoming_arrivals__smoothed_prediction(self):
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=[
+            _get_stop_monitoring_response([_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z',
+                                                      '2018-11-04T23:21:00Z', 'vehicle')]),
+            _get_stop_monitoring_response([_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z',
+                                                      '2018-11-04T23:22:00Z', 'vehicle')])
+        ])
+
+        first = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+        self.now += 30
+        second = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(first[0].arrival_time, 1541373660)
+        self.assertEqual(second[0].arrival_time, 1541373690)
+        self.assertTrue(second[0].realtime)
+
+    def test_get_upcoming_arrivals__shared_cache_entry(self):
+        shared = Mock()
+        shared.get = Mock(return_value=CacheEntry([list(self.FIRST_ARRIVAL)], time.time()))
+        self.stop_service.visit_cache = TieredCache(shared=shared)
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, [self.FIRST_ARRIVAL])
+        self.assertIsInstance(result[0], Arrival)
+        self.mock_client.get_real_time_stop_monitoring.assert_not_called()
+
+    def test_get_upcoming_arrivals__snapshot(self):
+        snapshot = StopSnapshot.build([
+            dict(_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z'), MonitoringRef=self.STOP_ID),
+            dict(_get_visit('J', 'OB', 'Balboa Park Station', '2018-11-04T22:50:00Z'), MonitoringRef=self.STOP_ID)
+        ], 1541372400)
+        self.stop_service = StopService(self.mock_client, snapshot_store=Mock(load=Mock(return_value=snapshot)),
+                                        clock=lambda: 1541372460)
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, [self.SECOND_ARRIVAL])
+        self.mock_client.get_real_time_stop_monitoring.assert_not_called()
+
+    def test_get_upcoming_arrivals__stale_snapshot(self):
+        snapshot = StopSnapshot.build([
+            dict(_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z'), MonitoringRef=self.STOP_ID)
+        ], 1541372400)
+        self.stop_service = StopService(self.mock_client, snapshot_store=Mock(load=Mock(return_value=snapshot)),
+                                        clock=lambda: 1541372400 + StopService.SNAPSHOT_MAX_AGE)
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, [self.FIRST_ARRIVAL, self.SECOND_ARRIVAL])
+        self.mock_client.get_real_time_stop_monitoring.assert_called_once_with(self.AGENCY, self.STOP_ID)
+
+    def test_get_upcoming_arrivals__snapshot_refreshed_in_background(self):
+        first = StopSnapshot.build([
+            dict(_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z'), MonitoringRef=self.STOP_ID)
+        ], self.NOW)
+        second = StopSnapshot.build([
+            dict(_get_visit('J', 'OB', 'Balboa Park Station', '2018-11-04T23:10:00Z'), MonitoringRef=self.STOP_ID)
+        ], self.NOW + StopService.SNAPSHOT_REFRESH_INTERVAL)
+        loaded = threading.Event()
+        snapshots = iter([first, second])
+        self.stop_service.snapshot_store = Mock(load=Mock(side_effect=lambda: loaded.wait(1) and next(snapshots)))
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.stop_service.executor.shutdown)
+        loaded.set()
+        self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+        loaded.clear()
+        self.now += StopService.SNAPSHOT_REFRESH_INTERVAL
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+        loaded.set()
+        self.stop_service._snapshot_executor.shutdown()
+
+        self.assertEqual(result, [self.SECOND_ARRIVAL])
+        self.assertEqual(self.stop_service._snapshot, second)
+        self.assertEqual(self.stop_service.snapshot_store.load.call_count, 2)
+        self.mock_client.get_real_time_stop_monitoring.assert_not_called()
+
+    def test_get_upcoming_arrivals__snapshot_loaded_while_executor_busy(self):
+        snapshot = StopSnapshot.build([
+            dict(_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z'), MonitoringRef=self.STOP_ID)
+        ], self.NOW)
+        self.stop_service.snapshot_store = Mock(load=Mock(return_value=snapshot))
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.stop_service.executor.shutdown)
+
+        futures = [self.stop_service.executor.submit(self.stop_service.get_upcoming_arrivals, self.STOP_ID)
+                   for _ in range(2)]
+        results = [future.result(timeout=1) for future in futures]
+
+        self.assertEqual(results, [[self.SECOND_ARRIVAL], [self.SECOND_ARRIVAL]])
+        self.stop_service.snapshot_store.load.assert_called_once_with()
+
+    def test_get_upcoming_arrivals__snapshot_load_fails(self):
+        snapshot = StopSnapshot.build([
+            dict(_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z'), MonitoringRef=self.STOP_ID)
+        ], self.NOW)
+        self.stop_service.snapshot_store = Mock(load=Mock(side_effect=[snapshot, RuntimeError('S3 is down')]))
+        self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+        self.now += StopService.SNAPSHOT_REFRESH_INTERVAL
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, [self.SECOND_ARRIVAL])
+        self.mock_client.get_real_time_stop_monitoring.assert_not_called()
+
+    def test_get_upcoming_arrivals__schedule_fallback(self):
+        departures = [Arrival('N', 'IB', 'Caltrain', 1541373600, 1541373600, False)]
+        self.stop_service.schedule = Mock(get_departures=Mock(return_value=departures))
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+
+        result = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, departures)
+        self.stop_service.schedule.get_departures.assert_called_once_with(self.STOP_ID, self.NOW,
+                                                                          StopService.SCHEDULE_DEPARTURE_COUNT)
+
+    def test_get_upcoming_arrivals__schedule_has_no_departures(self):
+        self.stop_service.schedule = Mock(get_departures=Mock(return_value=[]))
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+
+        with self.assertRaises(RuntimeError):
+            self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+    def test_get_upcoming_arrivals__no_schedule(self):
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+
+        with self.assertRaises(RuntimeError):
+            self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+    def test_lookup_upcoming_arrivals(self):
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, UpcomingArrivals([self.FIRST_ARRIVAL, self.SECOND_ARRIVAL], ArrivalSource.LIVE))
+
+    def test_lookup_upcoming_arrivals__stale_cache_entry(self):
+        self.stop_service.visit_cache = TieredCache(ttl=20, clock=lambda: self.now)
+        self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+        self.now += 30
+
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, UpcomingArrivals([self.FIRST_ARRIVAL, self.SECOND_ARRIVAL], ArrivalSource.STALE))
+        self.mock_client.get_real_time_stop_monitoring.assert_called_once_with(self.AGENCY, self.STOP_ID)
+
+    def test_lookup_upcoming_arrivals__stale_cache_entry_too_old(self):
+        self.stop_service.visit_cache = TieredCache(ttl=20, clock=lambda: self.now)
+        self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+        self.now += StopService.STALE_MAX_AGE
+
+        with self.assertRaises(RuntimeError):
+            self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+
+    def test_lookup_upcoming_arrivals__stale_snapshot(self):
+        snapshot = StopSnapshot.build([
+            dict(_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z'), MonitoringRef=self.STOP_ID)
+        ], self.NOW - StopService.SNAPSHOT_MAX_AGE)
+        self.stop_service.snapshot_store = Mock(load=Mock(return_value=snapshot))
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, UpcomingArrivals([self.SECOND_ARRIVAL], ArrivalSource.STALE))
+
+    def test_lookup_upcoming_arrivals__schedule_fallback(self):
+        departures = [Arrival('N', 'IB', 'Caltrain', 1541373600, 1541373600, False)]
+        self.stop_service.schedule = Mock(get_departures=Mock(return_value=departures))
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, UpcomingArrivals(departures, ArrivalSource.SCHEDULE))
+
+    def test_lookup_upcoming_arrivals__circuit_open(self):
+        self.stop_service.circuit_breaker = CircuitBreaker(failure_threshold=1)
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=RuntimeError('511 is down'))
+        with self.assertRaises(RuntimeError):
+            self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+
+        with self.assertRaises(CircuitOpenError):
+            self.stop_service.lookup_upcoming_arrivals(self.STOP_ID)
+        self.mock_client.get_real_time_stop_monitoring.assert_called_once_with(self.AGENCY, self.STOP_ID)
+
+    def test_lookup_upcoming_arrivals__hedged(self):
+        responses = iter([0.5, 0])
+
+        def get_real_time_stop_monitoring(agency, stop_id):
+            time.sleep(next(responses))
+            return _get_stop_monitoring_response()
+
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=get_real_time_stop_monitoring)
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=2)
+        self.stop_service.HEDGE_DELAY = 0.05
+        self.addCleanup(self.stop_service.executor.shutdown)
+
+        start = time.perf_counter()
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID, Deadline(2))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result, UpcomingArrivals([self.FIRST_ARRIVAL, self.SECOND_ARRIVAL], ArrivalSource.LIVE))
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(self.mock_client.get_real_time_stop_monitoring.call_count, 2)
+
+    def test_lookup_upcoming_arrivals__deadline_exceeded(self):
+        departures = [Arrival('N', 'IB', 'Caltrain', 1541373600, 1541373600, False)]
+        self.stop_service.schedule = Mock(get_departures=Mock(return_value=departures))
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=lambda *args: time.sleep(0.5))
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.stop_service.executor.shutdown)
+
+        start = time.perf_counter()
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID, Deadline(StopService.FALLBACK_RESERVE + 0.1))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result, UpcomingArrivals(departures, ArrivalSource.SCHEDULE))
+        self.assertLess(elapsed, 0.3)
+
+    def test_lookup_upcoming_arrivals__deadline_passed(self):
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.stop_service.executor.shutdown)
+
+        with self.assertRaises(DeadlineExceededError):
+            self.stop_service.lookup_upcoming_arrivals(self.STOP_ID, Deadline(0))
+        self.mock_client.get_real_time_stop_monitoring.assert_not_called()
+
+    def test_lookup_upcoming_arrivals__snapshot_load_bounded_by_deadline(self):
+        loaded = threading.Event()
+        self.stop_service.snapshot_store = Mock(load=Mock(side_effect=lambda: loaded.wait(1) and None))
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.stop_service.executor.shutdown)
+        self.addCleanup(loaded.set)
+
+        start = time.perf_counter()
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID, Deadline(StopService.FALLBACK_RESERVE + 0.2))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result, UpcomingArrivals([self.FIRST_ARRIVAL, self.SECOND_ARRIVAL], ArrivalSource.LIVE))
+        self.assertLess(elapsed, 0.3)
+
+    def test_lookup_upcoming_arrivals__snapshot_skipped_when_deadline_passed(self):
+        self.stop_service.snapshot_store = Mock(load=Mock(return_value=None))
+
+        result = self.stop_service.lookup_upcoming_arrivals(self.STOP_ID, Deadline(0))
+
+        self.assertEqual(result, UpcomingArrivals([self.FIRST_ARRIVAL, self.SECOND_ARRIVAL], ArrivalSource.LIVE))
+        self.stop_service.snapshot_store.load.assert_not_called()
+
+    def test_get_next_arrivals(self):
+        arrivals_by_stop = {
+            'a': [Arrival('N', 'IB', 'Caltrain', 100), Arrival('N', 'IB', 'Caltrain', 400)],
+            'b': [Arrival('J', 'IB', 'Embarcadero', 200), Arrival('J', 'OB', 'Balboa Park', 300)],
+            'c': [Arrival('KT', 'IB', 'Chinatown', 250)]
+        }
+        self.stop_service.get_upcoming_arrivals = Mock(side_effect=lambda stop_id, deadline: arrivals_by_stop[stop_id])
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            result = self.stop_service.get_next_arrivals(['a', 'b', 'c', 'a'], limit=4, executor=executor)
+
+        self.assertEqual([(stop_id, arrival.arrival_time) for stop_id, arrival in result],
+                         [('a', 100), ('b', 200), ('c', 250), ('b', 300)])
+        self.assertEqual(self.stop_service.get_upcoming_arrivals.call_count, 3)
+
+    def test_get_next_arrivals__deadline(self):
+        deadline = Deadline(2)
+        self.stop_service.get_upcoming_arrivals = Mock(return_value=[self.FIRST_ARRIVAL])
+
+        self.stop_service.get_next_arrivals(['a'], deadline=deadline)
+
+        self.stop_service.get_upcoming_arrivals.assert_called_once_with('a', deadline)
+
+    def test_get_next_arrivals__more_stops_than_workers(self):
+        stop_ids = ['a', 'b', 'c', 'd', 'e']
+        self.stop_service.snapshot_store = Mock(load=Mock(side_effect=lambda: time.sleep(0.1)))
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.stop_service.executor.shutdown)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            result = self.stop_service.get_next_arrivals(stop_ids, limit=5, executor=executor, deadline=Deadline(2))
+
+        self.assertEqual(len(result), 5)
+        self.assertEqual(self.mock_client.get_real_time_stop_monitoring.call_count, 5)
+        self.stop_service.snapshot_store.load.assert_called_once_with()
+
+    def test_get_next_arrivals__same_executor(self):
+        self.stop_service.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.stop_service.executor.shutdown)
+
+        with self.assertRaises(ValueError):
+            self.stop_service.get_next_arrivals(['a', 'b'], executor=self.stop_service.executor)
+
+    def test_get_next_arrivals__filters(self):
+        arrivals_by_stop = {
+            'a': [Arrival('N', 'IB', 'Caltrain', 100), Arrival('N', 'OB', 'Ocean Beach', 150)],
+            'b': [Arrival('J', 'IB', 'Embarcadero', 200), Arrival('N', 'IB', 'Caltrain', 300)]
+        }
+        self.stop_service.get_upcoming_arrivals = Mock(side_effect=lambda stop_id, deadline: arrivals_by_stop[stop_id])
+
+        result = self.stop_service.get_next_arrivals(['a', 'b'], line_ids={'N'}, directions={'IB'})
+
+        self.assertEqual([(stop_id, arrival.arrival_time) for stop_id, arrival in result], [('a', 100), ('b', 300)])
+
+    def test_get_next_arrivals__failed_stop(self):
+        self.stop_service.get_upcoming_arrivals = Mock(side_effect=[RuntimeError(), [self.FIRST_ARRIVAL]])
+
+        result = self.stop_service.get_next_arrivals(['a', 'b'])
+
+        self.assertEqual(result, [('b', self.FIRST_ARRIVAL)])
+
+    def test_get_next_arrivals__every_stop_failed(self):
+        self.stop_service.get_upcoming_arrivals = Mock(side_effect=RuntimeError())
+
+        with self.assertRaises(RuntimeError):
+            self.stop_service.get_next_arrivals(['a', 'b'])
+
+    def test_get_next_arrivals__no_stops(self):
+        self.assertEqual(self.stop_service.get_next_arrivals([]), [])
+
+    def test_prewarm_upcoming_arrivals(self):
+        self.stop_service.visit_cache = TieredCache()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            result = self.stop_service.prewarm_upcoming_arrivals([self.STOP_ID, '67890'], executor)
+        arrivals = self.stop_service.get_upcoming_arrivals(self.STOP_ID)
+
+        self.assertEqual(result, 2)
+        self.assertEqual(arrivals, [self.FIRST_ARRIVAL, self.SECOND_ARRIVAL])
+        self.assertEqual(self.mock_client.get_real_time_stop_monitoring.call_count, 2)
+
+    def test_prewarm_upcoming_arrivals__failed_stop(self):
+        self.stop_service.visit_cache = TieredCache()
+        self.mock_client.get_real_time_stop_monitoring = Mock(side_effect=[RuntimeError(),
+                                                                          _get_stop_monitoring_response()])
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            result = self.stop_service.prewarm_upcoming_arrivals([self.STOP_ID, '67890'], executor)
+
+        self.assertEqual(result, 1)
+
+    def test_prewarm_upcoming_arrivals__no_cache(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(ValueError):
+                self.stop_service.prewarm_upcoming_arrivals([self.STOP_ID], executor)
+
 
 class LineServiceTest(TestCase):
     AGENCY = 'SF'
     LINE_ID = 'J'
+    NOW = 1541372400
 
     def setUp(self):
         FiveElevenClient.__init__ = Mock(return_value=None)
         self.mock_client = FiveElevenClient('foo')
         self.line_service = LineService(self.mock_client)
+        self.now = self.NOW
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.pattern_store = FilePatternStore(self.directory.name)
+        self.stored_line_service = LineService(self.mock_client, self.pattern_store, clock=lambda: self.now)
 
     def test_get_patterns_for_line(self):
         five_eleven_response = {'journeyPatterns': 'journeyPatternsList'}
@@ -86,6 +530,116 @@ class LineServiceTest(TestCase):
         self.assertEqual(result, expected)
         self.mock_client.get_patterns_for_line.assert_called_with(self.AGENCY, self.LINE_ID)
 
+    def test_get_patterns_for_line__loaded(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+        self.line_service.get_patterns_for_line(self.LINE_ID)
+
+        result = self.line_service.get_patterns_for_line(self.LINE_ID)
+
+        self.assertEqual(result, _get_line_patterns())
+        self.mock_client.get_patterns_for_line.assert_called_once_with(self.AGENCY, self.LINE_ID)
+
+    def test_get_patterns_for_line__stored(self):
+        self.mock_client.get_patterns_for_line = Mock()
+        self.pattern_store.save(PatternRecord.build(self.AGENCY, self.LINE_ID, _get_line_patterns(), self.NOW))
+
+        result = self.stored_line_service.get_patterns_for_line(self.LINE_ID)
+
+        self.assertEqual(result, _get_line_patterns())
+        self.mock_client.get_patterns_for_line.assert_not_called()
+
+    def test_get_patterns_for_line__not_stored(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+
+        self.stored_line_service.get_patterns_for_line(self.LINE_ID)
+
+        self.assertEqual(self.pattern_store.load(self.AGENCY, self.LINE_ID).patterns, _get_line_patterns())
+
+    def test_get_patterns_for_line__expired(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+        self.stored_line_service.get_patterns_for_line(self.LINE_ID)
+        self.pattern_store.save(PatternRecord.build(self.AGENCY, self.LINE_ID, _get_line_patterns()[:1], self.NOW))
+        self.now += LineService.PATTERN_TTL
+
+        result = self.stored_line_service.get_patterns_for_line(self.LINE_ID)
+
+        self.assertEqual(result, _get_line_patterns()[:1])
+        self.mock_client.get_patterns_for_line.assert_called_once_with(self.AGENCY, self.LINE_ID)
+
+    def test_get_patterns_for_line__store_unavailable(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+        self.stored_line_service.get_patterns_for_line(self.LINE_ID)
+        self.pattern_store.load = Mock(side_effect=RuntimeError('S3 is down'))
+        self.now += LineService.PATTERN_TTL
+
+        result = self.stored_line_service.get_patterns_for_line(self.LINE_ID)
+
+        self.assertEqual(result, _get_line_patterns())
+        self.mock_client.get_patterns_for_line.assert_called_once_with(self.AGENCY, self.LINE_ID)
+
+    def test_get_patterns_for_line__store_access_denied(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+        s3_client = FakeS3Client(missing_key_code='AccessDenied')
+        s3_client.put_object = Mock(side_effect=RuntimeError('S3 is down'))
+        line_service = LineService(self.mock_client, S3PatternStore(s3_client, 'bucket'), clock=lambda: self.now)
+
+        result = line_service.get_patterns_for_line(self.LINE_ID)
+
+        self.assertEqual(result, _get_line_patterns())
+        self.mock_client.get_patterns_for_line.assert_called_once_with(self.AGENCY, self.LINE_ID)
+
+    def test_get_topology(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+
+        first = self.line_service.get_topology(self.LINE_ID)
+        second = self.line_service.get_topology(self.LINE_ID)
+
+        self.assertIs(first, second)
+        self.assertEqual(first.sequences, {'IB': [('13895', '13996')]})
+
+    def test_serves_stop(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+
+        self.assertTrue(self.line_service.serves_stop(self.LINE_ID, '13996'))
+        self.assertFalse(self.line_service.serves_stop(self.LINE_ID, '13996', 'OB'))
+
+    def test_get_stops_between(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+
+        self.assertEqual(self.line_service.get_stops_between(self.LINE_ID, '13895', '13996'), [])
+        self.assertIsNone(self.line_service.get_stops_between(self.LINE_ID, '13996', '13895'))
+
+    def test_refresh_patterns_for_line(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+        self.pattern_store.save(PatternRecord.build(self.AGENCY, self.LINE_ID, _get_line_patterns()[:0], self.NOW))
+
+        result = self.stored_line_service.refresh_patterns_for_line(self.LINE_ID)
+
+        self.assertTrue(result)
+        self.assertEqual(self.pattern_store.load(self.AGENCY, self.LINE_ID).patterns, _get_line_patterns())
+        self.assertEqual(self.stored_line_service.get_patterns_for_line(self.LINE_ID), _get_line_patterns())
+
+    def test_refresh_patterns_for_line__store_access_denied(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+        s3_client = FakeS3Client(missing_key_code='AccessDenied')
+        pattern_store = S3PatternStore(s3_client, 'bucket')
+        line_service = LineService(self.mock_client, pattern_store, clock=lambda: self.now)
+
+        result = line_service.refresh_patterns_for_line(self.LINE_ID)
+
+        self.assertTrue(result)
+        self.assertEqual(pattern_store.load(self.AGENCY, self.LINE_ID).patterns, _get_line_patterns())
+
+    def test_refresh_patterns_for_line__unchanged(self):
+        self.mock_client.get_patterns_for_line = Mock(return_value={'journeyPatterns': _get_line_patterns()})
+        self.pattern_store.save(PatternRecord.build(self.AGENCY, self.LINE_ID, _get_line_patterns(), self.NOW))
+        self.pattern_store.save = Mock()
+
+        result = self.stored_line_service.refresh_patterns_for_line(self.LINE_ID)
+
+        self.assertFalse(result)
+        self.pattern_store.save.assert_not_called()
+
     def test_get_patterns_for_line__no_patterns(self):
         five_eleven_response = {}
         self.mock_client.get_patterns_for_line = Mock(return_value=five_eleven_response)
@@ -95,11 +649,40 @@ class LineServiceTest(TestCase):
         self.mock_client.get_patterns_for_line.assert_called_with(self.AGENCY, self.LINE_ID)
 
 
-def _get_stop_monitoring_response():
+def _get_line_patterns():
+    return [
+        {
+            'DirectionRef': 'IB',
+            'PointsInSequence': {
+                'StopPointInJourneyPattern': [
+                    {'Name': 'Church St & 18th St', 'ScheduledStopPointRef': '13895'},
+                    {'Name': 'Church St & 24th St', 'ScheduledStopPointRef': '13996'}
+                ]
+            }
+        }
+    ]
+
+
+def _get_stop_monitoring_response(visits=None):
+    if visits is None:
+        visits = [_get_visit('N', 'IB', 'Caltrain', '2018-11-04T23:20:00Z'),
+                  _get_visit('J', 'OB', 'Balboa Park Station', '2018-11-04T23:10:00Z')]
     return {
         'ServiceDelivery': {
             'StopMonitoringDelivery': {
-                'MonitoredStopVisit': 'stopVisits'
+                'MonitoredStopVisit': visits
             }
         }
     }
+
+
+def _get_visit(line_id, direction, destination, arrival_time, expected_arrival_time=None, vehicle=None):
+    return {
+        'MonitoredVehicleJourney': {
+            'LineRef': line_id,
+            'DirectionRef': direction,
+            'DestinationName': destination,
+            'VehicleRef': vehicle,
+            'MonitoredCall': {'AimedArrivalTime': arrival_time, 'ExpectedArrivalTime': expected_arrival_time}
+        }
+    }
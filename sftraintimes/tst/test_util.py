@@ -0,0 +1,101 @@
+import calendar
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from sftraintimes.util import ResponseBuilder, StaticResponse, normalize_street_name, parse_datetime, parse_epoch, \
+    parse_epochs
+
+
+class StaticResponseTest(TestCase):
+    def test_build(self):
+        response = StaticResponse('Hello.')
+        attributes = {'user': {'id': 'userId'}}
+
+        self.assertEqual(response.build(), ResponseBuilder(output_speech_text='Hello.').build())
+        self.assertEqual(response.build(attributes),
+                         ResponseBuilder(output_speech_text='Hello.', session_attributes=attributes).build())
+
+    def test_build__separate_session_attributes(self):
+        response = StaticResponse('Hello.')
+
+        first = response.build()
+        first['sessionAttributes']['user'] = {'id': 'userId'}
+
+        self.assertEqual(response.build()['sessionAttributes'], {})
+
+
+class NormalizeStreetNameTest(TestCase):
+    def test_normalize_street_name(self):
+        self.assertEqual(normalize_street_name('church street'), 'church st')
+        self.assertEqual(normalize_street_name('ocean avenue'), 'ocean ave')
+        self.assertEqual(normalize_street_name('sunset boulevard'), 'sunset blvd')
+        self.assertEqual(normalize_street_name('san jose drive'), 'san jose dr')
+
+    def test_normalize_street_name__suffix_variants(self):
+        self.assertEqual(normalize_street_name('Clipper Terr.'), 'clipper ter')
+        self.assertEqual(normalize_street_name('Stanyan Str'), 'stanyan st')
+        self.assertEqual(normalize_street_name('Great Hwy'), 'great hwy')
+        self.assertEqual(normalize_street_name('Great Highway'), 'great hwy')
+
+    def test_normalize_street_name__ordinals(self):
+        self.assertEqual(normalize_street_name('sixteenth street'), '16th st')
+        self.assertEqual(normalize_street_name('twenty-fourth street'), '24th st')
+        self.assertEqual(normalize_street_name('Forty Eighth Avenue'), '48th ave')
+        self.assertEqual(normalize_street_name('third street'), '3rd st')
+        self.assertEqual(normalize_street_name('23 street'), '23rd st')
+        self.assertEqual(normalize_street_name('11th st'), '11th st')
+
+    def test_normalize_street_name__directionals(self):
+        self.assertEqual(normalize_street_name('West Portal Avenue'), normalize_street_name('W Portal Ave'))
+
+    def test_normalize_street_name__intersections(self):
+        self.assertEqual(normalize_street_name('Church St & 24th St'), 'church st & 24th st')
+        self.assertEqual(normalize_street_name('church street and twenty fourth street'), 'church st & 24th st')
+        self.assertEqual(normalize_street_name('  Church St&24th   St '), 'church st & 24th st')
+
+    def test_normalize_street_name__every_suffix_family_in_one_pass(self):
+        self.assertEqual(normalize_street_name('ocean avenue and geneva avenue'), 'ocean ave & geneva ave')
+        self.assertEqual(normalize_street_name('market street and castro street'), 'market st & castro st')
+
+    def test_normalize_street_name__unknown_words_kept(self):
+        self.assertEqual(normalize_street_name('the embarcadero'), 'the embarcadero')
+
+
+class ParseEpochTest(TestCase):
+    EPOCH = calendar.timegm((2018, 11, 4, 23, 5, 21))
+
+    def test_parse_epoch(self):
+        self.assertEqual(parse_epoch('2018-11-04T23:05:21Z'), self.EPOCH)
+        self.assertEqual(parse_epoch('2018-11-04T23:05:21'), self.EPOCH)
+        self.assertEqual(parse_epoch('2018-11-04T23:05:21.750Z'), self.EPOCH)
+
+    def test_parse_epoch__offset(self):
+        self.assertEqual(parse_epoch('2018-11-04T15:05:21-08:00'), self.EPOCH)
+        self.assertEqual(parse_epoch('2018-11-05T00:35:21+0130'), self.EPOCH)
+
+    def test_parse_epoch__leap_day_and_year_boundary(self):
+        self.assertEqual(parse_epoch('2020-02-29T00:00:00Z'), calendar.timegm((2020, 2, 29, 0, 0, 0)))
+        self.assertEqual(parse_epoch('2018-12-31T23:59:59Z'), calendar.timegm((2018, 12, 31, 23, 59, 59)))
+        self.assertEqual(parse_epoch('1970-01-01T00:00:00Z'), 0)
+
+    def test_parse_epoch__invalid(self):
+        with self.assertRaises(ValueError):
+            parse_epoch('2018-11-04')
+
+    def test_parse_epochs(self):
+        result = parse_epochs(['2018-11-04T23:05:21Z', None, '2018-11-04T15:05:21-08:00', '', '2018-11-04T23:05:21Z'])
+
+        self.assertEqual(result, [self.EPOCH, None, self.EPOCH, None, self.EPOCH])
+
+    def test_parse_datetime(self):
+        result = parse_datetime('2018-11-04T15:05:21-08:00')
+
+        self.assertEqual(result, datetime(2018, 11, 4, 23, 5, 21, tzinfo=timezone.utc))
+        self.assertEqual(result.utcoffset(), timedelta(hours=-8))
+        self.assertEqual(result.hour, 15)
+
+    def test_parse_datetime__utc(self):
+        result = parse_datetime('2018-11-04T23:05:21Z')
+
+        self.assertEqual(result, datetime(2018, 11, 4, 23, 5, 21, tzinfo=timezone.utc))
+        self.assertEqual(result.tzinfo, timezone.utc)
@@ -1,4 +1,175 @@
-from datetime import datetime
+import importlib
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+# USPS Publication 28, Appendix C1: standard suffix abbreviation followed by the names and variants that map to it.
+STREET_SUFFIXES = {
+    'aly': 'alley allee ally aly',
+    'anx': 'annex anex annx anx',
+    'arc': 'arcade arc',
+    'ave': 'avenue av aven avenu avn avnue ave',
+    'byu': 'bayou bayoo byu',
+    'bch': 'beach bch',
+    'bnd': 'bend bnd',
+    'blf': 'bluff bluf blf',
+    'btm': 'bottom bot bottm btm',
+    'blvd': 'boulevard boul boulv blvd',
+    'br': 'branch brnch br',
+    'brg': 'bridge brdge brg',
+    'brk': 'brook brk',
+    'byp': 'bypass bypa bypas byps byp',
+    'cp': 'camp cmp cp',
+    'cyn': 'canyon canyn cnyn cyn',
+    'cpe': 'cape cpe',
+    'cswy': 'causeway causwa cswy',
+    'ctr': 'center cen cent centr centre cnter cntr ctr',
+    'cir': 'circle circ circl crcl crcle cir',
+    'clf': 'cliff clf',
+    'clb': 'club clb',
+    'cmn': 'common cmn',
+    'cor': 'corner cor',
+    'crse': 'course crse',
+    'ct': 'court ct',
+    'cv': 'cove cv',
+    'crk': 'creek crk',
+    'cres': 'crescent crsent crsnt cres',
+    'xing': 'crossing crssng xing',
+    'dl': 'dale dl',
+    'dm': 'dam dm',
+    'dv': 'divide div dvd dv',
+    'dr': 'drive driv drv dr',
+    'est': 'estate est',
+    'expy': 'expressway exp expr express expw expy',
+    'ext': 'extension extn extnsn ext',
+    'fls': 'falls fls',
+    'fry': 'ferry frry fry',
+    'fld': 'field fld',
+    'flds': 'fields flds',
+    'flt': 'flat flt',
+    'frd': 'ford frd',
+    'frst': 'forest forests frst',
+    'frg': 'forge forg frg',
+    'frk': 'fork frk',
+    'ft': 'fort frt ft',
+    'fwy': 'freeway freewy frway frwy fwy',
+    'gdn': 'garden gardn grden grdn gdn',
+    'gdns': 'gardens grdns gdns',
+    'gtwy': 'gateway gatewy gatway gtway gtwy',
+    'gln': 'glen gln',
+    'grn': 'green grn',
+    'grv': 'grove grov grv',
+    'hbr': 'harbor harb harbr hrbor hbr',
+    'hvn': 'haven hvn',
+    'hts': 'heights ht hts',
+    'hwy': 'highway highwy hiway hiwy hway hwy',
+    'hl': 'hill hl',
+    'hls': 'hills hls',
+    'holw': 'hollow hllw hollows holws holw',
+    'is': 'island islnd is',
+    'jct': 'junction jction jctn junctn juncton jct',
+    'ky': 'key ky',
+    'knl': 'knoll knol knl',
+    'lk': 'lake lk',
+    'lndg': 'landing lndng lndg',
+    'ln': 'lane ln',
+    'lgt': 'light lgt',
+    'lck': 'lock lck',
+    'ldg': 'lodge ldge lodg ldg',
+    'loop': 'loop loops',
+    'mall': 'mall',
+    'mnr': 'manor mnr',
+    'mdw': 'meadow mdw',
+    'mdws': 'meadows medows mdws',
+    'ml': 'mill ml',
+    'msn': 'mission missn mssn msn',
+    'mtwy': 'motorway mtwy',
+    'mt': 'mount mnt mt',
+    'mtn': 'mountain mntain mntn mountin mtin mtn',
+    'nck': 'neck nck',
+    'orch': 'orchard orchrd orch',
+    'oval': 'oval ovl',
+    'park': 'park prk parks',
+    'pkwy': 'parkway parkwy pkway pky parkways pkwys pkwy',
+    'pass': 'pass',
+    'path': 'path paths',
+    'pike': 'pike pikes',
+    'pne': 'pine pne',
+    'pl': 'place pl',
+    'pln': 'plain pln',
+    'plz': 'plaza plza plz',
+    'pt': 'point pt',
+    'prt': 'port prt',
+    'pr': 'prairie prr pr',
+    'radl': 'radial rad radiel radl',
+    'rnch': 'ranch ranches rnchs rnch',
+    'rpd': 'rapid rpd',
+    'rst': 'rest rst',
+    'rdg': 'ridge rdge rdg',
+    'riv': 'river rvr rivr riv',
+    'rd': 'road rd',
+    'rds': 'roads rds',
+    'rte': 'route rte',
+    'row': 'row',
+    'run': 'run',
+    'shl': 'shoal shl',
+    'shr': 'shore shoar shr',
+    'skwy': 'skyway skwy',
+    'spg': 'spring spng sprng spg',
+    'sq': 'square sqr sqre squ sq',
+    'sta': 'station statn stn sta',
+    'st': 'street strt str st saint',
+    'sts': 'streets sts',
+    'smt': 'summit sumit sumitt smt',
+    'ter': 'terrace terr ter',
+    'trce': 'trace traces trce',
+    'trak': 'track tracks trk trks trak',
+    'trl': 'trail trails trls trl',
+    'tunl': 'tunnel tunel tunls tunnels tunnl tunl',
+    'tpke': 'turnpike trnpk turnpk tpke',
+    'un': 'union un',
+    'vly': 'valley vally vlly vly',
+    'via': 'viaduct vdct viadct via',
+    'vw': 'view vw',
+    'vlg': 'village vill villag villg villiage vlg',
+    'vis': 'vista vist vst vsta vis',
+    'walk': 'walk walks',
+    'way': 'way wy',
+    'wls': 'wells wls'
+}
+DIRECTIONALS = {
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw'
+}
+CONJUNCTIONS = {'and': '&', 'at': '&'}
+_ISO_DATE_PATTERN = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.\d+)?(?:Z|([+-])(\d{2}):?(\d{2}))?$')
+_UNIT_ORDINALS = ['first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth']
+_TEEN_ORDINALS = ['tenth', 'eleventh', 'twelfth', 'thirteenth', 'fourteenth', 'fifteenth', 'sixteenth',
+                  'seventeenth', 'eighteenth', 'nineteenth']
+_TENS = ['twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+_TENS_ORDINALS = ['twentieth', 'thirtieth', 'fortieth', 'fiftieth', 'sixtieth', 'seventieth', 'eightieth',
+                  'ninetieth']
+
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported the first time one of its attributes is used, so importing the Lambda
+    entry point does not pay for boto3 or urllib3 on requests that never touch AWS or 511.
+    """
+    def __init__(self, name):
+        """
+        Constructs a new LazyModule instance.
+        :param name: The absolute name of the module to import, ex: 'boto3'.
+        """
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attribute)
 
 
 class ResponseBuilder:
@@ -7,16 +178,21 @@ class ResponseBuilder:
     OUTPUT_SPEECH_TYPE = 'PlainText'
     CARD_TYPE = 'Simple'
 
-    def __init__(self, output_speech_text=None):
-        """Constructs an instance of this builder."""
+    def __init__(self, output_speech_text=None, session_attributes=None):
+        """
+        Constructs an instance of this builder.
+        :param output_speech_text: The text Alexa should speak.
+        :param session_attributes: A dict of attributes Alexa should send back with the next request in the session.
+        """
         self.output_speech_text = output_speech_text
+        self.session_attributes = session_attributes
 
     def build(self):
         """
         Builds the response dict.
         :return: A dict containing the outputSpeech and/or card provided to the builder, formatted as an Alexa response.
         """
-        response = {'version': self.VERSION, 'response': {}, 'sessionAttributes': {}}
+        response = {'version': self.VERSION, 'response': {}, 'sessionAttributes': self.session_attributes or {}}
 
         if self.output_speech_text:
             response['response']['outputSpeech'] = {
@@ -27,29 +203,143 @@ class ResponseBuilder:
         return response
 
 
+class StaticResponse:
+    """
+    An Alexa response whose speech never changes. It is built once, and each request gets a shallow copy carrying its
+    own session attributes, so the shared parts must be treated as read-only.
+    """
+    def __init__(self, output_speech_text):
+        """
+        Constructs a new StaticResponse instance.
+        :param output_speech_text: The text Alexa should speak.
+        """
+        self._response = ResponseBuilder(output_speech_text=output_speech_text).build()
+
+    def build(self, session_attributes=None):
+        """
+        Builds the response dict.
+        :param session_attributes: A dict of attributes Alexa should send back with the next request in the session.
+        :return: A dict formatted as an Alexa response, equal to what ResponseBuilder would build for the same speech.
+        """
+        return dict(self._response, sessionAttributes=session_attributes or {})
+
+
 def parse_datetime(iso_date):
-    year = int(iso_date[:4])
-    month = int(iso_date[5:7])
-    day = int(iso_date[8:10])
-    hour = int(iso_date[11:13])
-    minute = int(iso_date[14:16])
-    second = int(iso_date[17:19])
-
-    return datetime(year, month, day, hour, minute, second)
-
-
-def parse_street(literal_street):
-    """
-    Parses an AMAZON.StreetName slot from Alexa into a street name matching SFMTA formats. Example: 'market street' ->
-    'market st', 'ocean avenue' -> 'ocean ave'
-    :param literal_street: The street name as received from Alexa.
-    :return: The street name formatted for matching against SFMTA stops.
-    """
-    if 'street' in literal_street:
-        return literal_street.replace('street', 'st')
-    if 'avenue' in literal_street:
-        return literal_street.replace('avenue', 'ave')
-    if 'boulevard' in literal_street:
-        return literal_street.replace('boulevard', 'blvd')
-    if 'drive' in literal_street:
-        return literal_street.replace('drive', 'dr')
+    """
+    Parses an ISO 8601 timestamp, keeping its UTC offset.
+    :param iso_date: The timestamp (ex: '2018-11-04T15:05:21-08:00'). Timestamps without an offset are taken to be UTC.
+    :return: A timezone-aware datetime.
+    """
+    epoch, offset = _parse_iso_date(iso_date)
+    zone = timezone.utc if offset == 0 else timezone(timedelta(seconds=offset))
+
+    return datetime.fromtimestamp(epoch, zone)
+
+
+def parse_epoch(iso_date):
+    """
+    Converts an ISO 8601 timestamp to epoch seconds without building a datetime. Fractional seconds are truncated.
+    Results are memoized, since the timestamps in a feed repeat heavily.
+    :param iso_date: The timestamp (ex: '2018-11-04T23:05:21Z' or '2018-11-04T15:05:21-08:00'). Timestamps without an
+                     offset are taken to be UTC.
+    :return: The number of seconds since the epoch, as an int.
+    """
+    return _parse_epoch(iso_date)
+
+
+def parse_epochs(iso_dates):
+    """
+    Converts a column of ISO 8601 timestamps, such as every AimedArrivalTime in a feed, to epoch seconds. Arrival
+    times in a feed fall within the next hour or so, so they share one memo of a few thousand distinct values across
+    calls and each is parsed once.
+    :param iso_dates: An iterable of timestamps. None or empty values are allowed.
+    :return: A list of epoch seconds, with None wherever the input was None or empty.
+    """
+    parse = _parse_epoch
+    return [parse(iso_date) if iso_date else None for iso_date in iso_dates]
+
+
+def normalize_street_name(street_name):
+    """
+    Normalizes a street name or intersection so that names from Alexa and from SFMTA compare equal. Every token is
+    rewritten in a single pass: street suffixes and their variants become USPS abbreviations, spelled-out and numeric
+    ordinals become '16th' style ordinals, directionals are abbreviated and 'and' becomes '&'. Example: 'Church Street
+    and Sixteenth Avenue' -> 'church st & 16th ave'. Results are memoized.
+    :param street_name: The street name or intersection, as received from Alexa or as named by SFMTA.
+    :return: The normalized name.
+    """
+    return _normalize_street_name(street_name)
+
+
+@lru_cache(maxsize=4096)
+def _normalize_street_name(street_name):
+    tokens = []
+    for match in _STREET_TOKEN_PATTERN.finditer(street_name.lower().replace("'", '')):
+        compound_ordinal, number, word = match.groups()
+        if word is not None:
+            tokens.append(_STREET_TOKEN_REPLACEMENTS.get(word, word))
+        elif number is not None:
+            tokens.append(_to_ordinal(int(number)))
+        else:
+            tokens.append(_STREET_TOKEN_REPLACEMENTS[compound_ordinal.replace('-', ' ')])
+
+    return ' '.join(tokens)
+
+
+@lru_cache(maxsize=8192)
+def _parse_epoch(iso_date):
+    return _parse_iso_date(iso_date)[0]
+
+
+def _parse_iso_date(iso_date):
+    match = _ISO_DATE_PATTERN.match(iso_date)
+    if match is None:
+        raise ValueError('Invalid ISO 8601 timestamp: {}'.format(iso_date))
+
+    year, month, day, hour, minute, second, sign, offset_hours, offset_minutes = match.groups()
+    epoch = _days_from_civil(int(year), int(month), int(day)) * 86400 + int(hour) * 3600 + int(minute) * 60 + \
+        int(second)
+    if sign is None:
+        return epoch, 0
+
+    offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+    if sign == '-':
+        offset = -offset
+    return epoch - offset, offset
+
+
+def _days_from_civil(year, month, day):
+    # Howard Hinnant's days_from_civil: days since 1970-01-01 in the proleptic Gregorian calendar.
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def _to_ordinal(number):
+    if 10 <= number % 100 <= 20:
+        return '{}th'.format(number)
+    return '{}{}'.format(number, {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th'))
+
+
+def _build_street_token_replacements():
+    replacements = {}
+    for abbreviation, variants in STREET_SUFFIXES.items():
+        for variant in variants.split():
+            replacements[variant] = abbreviation
+    replacements.update(DIRECTIONALS)
+    replacements.update(CONJUNCTIONS)
+    for number, word in enumerate(_UNIT_ORDINALS + _TEEN_ORDINALS, 1):
+        replacements[word] = _to_ordinal(number)
+    for tens, (tens_word, tens_ordinal) in enumerate(zip(_TENS, _TENS_ORDINALS), 2):
+        replacements[tens_ordinal] = _to_ordinal(tens * 10)
+        for unit, unit_ordinal in enumerate(_UNIT_ORDINALS, 1):
+            replacements['{} {}'.format(tens_word, unit_ordinal)] = _to_ordinal(tens * 10 + unit)
+    return replacements
+
+
+_STREET_TOKEN_REPLACEMENTS = _build_street_token_replacements()
+_STREET_TOKEN_PATTERN = re.compile(r'\b((?:{})[- ](?:{}))\b|\b(\d+)(?:st|nd|rd|th)?\b|([a-z0-9]+|&)'.format(
+    '|'.join(_TENS), '|'.join(_UNIT_ORDINALS)))